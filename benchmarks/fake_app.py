@@ -0,0 +1,6 @@
+# The API with the fake Earth Engine client: gunicorn -c gunicorn.conf.py benchmarks.fake_app:app
+from benchmarks import fake_ee
+
+fake_ee.install()
+
+from main import app  # noqa: E402
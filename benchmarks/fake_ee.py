@@ -0,0 +1,80 @@
+# A stand-in for the earthengine-api client, for load tests without Earth Engine credentials or quota.
+# Every ee.* call builds a chainable object; getInfo() waits EE_FAKE_LATENCY seconds for the "network", then holds
+# the GIL for EE_FAKE_GIL_SECONDS, like the client's own Python work (request serialization, response parsing),
+# and answers from the last method in the chain. It covers the /ndvi_trend path and /health-type routes.
+import ctypes
+import os
+import sys
+import time
+import types
+from datetime import date, timedelta
+
+LATENCY = float(os.getenv('EE_FAKE_LATENCY', '0.2'))
+GIL_SECONDS = float(os.getenv('EE_FAKE_GIL_SECONDS', '0.02'))
+SERIES_LENGTH = int(os.getenv('EE_FAKE_SERIES_LENGTH', '46'))
+
+# Functions called through PyDLL keep the GIL, so this blocks every thread of the worker without using a core,
+# and the benchmark shows the per-process limit even on a host with fewer cores than workers
+_usleep_holding_gil = ctypes.PyDLL(None).usleep
+
+
+def _series():
+    start = date(2023, 1, 1)
+    dates = [(start + timedelta(days=8 * i)).isoformat() for i in range(SERIES_LENGTH)]
+    ndvi = [0.3 + 0.4 * (i % 23) / 23 for i in range(SERIES_LENGTH)]
+    return dates, ndvi
+
+
+class FakeComputedObject:
+    def __init__(self, last_call=None):
+        self._last_call = last_call
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return FakeComputedObject(name)
+        return method
+
+    def __call__(self, *args, **kwargs):
+        return FakeComputedObject(self._last_call)
+
+    def serialize(self):
+        return repr(id(self))
+
+    def getInfo(self):
+        time.sleep(LATENCY)
+        _usleep_holding_gil(int(GIL_SECONDS * 1e6))
+        dates, ndvi = _series()
+        if self._last_call == 'size':
+            return SERIES_LENGTH
+        if self._last_call == 'get':
+            return [dates, ndvi]
+        if self._last_call == 'map':
+            return {'features': [{'properties': {'date': d, 'ndvi': v}} for d, v in zip(dates, ndvi)]}
+        return {}
+
+
+class EEException(Exception):
+    pass
+
+
+class _FakeEE(types.ModuleType):
+    EEException = EEException
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return FakeComputedObject(name)
+
+    def Initialize(self, *args, **kwargs):
+        time.sleep(LATENCY)
+
+    def ServiceAccountCredentials(self, *args, **kwargs):
+        return None
+
+
+def install():
+    # lazy_import('ee') returns whatever is already in sys.modules, so this must run before the app is imported
+    sys.modules['ee'] = _FakeEE('ee')
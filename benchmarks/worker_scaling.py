@@ -0,0 +1,119 @@
+# Throughput of /ndvi_trend against the fake Earth Engine client, for increasing gunicorn worker counts.
+#
+#   python -m benchmarks.worker_scaling --workers 1 2 4 --concurrency 32 --duration 20 --latency 0.1 --gil 0.02
+#
+# Each worker count gets a fresh data directory and gunicorn process (gunicorn.conf.py, benchmarks.fake_app:app).
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np
+
+AOI = {
+    "type": "geojson",
+    "data": {
+        "type": "Feature",
+        "properties": {},
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[-95.5, 42.5], [-95.5, 42.7], [-95.3, 42.7], [-95.3, 42.5], [-95.5, 42.5]]]
+        }
+    }
+}
+PATH = "/ndvi_trend?start_date=2023-01-01&end_date=2023-12-31"
+
+
+def start_server(workers: int, port: int, data_dir: str, latency: float, gil_seconds: float) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(workers),
+        BIND=f"127.0.0.1:{port}",
+        FARM_API_DATA_DIR=data_dir,
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(data_dir, 'prometheus'),
+        FIELD_SCHEDULER_ENABLED='0',
+        EE_FAKE_LATENCY=str(latency),
+        EE_FAKE_GIL_SECONDS=str(gil_seconds),
+    )
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'benchmarks.fake_app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(base_url: str, workers: int, timeout: float = 60):
+    # /ready is answered by whichever worker accepts the connection, so wait for a run of ready answers
+    deadline = time.monotonic() + timeout
+    ready_answers = 0
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/ready") as response:
+                    ready_answers = ready_answers + 1 if response.status == 200 else 0
+            except aiohttp.ClientError:
+                ready_answers = 0
+            if ready_answers >= 4 * workers:
+                return
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+
+async def run_load(base_url: str, concurrency: int, duration: float):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def client(session):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            async with session.post(f"{base_url}{PATH}", json=AOI) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+                    continue
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+        started = time.monotonic()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return np.array(latencies), errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/ndvi_trend throughput by gunicorn worker count, against the fake Earth Engine client")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds each fake getInfo() waits with the GIL released")
+    parser.add_argument('--gil', type=float, default=0.02, help="Seconds each fake getInfo() then holds the GIL")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"POST {PATH}  concurrency={args.concurrency}  duration={args.duration}s  fake EE latency={args.latency}s gil={args.gil}s")
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as data_dir:
+            server = start_server(workers, args.port, data_dir, args.latency, args.gil)
+            base_url = f"http://127.0.0.1:{args.port}"
+            try:
+                asyncio.run(wait_ready(base_url, workers))
+                latencies, errors, elapsed = asyncio.run(run_load(base_url, args.concurrency, args.duration))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+        throughput = len(latencies) / elapsed
+        baseline = baseline or throughput
+        p50, p99 = (np.percentile(latencies, [50, 99]) * 1000) if len(latencies) else (float('nan'), float('nan'))
+        print(f"{workers:>7} {throughput:>8.1f} {p50:>8.0f} {p99:>8.0f} {errors:>7} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
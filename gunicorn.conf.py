@@ -0,0 +1,56 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py main:app
+# Earth Engine calls block their worker, so throughput scales with processes rather than threads.
+# Caches, uploads, field registry and baselines live in SQLite (WAL) and files under FARM_API_DATA_DIR,
+# which every worker on the host shares.
+import math
+import os
+import shutil
+
+# Each worker has its own Earth Engine client and in-memory caches, so the default stays modest
+MAX_DEFAULT_WORKERS = 8
+
+
+def available_cpus() -> int:
+    # os.cpu_count() is the host's CPU count inside a container; the affinity mask and the
+    # cgroup CPU quota (v2 cpu.max, v1 cfs_quota_us / cfs_period_us) are what the pod may use
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f, open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as g:
+                limit, period = int(f.read()), int(g.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(available_cpus(), MAX_DEFAULT_WORKERS))))
+worker_class = 'uvicorn_worker.UvicornWorker'
+# Exports and baseline requests can hold a worker for minutes
+timeout = int(os.getenv('WORKER_TIMEOUT', '300'))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # Samples of workers from a previous run would otherwise be aggregated forever
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
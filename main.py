@@ -1,31 +1,42 @@
-import ee
-from fastapi import FastAPI
+from src.startup import mark, start_earth_engine_init
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import logging
-import os
-import json
+import asyncio
+import math
+from contextlib import asynccontextmanager
 from src.api_routes import router
-from dotenv import load_dotenv
-from google.auth.exceptions import DefaultCredentialsError
-from google.oauth2 import service_account
+from src.tile_proxy import close_session as close_tile_session
+from src.responses import ORJSONNumpyResponse, CompressionMiddleware
+from src.metrics import MetricsMiddleware
+from src.tracing import TracingMiddleware
+from src.profiling import RequestProfilerMiddleware
+from src.field_registry import run_field_scheduler
+from src.circuit_breaker import UpstreamUnavailable
+from src.settings import FIELD_SCHEDULER_ENABLED
 
-# Initialize Earth Engine
-#ee.Initialize(project='ee-mazikuben2')
-
-# Load environment vation.")riables from .env file
-service_account = 'test-724@ee-mazikuben2.iam.gserviceaccount.com'
-credentials = ee.ServiceAccountCredentials(service_account, 'credentials.json')
-ee.Initialize(credentials)
-
-    
-    
+mark('imports_done')
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Earth Engine is initialized in the background so the worker can serve
+    # /health, /ready and /dataset_info immediately; EE routes return 503 until it is ready
+    start_earth_engine_init()
+    scheduler = asyncio.create_task(run_field_scheduler()) if FIELD_SCHEDULER_ENABLED else None
+    mark('serving')
+    yield
+    if scheduler is not None:
+        scheduler.cancel()
+    await close_tile_session()
+
 app = FastAPI(title="Farm Analysis API",
               description="API for analyzing farm vegetation and climate data using Google Earth Engine and NASA data sources.",
-              version="1.0.0")
+              version="1.0.0",
+              lifespan=lifespan,
+              default_response_class=ORJSONNumpyResponse)
 
 # Set up CORS
 app.add_middleware(
@@ -36,9 +47,29 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# gzip/brotli negotiated per request from Accept-Encoding
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+# Samples requests sent with X-Debug-Profile: 1 (requires DEBUG_TOKEN)
+app.add_middleware(RequestProfilerMiddleware)
+
+# Root tracing span per request; Earth Engine round-trips become nested spans
+app.add_middleware(TracingMiddleware)
+
+# Outermost, so latency and response sizes include compression
+app.add_middleware(MetricsMiddleware)
+
+# An open breaker or a missed deadline outside the stale-result routes fails fast with a retry hint, not a 500
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    return ORJSONNumpyResponse(status_code=503, content={"detail": str(exc)},
+                               headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
 # Include the API routes
 app.include_router(router)
 
+mark('app_created')
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
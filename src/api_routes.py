@@ -1,26 +1,55 @@
-from fastapi import APIRouter, HTTPException, File, UploadFile, Query, Path, Depends, Body
-from fastapi.responses import JSONResponse
+from __future__ import annotations
+
+from fastapi import APIRouter, HTTPException, File, UploadFile, Query, Path, Depends, Body, Header, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, Response, FileResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from datetime import date, datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 import json
-import geopandas as gpd
+import asyncio
 import numpy as np
 import io
+import os
+import re
+import hashlib
 import logging
-import ee
 
-from .models import AOIInput, FarmAnalysisRequest, WeatherAnalysisRequest, GeoJSONFeature, GeoJSON, HLSImageRequest
+from .startup import lazy_import, require_earth_engine, readiness, startup_report, ee_ready
+from .metrics import metrics_response
+from .tracing import recent_traces, get_trace
+from .profiling import (require_debug_token, exclusive_profiler, get_request_profile, start_tracemalloc,
+                        stop_tracemalloc, take_snapshot, track_allocations)
+from .models import AOIInput, FarmAnalysisRequest, WeatherAnalysisRequest, GeoJSONFeature, GeoJSON, HLSImageRequest, COGExportRequest, FieldRegistration, NDVIChangeRequest, GridStatsRequest
 from .earth_engine import get_image_data, get_image_urls_for_region
-from .geojson_utils import process_geojson, find_feature_by_name, create_aoi_from_feature
-from .farm_analysis import analyze_farm, get_ndvi_trend, CROP_NDVI_THRESHOLDS
-from .weather_analysis import analyze_climate
+from .geojson_utils import process_geojson, create_aoi_from_feature
+from .farm_analysis import (analyze_farm, get_ndvi_trend, get_ndvi_trend_columns, calculate_trendline, calculate_ndvi_change,
+                           CROP_NDVI_THRESHOLDS)
+from .crop_profiles import CROP_PROFILES
+from .weather_analysis import analyze_climate, analyze_weather_columns, summarize_climate
+from .local_render import get_image_data_local, thumbnail_cache
+from .cog_export import export_analysis_raster, export_path, EXPORT_LAYERS, EXPORT_SOURCES
+from .compositing import COMPOSITE_METHODS
+from .tile_proxy import TILE_LAYERS, MAX_ZOOM, TileFetchError, fetch_tile
+from .settings import TILE_MAX_AGE, PROFILE_MAX_SECONDS
+from .responses import ORJSONNumpyResponse, features_to_columns
+from .arrow_output import negotiate_tabular_format, columns_to_table, table_response
+from .baselines import score_anomalies, aoi_key
+from .uploads import Upload, save_upload, load_upload, last_upload_id, read_upload, is_supported_upload, name_keys
+from .region_catalog import region_catalog
+from .circuit_breaker import breaker_status, UpstreamUnavailable
+from .stale_results import with_stale_fallback, result_key
+from .region_tiles import get_region_tile, MVT_MEDIA_TYPE, MAX_REGION_ZOOM
+from .grid_stats import grid_stats, GRID_LAYERS, GRID_PRECISIONS
+from .field_registry import (register_field, delete_field, list_fields, get_field, get_field_summary,
+                             precompute_due_fields)
+
+ee = lazy_import('ee')
 
 router = APIRouter()
 
 
 
-# Global variable to store the last uploaded GeoJSON
-last_uploaded_geojson = None
+INVALID_UPLOAD_MESSAGE = "Invalid file type. Please upload a GeoJSON (.geojson), zipped shapefile (.zip), GeoPackage (.gpkg) or GeoParquet (.parquet) file."
 
 #@router.post("/upload_process_full_geojson")
 #async def upload_geojson(file: UploadFile = File(...)):
@@ -57,116 +86,130 @@ last_uploaded_geojson = None
 
 
 
+async def resolve_upload(file: Optional[UploadFile], upload_id: Optional[str], label: str) -> Upload:
+    # A new file is stored and becomes the last upload; otherwise upload_id, or the last upload, is loaded
+    if file:
+        with track_allocations(label):
+            content = await file.read()
+            try:
+                gdf = await run_in_threadpool(read_upload, content, file.filename)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            upload = await run_in_threadpool(save_upload, content, gdf, file.filename)
+        return upload
+
+    upload_id = upload_id or await run_in_threadpool(last_upload_id)
+    if upload_id is None:
+        raise HTTPException(status_code=404, detail="No GeoJSON file has been uploaded yet. Please upload a file.")
+    upload = await run_in_threadpool(load_upload, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Upload '{upload_id}' not found.")
+    return upload
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    if bbox is None:
+        return None
+    try:
+        west, south, east, north = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be 'west,south,east,north' in degrees")
+    if west > east or south > north:
+        raise HTTPException(status_code=400, detail="bbox must be 'west,south,east,north' with west <= east and south <= north")
+    return west, south, east, north
+
+
+def parse_property_filters(filters: Optional[List[str]]) -> Dict[str, List[str]]:
+    parsed = {}
+    for value in filters or []:
+        key, separator, expected = value.partition(":")
+        if not separator or not key:
+            raise HTTPException(status_code=400, detail=f"Invalid filter '{value}'. Use 'property:value'.")
+        parsed.setdefault(key, []).append(expected)
+    return parsed
+
+
 @router.post("/inspect_geojson")
 async def inspect_geojson(
     file: UploadFile = File(None),
     show_all_properties: bool = Query(False, description="Show all properties for each region"),
-    name_key: Optional[str] = Query(None, description="Specify the key to use for region names")
+    name_key: Optional[str] = Query(None, description="Specify the key to use for region names"),
+    upload_id: Optional[str] = Query(None, description="Inspect an earlier upload instead of the last one"),
+    fields: Optional[List[str]] = Query(None, description="Only return these properties for each region. Repeat the parameter or comma-separate names"),
+    filter: Optional[List[str]] = Query(None, description="Only regions whose property equals a value, as 'property:value'. Repeat to combine"),
+    bbox: Optional[str] = Query(None, description="Only regions intersecting 'west,south,east,north'"),
+    summary: bool = Query(False, description="Return region counts by type and country instead of the regions"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(1000, ge=1, le=10000, description="Maximum number of regions per page")
 ):
-    global last_uploaded_geojson
-    
-    if file:
-        if not file.filename.endswith('.geojson'):
-            return JSONResponse(status_code=400, content={"message": "Invalid file type. Please upload a GeoJSON file."})
-        
-        content = await file.read()
-        gdf = gpd.read_file(io.BytesIO(content))
-        
-        if gdf.crs and gdf.crs != "EPSG:4326":
-            gdf = gdf.to_crs("EPSG:4326")
-        
-        geojson_dict = json.loads(gdf.to_json())
-        last_uploaded_geojson = geojson_dict
-    elif last_uploaded_geojson is None:
-        raise HTTPException(status_code=404, detail="No GeoJSON file has been uploaded yet. Please upload a file.")
-    else:
-        geojson_dict = last_uploaded_geojson
-    
-    regions = []
-    common_name_keys = ['NAME_1', 'name', 'NAME', 'Name', 'id', 'ID', 'Id', 'region', 'REGION', 'Region']
-    
-    if name_key:
-        common_name_keys.insert(0, name_key)
-    
-    for i, feature in enumerate(geojson_dict['features']):
-        properties = feature['properties']
-        
-        name = next((properties.get(key) for key in common_name_keys if key in properties), None)
-        
-        if name is None:
-            name = f"Unnamed Region {i + 1}"
-        
-        region_info = {
-            "id": properties.get('ID_1') or properties.get('id') or i,
-            "name": name,
-            "type": properties.get('TYPE_1') or properties.get('ENGTYPE_1'),
-            "country": properties.get('NAME_0')
-        }
-        
-        if show_all_properties:
-            region_info["properties"] = properties
-        
-        regions.append(region_info)
-    
-    return {
+    if file and not is_supported_upload(file.filename):
+        return JSONResponse(status_code=400, content={"message": INVALID_UPLOAD_MESSAGE})
+
+    property_filters = parse_property_filters(filter)
+    bounds = parse_bbox(bbox)
+    try:
+        after = int(cursor) if cursor is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    field_names = list(dict.fromkeys(name.strip() for value in fields or [] for name in value.split(",") if name.strip()))
+
+    upload = await resolve_upload(file, upload_id, 'inspect_geojson')
+    catalog = await run_in_threadpool(region_catalog, upload, name_key)
+    positions = await run_in_threadpool(catalog.select, property_filters, bounds)
+
+    result = {
         "message": "GeoJSON file inspection results",
-        "total_regions": len(regions),
-        "regions": regions
+        "upload_id": upload.id,
+        "total_regions": len(catalog),
+        "matched_regions": len(positions),
     }
+    if summary:
+        result["summary"] = catalog.summary(positions)
+        return result
+
+    regions, next_cursor = catalog.page(positions, after, limit, field_names, show_all_properties)
+    result["regions"] = regions
+    result["next_cursor"] = str(next_cursor) if next_cursor is not None else None
+    return result
 
-@router.post("/region_image/{region_name}")
+@router.post("/region_image/{region_name}", dependencies=[Depends(require_earth_engine)])
 async def get_region_image(
     region_name: str = Path(..., description="Name of the region to process"),
     file: UploadFile = File(None),
-    name_key: Optional[str] = Query(None, description="Specify the key to use for region names")
+    name_key: Optional[str] = Query(None, description="Specify the key to use for region names"),
+    upload_id: Optional[str] = Query(None, description="Use an earlier upload instead of the last one")
 ):
-    global last_uploaded_geojson
-    
-    if file:
-        if not file.filename.endswith('.geojson'):
-            return JSONResponse(status_code=400, content={"message": "Invalid file type. Please upload a GeoJSON file."})
-        
-        content = await file.read()
-        gdf = gpd.read_file(io.BytesIO(content))
-        
-        if gdf.crs and gdf.crs != "EPSG:4326":
-            gdf = gdf.to_crs("EPSG:4326")
-        
-        geojson_dict = json.loads(gdf.to_json())
-        last_uploaded_geojson = geojson_dict
-    elif last_uploaded_geojson is None:
-        raise HTTPException(status_code=404, detail="No GeoJSON file has been uploaded yet. Please upload a file.")
-    else:
-        geojson_dict = last_uploaded_geojson
-    
-    common_name_keys = ['NAME_1', 'name', 'NAME', 'Name', 'id', 'ID', 'Id', 'region', 'REGION', 'Region']
-    if name_key:
-        common_name_keys.insert(0, name_key)
+    if file and not is_supported_upload(file.filename):
+        return JSONResponse(status_code=400, content={"message": INVALID_UPLOAD_MESSAGE})
+
+    upload = await resolve_upload(file, upload_id, 'region_image')
     
-    target_feature = find_feature_by_name(geojson_dict, region_name, common_name_keys)
+    position = upload.find(region_name, name_keys(name_key))
     
-    if target_feature is None:
+    if position is None:
         raise HTTPException(status_code=404, detail=f"Region '{region_name}' not found in the uploaded GeoJSON.")
+    target_feature = upload.feature(position)
     
     logging.info(f"Processing region: {region_name}")
     logging.info(f"Geometry type: {target_feature['geometry']['type']}")
 
     aoi = create_aoi_from_feature(target_feature)
     
-    rgb_url, ndvi_url = get_image_urls_for_region(aoi)
+    rgb_url, ndvi_url = await run_in_threadpool(get_image_urls_for_region, aoi)
     
     if rgb_url is None or ndvi_url is None:
         raise HTTPException(status_code=404, detail=f"No image found for region '{region_name}' in the past year.")
     
     return {
         "region_name": region_name,
+        "upload_id": upload.id,
         "properties": target_feature['properties'],
         "rgb_image_url": rgb_url,
         "ndvi_image_url": ndvi_url
     }
 
-@router.post("/hls_image")
-async def get_hls_image_api(request: HLSImageRequest):
+@router.post("/hls_image", dependencies=[Depends(require_earth_engine)])
+async def get_hls_image_api(request: HLSImageRequest, http_request: Request):
     try:
         aoi_input = request.aoi
         if aoi_input.type == "coordinates":
@@ -174,7 +217,7 @@ async def get_hls_image_api(request: HLSImageRequest):
             aoi = ee.Geometry.Rectangle([coords.lon1, coords.lat1, coords.lon2, coords.lat2])
         elif aoi_input.type == "geojson":
             if isinstance(aoi_input.data, GeoJSONFeature):
-                aoi = ee.Geometry(aoi_input.data.geometry.dict())
+                aoi = aoi_input.data.geometry.to_ee()
             elif isinstance(aoi_input.data, GeoJSON):
                 aoi = ee.FeatureCollection(aoi_input.data.dict()).geometry()
             else:
@@ -182,22 +225,200 @@ async def get_hls_image_api(request: HLSImageRequest):
         else:
             raise HTTPException(status_code=400, detail="Invalid AOI type. Use 'coordinates' or 'geojson'.")
         
-        result = get_image_data(aoi, 0, {})
+        if request.composite is not None and request.composite not in COMPOSITE_METHODS:
+            raise HTTPException(status_code=400, detail=f"Invalid composite: {request.composite}. Use one of {list(COMPOSITE_METHODS)}.")
+
+        if request.local_render:
+            if request.composite:
+                raise HTTPException(status_code=400, detail="composite is not supported together with local_render.")
+            result = await run_in_threadpool(get_image_data_local, aoi, 0, {})
+        else:
+            result = await run_in_threadpool(get_image_data, aoi, 0, {}, request.composite, aoi_bbox(request.aoi))
 
         if result is None:
             raise HTTPException(status_code=404, detail="No image found for the specified location in the past year.")
 
+        if request.local_render:
+            base_url = str(http_request.base_url).rstrip('/')
+            for key in ("full_rgb_url", "full_ndvi_url", "clipped_rgb_url", "clipped_ndvi_url"):
+                result[key] = base_url + result[key]
+
         return result
+    except (HTTPException, UpstreamUnavailable):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+@router.post("/export_cog", dependencies=[Depends(require_earth_engine)])
+async def export_cog(request: COGExportRequest, http_request: Request):
+    if request.layer not in EXPORT_LAYERS:
+        raise HTTPException(status_code=400, detail=f"Invalid layer: {request.layer}. Use one of {list(EXPORT_LAYERS)}.")
+    if request.source not in EXPORT_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Invalid source: {request.source}. Use one of {list(EXPORT_SOURCES)}.")
+
+    try:
+        aoi = create_aoi(request.aoi)
+        result = await run_in_threadpool(export_analysis_raster, aoi, request.layer, request.source, request.scale)
+    except (HTTPException, UpstreamUnavailable):
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logging.error(f"Error in export_cog: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while exporting the raster: {str(e)}")
+
+    if result is None:
+        raise HTTPException(status_code=404, detail="No image found for the specified location in the past year.")
+
+    result["url"] = str(http_request.url_for("get_exported_cog", export_id=result["export_id"]))
+    return result
+
+
+@router.get("/exports/{export_id}.tif")
+async def get_exported_cog(export_id: str = Path(..., description="Export ID returned by /export_cog")):
+    path = await run_in_threadpool(export_path, export_id) if re.fullmatch(r"[0-9a-f]{40}", export_id) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Export not found or expired. Request /export_cog again.")
+    # FileResponse answers Range requests, so GIS clients only read the blocks they need
+    return FileResponse(path, media_type="image/tiff; application=geotiff; profile=cloud-optimized",
+                        filename=f"{export_id}.tif")
+
+
+@router.get("/thumbnails/{key}.png")
+async def get_thumbnail(key: str = Path(..., description="Thumbnail key returned by /hls_image")):
+    png = await run_in_threadpool(thumbnail_cache.get, key)
+    if png is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found or expired. Request /hls_image again.")
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "public, max-age=86400, immutable"})
+
+
+@router.get("/tiles/{layer}/{z}/{x}/{y}.png", dependencies=[Depends(require_earth_engine)])
+async def get_map_tile(
+    layer: str = Path(..., description="Tile layer: 'rgb' or 'ndvi'"),
+    z: int = Path(..., description="Zoom level"),
+    x: int = Path(..., description="Tile column"),
+    y: int = Path(..., description="Tile row"),
+    if_none_match: Optional[str] = Header(None)
+):
+    if layer not in TILE_LAYERS:
+        raise HTTPException(status_code=404, detail=f"Unknown tile layer: {layer}. Use one of {list(TILE_LAYERS)}.")
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=400, detail=f"Invalid tile coordinates: {z}/{x}/{y}")
+
+    try:
+        tile, etag = await fetch_tile(layer, z, x, y)
+    except TileFetchError as e:
+        logging.error(f"Error in get_map_tile: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e))
+
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TILE_MAX_AGE}"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=tile, media_type="image/png", headers=headers)
+
+
+@router.get("/regions/{upload_id}/{z}/{x}/{y}.mvt")
+async def get_region_tile_route(
+    upload_id: str = Path(..., description="upload_id returned by /inspect_geojson or /region_image"),
+    z: int = Path(..., description="Zoom level"),
+    x: int = Path(..., description="Tile column"),
+    y: int = Path(..., description="Tile row"),
+    name_key: Optional[str] = Query(None, description="Specify the key to use for region names")
+):
+    if not 0 <= z <= MAX_REGION_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=400, detail=f"Invalid tile coordinates: {z}/{x}/{y}")
+
+    tile = await run_in_threadpool(get_region_tile, upload_id, z, x, y, name_key)
+    if tile is None:
+        raise HTTPException(status_code=404, detail=f"Upload '{upload_id}' not found.")
+    # Upload ids are content hashes, so a tile never changes
+    headers = {"Cache-Control": "public, max-age=86400, immutable"}
+    if not tile:
+        return Response(status_code=204, headers=headers)
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE, headers=headers)
     
     
 
+@router.get("/health")
+async def health():
+    # Liveness only: the process is up and serving, whether or not Earth Engine is ready
+    return {"status": "ok"}
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+@router.get("/debug/traces", dependencies=[Depends(require_debug_token)])
+async def list_traces(
+    limit: int = Query(20, ge=1, le=200),
+    min_duration_ms: float = Query(0, ge=0),
+    name: Optional[str] = Query(None, description="Root span name, e.g. 'POST /hls_image'")
+):
+    return {"traces": recent_traces(limit, min_duration_ms, name)}
+
+@router.get("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def profile_worker(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=100)
+):
+    # Samples every thread of this worker while it keeps serving traffic
+    with exclusive_profiler(interval_ms / 1000) as profiler:
+        await asyncio.sleep(seconds)
+    return PlainTextResponse(profiler.collapsed(), headers={"X-Profile-Samples": str(profiler.samples)})
+
+@router.get("/debug/profile/{profile_id}", dependencies=[Depends(require_debug_token)])
+async def read_request_profile(profile_id: str):
+    collapsed = get_request_profile(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found. Only the most recent request profiles are kept.")
+    return PlainTextResponse(collapsed)
+
+@router.post("/debug/tracemalloc/start", dependencies=[Depends(require_debug_token)])
+async def tracemalloc_start(frames: int = Query(25, ge=1, le=100)):
+    return start_tracemalloc(frames)
+
+@router.post("/debug/tracemalloc/stop", dependencies=[Depends(require_debug_token)])
+async def tracemalloc_stop():
+    return stop_tracemalloc()
+
+@router.get("/debug/tracemalloc/snapshot", dependencies=[Depends(require_debug_token)])
+async def tracemalloc_snapshot(
+    limit: int = Query(25, ge=1, le=500),
+    key_type: str = Query("lineno", pattern="^(lineno|filename|traceback)$")
+):
+    return await run_in_threadpool(take_snapshot, limit, key_type)
+
+@router.get("/debug/traces/{trace_id}", dependencies=[Depends(require_debug_token)])
+async def read_trace(trace_id: str):
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found. Only the most recent traces are kept.")
+    return trace
+
+
+@router.get("/ready")
+async def ready():
+    status = readiness()
+    # Open breakers do not make the worker unready: it still serves cached and stale results
+    return JSONResponse(status_code=200 if status["ready"] else 503,
+                        content={**status, "circuit_breakers": breaker_status()})
+
+
+@router.get("/startup_report")
+async def get_startup_report():
+    return startup_report()
+
+
 @router.get("/dataset_info")
 async def get_dataset_info():
     return {
         "dataset_name": "NASA/HLS/HLSL30/v002",
         "description": "Harmonized Landsat Sentinel-2 (HLS) dataset",
+        "collections": [
+            {"name": "NASA/HLS/HLSL30/v002", "sensor": "Landsat 8/9 OLI"},
+            {"name": "NASA/HLS/HLSS30/v002", "sensor": "Sentinel-2 MSI", "band_mapping": {"B8A": "B5"}}
+        ],
         "resolution": "30 meters",
         "bands": [
             {"name": "B1", "description": "Coastal Aerosol"},
@@ -229,10 +450,24 @@ async def get_dataset_info():
     
     
 
-def validate_crop_type(crop_type: str = Query(..., description="Type of crop")) -> str:
-    if crop_type not in CROP_NDVI_THRESHOLDS:
-        raise HTTPException(status_code=400, detail=f"Unsupported crop type: {crop_type}")
-    return crop_type
+def validate_crop_type(
+    crop_type: List[str] = Query(..., description="Type of crop. Repeat the parameter or comma-separate values to compare several crops")
+) -> List[str]:
+    crop_types = list(dict.fromkeys(crop.strip() for value in crop_type for crop in value.split(",") if crop.strip()))
+    if not crop_types:
+        raise HTTPException(status_code=400, detail="At least one crop type is required")
+    for crop in crop_types:
+        if crop not in CROP_NDVI_THRESHOLDS:
+            raise HTTPException(status_code=400, detail=f"Unsupported crop type: {crop}")
+    return crop_types
+
+
+def validate_layout(
+    layout: str = Query("features", description="'features' for a list of per-date features, 'columnar' for {\"dates\": [...], \"mean\": [...]} arrays")
+) -> str:
+    if layout not in ("features", "columnar"):
+        raise HTTPException(status_code=400, detail=f"Invalid layout: {layout}. Use 'features' or 'columnar'.")
+    return layout
 
 
 def create_aoi(aoi_input: AOIInput) -> ee.Geometry:
@@ -241,17 +476,56 @@ def create_aoi(aoi_input: AOIInput) -> ee.Geometry:
         return ee.Geometry.Rectangle([coords.lon1, coords.lat1, coords.lon2, coords.lat2])
     elif aoi_input.type == "geojson":
         if isinstance(aoi_input.data, GeoJSONFeature):
-            return ee.Geometry(aoi_input.data.geometry.dict())
+            return aoi_input.data.geometry.to_ee()
         elif isinstance(aoi_input.data, GeoJSON):
             return ee.FeatureCollection(aoi_input.data.dict()).geometry()
     raise HTTPException(status_code=400, detail="Invalid AOI input")
 
-@router.post("/analyze_farm")
-async def analyze_farm_route(request: FarmAnalysisRequest, crop_type: str = Depends(validate_crop_type)):
+def aoi_bbox(aoi_input: AOIInput):
+    if aoi_input.type == "coordinates":
+        coords = aoi_input.data
+        return (min(coords.lon1, coords.lon2), min(coords.lat1, coords.lat2),
+                max(coords.lon1, coords.lon2), max(coords.lat1, coords.lat2))
+    if isinstance(aoi_input.data, GeoJSONFeature):
+        return aoi_input.data.geometry.bounds
+    bounds = np.array([feature.geometry.bounds for feature in aoi_input.data.features])
+    return (float(bounds[:, 0].min()), float(bounds[:, 1].min()),
+            float(bounds[:, 2].max()), float(bounds[:, 3].max()))
+
+def aoi_geojson(aoi_input: AOIInput) -> Dict:
+    if aoi_input.type == "coordinates":
+        west, south, east, north = aoi_bbox(aoi_input)
+        return {"type": "Polygon", "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]]}
+    if isinstance(aoi_input.data, GeoJSONFeature):
+        return aoi_input.data.geometry.to_geojson()
+    return {"type": "GeometryCollection", "geometries": [feature.geometry.to_geojson() for feature in aoi_input.data.features]}
+
+@router.get("/crop_profiles")
+async def get_crop_profiles():
+    return CROP_PROFILES
+
+@router.post("/analyze_farm", dependencies=[Depends(require_earth_engine)])
+async def analyze_farm_route(
+    request: FarmAnalysisRequest,
+    crop_types: List[str] = Depends(validate_crop_type),
+    layout: str = Depends(validate_layout)
+):
     try:
         aoi = create_aoi(request.aoi)
-        result = analyze_farm(aoi, request.date_range.start_date.isoformat(), request.date_range.end_date.isoformat(), crop_type)
-        return result
+        baseline_key = aoi_key(aoi_geojson(request.aoi))
+
+        def compute():
+            result = analyze_farm(aoi, request.date_range.start_date.isoformat(), request.date_range.end_date.isoformat(), crop_types)
+            # z-scores against the per-day-of-year climatology; computed in the background on first use
+            result["anomaly"] = score_anomalies(aoi, baseline_key, result["ndvi_stats"])
+            return result
+
+        # A response whose baseline is still being computed is not kept as the fallback for later outages
+        result, stale = await with_stale_fallback("analyze_farm", result_key("analyze_farm", request.dict(), crop_types), compute,
+                                                  lambda result: result["anomaly"]["baseline_status"] != "pending")
+        if layout == "columnar":
+            result["ndvi_stats"] = features_to_columns(result["ndvi_stats"])
+        return ORJSONNumpyResponse({**result, **stale})
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -260,12 +534,35 @@ async def analyze_farm_route(request: FarmAnalysisRequest, crop_type: str = Depe
 
 
 
-@router.post("/analyze_climate")
-async def analyze_climate_route(request: WeatherAnalysisRequest):
+@router.post("/analyze_climate", dependencies=[Depends(require_earth_engine)])
+async def analyze_climate_route(
+    request: WeatherAnalysisRequest,
+    layout: str = Depends(validate_layout),
+    output_format: Optional[str] = Query(None, alias="format", description="'json' (default), 'arrow' or 'parquet'"),
+    accept: Optional[str] = Header(None)
+):
     try:
         aoi = create_aoi(request.aoi)
-        result = analyze_climate(aoi, request.date_range.start_date.isoformat(), request.date_range.end_date.isoformat(), request.parameters)
-        return result
+        tabular_format = negotiate_tabular_format(accept, output_format)
+        if tabular_format:
+            # Stored under their own key: the columns are a different result from the JSON response
+            columns, stale = await with_stale_fallback(
+                "analyze_climate", result_key("analyze_climate", request.dict(), "columns"),
+                lambda: analyze_weather_columns(aoi, request.date_range.start_date.isoformat(), request.date_range.end_date.isoformat(), request.parameters)
+            )
+            if not columns['date']:
+                raise HTTPException(status_code=404, detail="No climate data found for the specified area and date range.")
+            precip_values = (np.asarray(columns['precipitation']) * 86400).tolist()  # Convert to mm/day
+            summary = summarize_climate(columns['temperature'], precip_values)
+            return table_response(columns_to_table(columns, {**summary, **stale}), tabular_format, "climate")
+
+        result, stale = await with_stale_fallback(
+            "analyze_climate", result_key("analyze_climate", request.dict()),
+            lambda: analyze_climate(aoi, request.date_range.start_date.isoformat(), request.date_range.end_date.isoformat(), request.parameters)
+        )
+        if layout == "columnar":
+            result["weather_data"] = features_to_columns(result["weather_data"])
+        return ORJSONNumpyResponse({**result, **stale})
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -276,7 +573,7 @@ async def analyze_climate_route(request: WeatherAnalysisRequest):
     
 
 
-@router.post("/ndvi_trend")
+@router.post("/ndvi_trend", dependencies=[Depends(require_earth_engine)])
 async def get_ndvi_trend_route(
     aoi: Dict = Body(..., example={
         "type": "geojson",
@@ -290,7 +587,9 @@ async def get_ndvi_trend_route(
         }
     }),
     start_date: date = Query(...),
-    end_date: date = Query(...)
+    end_date: date = Query(...),
+    output_format: Optional[str] = Query(None, alias="format", description="'json' (default), 'arrow' or 'parquet'"),
+    accept: Optional[str] = Header(None)
 ):
     try:
         aoi_input = AOIInput(**aoi)
@@ -300,7 +599,22 @@ async def get_ndvi_trend_route(
         
         logging.info(f"Fetching NDVI trend for AOI: {aoi}, Start Date: {start_date_str}, End Date: {end_date_str}")
         
-        ndvi_data = get_ndvi_trend(ee_aoi, start_date_str, end_date_str)
+        tabular_format = negotiate_tabular_format(accept, output_format)
+        if tabular_format:
+            columns, stale = await with_stale_fallback(
+                "ndvi_trend", result_key("ndvi_trend", aoi, start_date_str, end_date_str, "columns"),
+                lambda: get_ndvi_trend_columns(ee_aoi, start_date_str, end_date_str)
+            )
+            if not columns['date']:
+                raise HTTPException(status_code=404, detail="No NDVI data found for the specified area and date range.")
+            trend = calculate_trendline(columns['date'], columns['ndvi'])
+            metadata = {"trendline": {"start": trend['start'], "end": trend['end']}, "trend_direction": trend['direction'], **stale}
+            return table_response(columns_to_table(columns, metadata), tabular_format, "ndvi_trend")
+        
+        ndvi_data, stale = await with_stale_fallback(
+            "ndvi_trend", result_key("ndvi_trend", aoi, start_date_str, end_date_str),
+            lambda: get_ndvi_trend(ee_aoi, start_date_str, end_date_str)
+        )
         
         if not ndvi_data:
             logging.warning("No NDVI data found for the specified parameters")
@@ -314,34 +628,123 @@ async def get_ndvi_trend_route(
                 }
             )
         
-        # Calculate simple linear regression for trendline
-        dates = [datetime.strptime(d['date'], '%Y-%m-%d').timestamp() for d in ndvi_data]
-        ndvi_values = [d['ndvi'] for d in ndvi_data]
-        
-        if len(dates) > 1:
-            coeffs = np.polyfit(dates, ndvi_values, 1)
-            trendline = np.poly1d(coeffs)
-            trend_start = float(trendline(dates[0]))
-            trend_end = float(trendline(dates[-1]))
-            
-            trend_direction = "Increasing" if coeffs[0] > 0 else "Decreasing" if coeffs[0] < 0 else "Stable"
-        else:
-            trend_start = trend_end = ndvi_values[0] if ndvi_values else None
-            trend_direction = "Insufficient data"
+        trend = calculate_trendline([d['date'] for d in ndvi_data], [d['ndvi'] for d in ndvi_data])
         
-        logging.info(f"NDVI trend calculated successfully. Direction: {trend_direction}")
+        logging.info(f"NDVI trend calculated successfully. Direction: {trend['direction']}")
         
-        return {
+        return ORJSONNumpyResponse({
             "ndvi_data": ndvi_data,
             "trendline": {
-                "start": trend_start,
-                "end": trend_end
+                "start": trend['start'],
+                "end": trend['end']
             },
-            "trend_direction": trend_direction
-        }
+            "trend_direction": trend['direction'],
+            **stale
+        })
     except HTTPException as he:
         logging.error(f"HTTP Exception in get_ndvi_trend_route: {str(he)}")
         raise he
     except Exception as e:
         logging.error(f"Unexpected error in get_ndvi_trend_route: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred while fetching NDVI trend: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred while fetching NDVI trend: {str(e)}")
+
+
+@router.post("/ndvi_change", dependencies=[Depends(require_earth_engine)])
+async def ndvi_change_route(request: NDVIChangeRequest, http_request: Request):
+    for label, period in (("before", request.before), ("after", request.after)):
+        if period.start_date >= period.end_date:
+            raise HTTPException(status_code=400, detail=f"'{label}' start_date must be before end_date.")
+
+    try:
+        aoi = create_aoi(request.aoi)
+        periods = [request.before.start_date.isoformat(), request.before.end_date.isoformat(),
+                   request.after.start_date.isoformat(), request.after.end_date.isoformat()]
+
+        thumbnail_key = None
+        if request.thumbnail:
+            thumbnail_key = "change_" + hashlib.sha1(
+                json.dumps([request.aoi.dict(), periods], sort_keys=True).encode('utf-8')
+            ).hexdigest()
+
+        result, stale = await with_stale_fallback(
+            "ndvi_change", result_key("ndvi_change", request.dict()),
+            lambda: calculate_ndvi_change(aoi, *periods, thumbnail_key)
+        )
+        if "change_thumbnail_url" in result:
+            result["change_thumbnail_url"] = str(http_request.base_url).rstrip('/') + result["change_thumbnail_url"]
+        return ORJSONNumpyResponse({**result, **stale})
+    except HTTPException as he:
+        raise he
+    except ValueError as ve:
+        raise HTTPException(status_code=404, detail=str(ve))
+    except Exception as e:
+        logging.error(f"Error in ndvi_change_route: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while computing NDVI change: {str(e)}")
+
+@router.post("/fields", status_code=201)
+async def create_field(registration: FieldRegistration, background_tasks: BackgroundTasks):
+    if registration.crop_type not in CROP_NDVI_THRESHOLDS:
+        raise HTTPException(status_code=400, detail=f"Unsupported crop type: {registration.crop_type}")
+
+    field = await run_in_threadpool(register_field, registration.name, registration.crop_type,
+                                    registration.geometry.to_geojson())
+    # New fields get their first summary right away instead of waiting for the next scheduler run
+    if ee_ready.is_set():
+        background_tasks.add_task(precompute_due_fields)
+    return field
+
+@router.get("/fields")
+async def get_fields():
+    return {"fields": await run_in_threadpool(list_fields)}
+
+@router.get("/fields/{field_id}")
+async def get_field_route(field_id: str):
+    field = await run_in_threadpool(get_field, field_id)
+    if field is None:
+        raise HTTPException(status_code=404, detail=f"Field '{field_id}' not found.")
+    return field
+
+@router.get("/fields/{field_id}/summary")
+async def get_field_summary_route(field_id: str):
+    field = await run_in_threadpool(get_field, field_id)
+    if field is None:
+        raise HTTPException(status_code=404, detail=f"Field '{field_id}' not found.")
+    summary = await run_in_threadpool(get_field_summary, field_id)
+    if summary is None:
+        return JSONResponse(status_code=202, content={"message": "Summary has not been computed yet. Try again shortly."})
+    return {"field_id": field_id, "name": field['name'], "crop_type": field['crop_type'], **summary}
+
+@router.delete("/fields/{field_id}")
+async def delete_field_route(field_id: str):
+    if not await run_in_threadpool(delete_field, field_id):
+        raise HTTPException(status_code=404, detail=f"Field '{field_id}' not found.")
+    return {"message": f"Field '{field_id}' deleted."}
+
+@router.post("/fields/precompute", dependencies=[Depends(require_earth_engine), Depends(require_debug_token)])
+async def precompute_fields_route():
+    return await run_in_threadpool(precompute_due_fields)
+
+
+@router.post("/grid_stats", dependencies=[Depends(require_earth_engine)])
+async def grid_stats_route(request: GridStatsRequest):
+    if request.layer not in GRID_LAYERS:
+        raise HTTPException(status_code=400, detail=f"Invalid layer: {request.layer}. Use one of {list(GRID_LAYERS)}.")
+    if request.precision not in GRID_PRECISIONS:
+        raise HTTPException(status_code=400, detail=f"precision must be between {GRID_PRECISIONS.start} and {GRID_PRECISIONS.stop - 1}.")
+    if request.date_range.start_date >= request.date_range.end_date:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date.")
+
+    try:
+        result, stale = await with_stale_fallback(
+            "grid_stats", result_key("grid_stats", request.dict()),
+            lambda: grid_stats(request.layer, aoi_geojson(request.aoi), aoi_bbox(request.aoi), request.precision,
+                               request.date_range.start_date.isoformat(), request.date_range.end_date.isoformat())
+        )
+        return ORJSONNumpyResponse({**result, **stale})
+    except HTTPException as he:
+        raise he
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logging.error(f"Error in grid_stats: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while computing grid statistics: {str(e)}")
@@ -0,0 +1,63 @@
+import io
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+TABULAR_FORMATS = ("json", "arrow", "parquet")
+
+
+def negotiate_tabular_format(accept: Optional[str], output_format: Optional[str]) -> Optional[str]:
+    # An explicit ?format= wins over the Accept header; None means the regular JSON response
+    if output_format is not None:
+        if output_format not in TABULAR_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Invalid format: {output_format}. Use one of {list(TABULAR_FORMATS)}.")
+        return None if output_format == "json" else output_format
+    if accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        return "arrow"
+    if accept and PARQUET_MEDIA_TYPE in accept:
+        return "parquet"
+    return None
+
+
+def columns_to_table(columns: Dict[str, List[Any]], metadata: Optional[Dict[str, Any]] = None):
+    import pyarrow as pa
+
+    arrays = []
+    for name, values in columns.items():
+        if name == "date":
+            arrays.append(pa.array(np.array(values, dtype="datetime64[D]")))
+        else:
+            arrays.append(pa.array(np.asarray(values, dtype=np.float64)))
+
+    # Scalar results (trendline, drought status, ...) travel as JSON in the schema metadata
+    schema_metadata = {key: json.dumps(value) for key, value in (metadata or {}).items()}
+    batch = pa.RecordBatch.from_arrays(arrays, names=list(columns))
+    return pa.Table.from_batches([batch]).replace_schema_metadata(schema_metadata)
+
+
+def table_response(table, output_format: str, name: str) -> Response:
+    import pyarrow as pa
+
+    sink = io.BytesIO()
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, sink, compression="zstd")
+        media_type = PARQUET_MEDIA_TYPE
+        filename = f"{name}.parquet"
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        media_type = ARROW_STREAM_MEDIA_TYPE
+        filename = f"{name}.arrows"
+
+    return Response(
+        content=sink.getvalue(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .startup import lazy_import
+from .db import get_connection
+from .metrics import instrument
+from .tracing import traced_get_info
+from .circuit_breaker import no_deadline
+from .farm_analysis import MODIS_NDVI_COLLECTION
+from .settings import BASELINE_START_DATE, BASELINE_WORKERS, BASELINE_RETRY_AFTER
+
+ee = lazy_import('ee')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS baselines (
+    aoi_key TEXT NOT NULL,
+    doy INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    std REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (aoi_key, doy)
+);
+CREATE TABLE IF NOT EXISTS baseline_jobs (
+    aoi_key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    error TEXT
+);
+"""
+
+_executor = ThreadPoolExecutor(max_workers=BASELINE_WORKERS, thread_name_prefix='baseline')
+
+
+def _connect():
+    conn = get_connection('baselines')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def aoi_key(geometry: Dict[str, Any]) -> str:
+    # The same area keys the same whether it came as coordinates, a Feature or a FeatureCollection:
+    # parts are dissolved, snapped to ~1 cm and put in canonical ring order before hashing
+    import shapely
+    from shapely.geometry import shape
+
+    dissolved = shapely.union_all(shapely.get_parts(shapely.make_valid(shape(geometry))))
+    canonical = shapely.normalize(shapely.set_precision(dissolved, 1e-7))
+    return hashlib.sha1(shapely.to_wkb(canonical)).hexdigest()
+
+
+def _day_of_year(date: str) -> int:
+    return datetime.strptime(date, '%Y-%m-%d').timetuple().tm_yday
+
+
+@instrument('compute_ndvi_baseline')
+def compute_baseline(aoi: ee.Geometry) -> List[Dict[str, Any]]:
+    collection = ee.ImageCollection(MODIS_NDVI_COLLECTION) \
+        .filterDate(BASELINE_START_DATE, datetime.now(timezone.utc).strftime('%Y-%m-%d')) \
+        .filterBounds(aoi)
+
+    def mean_ndvi(image):
+        ndvi = image.select('NDVI').divide(10000).reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=aoi,
+            scale=250,
+            maxPixels=1e9
+        ).get('NDVI')
+        return ee.Feature(None, {'ndvi': ndvi, 'doy': image.date().getRelative('day', 'year').add(1)})
+
+    # Grouping by composite day-of-year happens server-side; only ~23 rows come back
+    groups = collection.map(mean_ndvi) \
+        .filter(ee.Filter.notNull(['ndvi'])) \
+        .reduceColumns(
+            ee.Reducer.mean().combine(ee.Reducer.stdDev(), None, True).combine(ee.Reducer.count(), None, True)
+                .group(groupField=1, groupName='doy'),
+            ['ndvi', 'doy']
+        ).get('groups')
+    return traced_get_info(groups, 'ndvi_baseline', ['modis'])
+
+
+def _set_job(conn, key: str, status: str, error: Optional[str] = None):
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO baseline_jobs (aoi_key, status, updated_at, error) VALUES (?, ?, ?, ?)",
+                     (key, status, time.time(), error))
+
+
+def _run_baseline_job(key: str, aoi: ee.Geometry):
+    with closing(_connect()) as conn:
+        try:
+            with no_deadline():
+                groups = compute_baseline(aoi)
+            with conn:
+                conn.execute("DELETE FROM baselines WHERE aoi_key = ?", (key,))
+                conn.executemany(
+                    "INSERT INTO baselines (aoi_key, doy, mean, std, count) VALUES (?, ?, ?, ?, ?)",
+                    [(key, int(group['doy']), group['mean'], group['stdDev'], group['count']) for group in groups]
+                )
+            _set_job(conn, key, 'ready')
+            logging.info(f"NDVI baseline ready for AOI {key}: {len(groups)} composite days")
+        except Exception as e:
+            logging.error(f"NDVI baseline for AOI {key} failed: {str(e)}")
+            _set_job(conn, key, 'failed', str(e))
+
+
+def request_baseline(aoi: ee.Geometry, key: str) -> str:
+    # Returns the baseline status for the AOI and queues a background computation when there is none
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        job = conn.execute("SELECT status, updated_at FROM baseline_jobs WHERE aoi_key = ?", (key,)).fetchone()
+        if job and (job['status'] == 'ready' or time.time() - job['updated_at'] < BASELINE_RETRY_AFTER):
+            conn.rollback()
+            return job['status']
+        conn.execute("INSERT OR REPLACE INTO baseline_jobs (aoi_key, status, updated_at, error) VALUES (?, 'pending', ?, NULL)",
+                     (key, time.time()))
+        conn.commit()
+
+    _executor.submit(_run_baseline_job, key, aoi)
+    return 'pending'
+
+
+def get_baseline(key: str) -> Dict[int, Dict[str, float]]:
+    with closing(_connect()) as conn:
+        rows = conn.execute("SELECT doy, mean, std, count FROM baselines WHERE aoi_key = ?", (key,)).fetchall()
+    return {row['doy']: {'mean': row['mean'], 'std': row['std'], 'count': row['count']} for row in rows}
+
+
+def _nearest_doy(doys: np.ndarray, doy: int) -> int:
+    # Circular distance so late-December dates can match early-January composites
+    distance = np.abs(doys - doy)
+    distance = np.minimum(distance, 366 - distance)
+    return int(doys[np.argmin(distance)])
+
+
+def score_anomalies(aoi: ee.Geometry, key: str, ndvi_stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    status = request_baseline(aoi, key)
+    if status != 'ready':
+        return {"baseline_status": status}
+
+    baseline = get_baseline(key)
+    if not baseline or not ndvi_stats:
+        return {"baseline_status": status}
+
+    doys = np.array(sorted(baseline))
+    for feature in ndvi_stats:
+        properties = feature['properties']
+        reference = baseline[_nearest_doy(doys, _day_of_year(properties['date']))]
+        if properties.get('mean') is None or not reference['std']:
+            properties['zscore'] = None
+        else:
+            properties['zscore'] = (properties['mean'] - reference['mean']) / reference['std']
+
+    current = ndvi_stats[-1]['properties']
+    current_doy = _nearest_doy(doys, _day_of_year(current['date']))
+    return {
+        "baseline_status": status,
+        "baseline_start_date": BASELINE_START_DATE,
+        "current_date": current['date'],
+        "current_zscore": current.get('zscore'),
+        "baseline_mean": baseline[current_doy]['mean'],
+        "baseline_std": baseline[current_doy]['std'],
+        "baseline_years": baseline[current_doy]['count'],
+    }
@@ -0,0 +1,165 @@
+import os
+import time
+import hashlib
+import threading
+import logging
+from contextlib import closing
+from typing import Optional
+
+from .db import connect
+from .metrics import record_cache_lookup
+
+# Hits refresh an entry's recency at most this often, so hot entries do not turn every read into a write
+TOUCH_INTERVAL = 60
+STALE_TMP_AGE = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+"""
+
+
+class DiskLRUCache:
+    # Entries are files in `directory`; their sizes and recency live in a SQLite index next to it
+    # (`<directory>.db`), so every worker process shares one cache and one byte budget
+    def __init__(self, directory: str, max_bytes: int, name: Optional[str] = None):
+        self.directory = directory
+        self.name = name or os.path.basename(directory.rstrip(os.sep))
+        self.max_bytes = max_bytes
+        self.index_path = directory.rstrip(os.sep) + '.db'
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.index_path)
+        return conn
+
+    def _load_existing(self):
+        # Indexes files left by a cache directory that predates the index; other workers starting
+        # at the same time insert the same rows, which is harmless
+        existing = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.tmp'):
+                # Only old ones: a fresh temporary file may be another worker's write in progress
+                if time.time() - stat.st_mtime > STALE_TMP_AGE:
+                    os.remove(path)
+                continue
+            existing.append((name, stat.st_size, stat.st_mtime))
+
+        with closing(connect(self.index_path)) as conn:
+            conn.executescript(SCHEMA)
+            with conn:
+                if not conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone():
+                    conn.executemany("INSERT OR IGNORE INTO entries (name, size, accessed_at) VALUES (?, ?, ?)", existing)
+                # The running byte total is summed once, when the index is created (or predates the totals table)
+                conn.execute("INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, self._file_name(key)))
+
+    def get(self, key: str) -> Optional[bytes]:
+        # The file itself is the source of truth for hits, so reads need no index lookup
+        name = self._file_name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+                touched = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            record_cache_lookup(self.name, False)
+            return None
+
+        self._touch(name, path, touched)
+        record_cache_lookup(self.name, True)
+        return data
+
+    def file_path(self, key: str) -> Optional[str]:
+        # For entries served straight from disk; a hit counts as a use, like get()
+        name = self._file_name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            touched = os.stat(path).st_mtime
+        except FileNotFoundError:
+            record_cache_lookup(self.name, False)
+            return None
+
+        self._touch(name, path, touched)
+        record_cache_lookup(self.name, True)
+        return path
+
+    def _touch(self, name: str, path: str, touched: float):
+        now = time.time()
+        if now - touched > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+                conn = self._connection()
+                with conn:
+                    conn.execute("UPDATE entries SET accessed_at = ? WHERE name = ?", (now, name))
+            except FileNotFoundError:
+                pass
+
+    def put(self, key: str, data: bytes):
+        name = self._file_name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._add(name, len(data))
+
+    def put_file(self, key: str, source_path: str) -> str:
+        # Moves a finished file into the cache without reading it; source_path must be on the same filesystem
+        name = self._file_name(key)
+        path = os.path.join(self.directory, name)
+        size = os.path.getsize(source_path)
+        os.replace(source_path, path)
+        self._add(name, size)
+        return path
+
+    def _add(self, name: str, size: int):
+        conn = self._connection()
+        with conn:
+            # The UPDATE takes the write lock first, so the replaced entry's size cannot change underneath it
+            conn.execute("UPDATE totals SET bytes = bytes + ? - COALESCE((SELECT size FROM entries WHERE name = ?), 0) "
+                         "WHERE id = 0", (size, name))
+            conn.execute("INSERT OR REPLACE INTO entries (name, size, accessed_at) VALUES (?, ?, ?)",
+                         (name, size, time.time()))
+            total = conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(conn, total)
+
+    def _evict(self, conn, total: int):
+        evicted = []
+        for row in conn.execute("SELECT name, size FROM entries ORDER BY accessed_at"):
+            if total <= self.max_bytes or total == row['size']:
+                break
+            evicted.append(row['name'])
+            total -= row['size']
+        conn.executemany("DELETE FROM entries WHERE name = ?", [(name,) for name in evicted])
+        conn.execute("UPDATE totals SET bytes = ? WHERE id = 0", (total,))
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            logging.debug(f"Evicted cache entry {name} from {self.directory}")
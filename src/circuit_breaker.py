@@ -0,0 +1,192 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .startup import lazy_import
+from .metrics import BREAKER_OPEN, BREAKER_REJECTIONS
+from .settings import (EE_DEADLINES, EE_MAX_CONCURRENT_CALLS, BREAKER_WINDOW, BREAKER_MIN_CALLS,
+                       BREAKER_FAILURE_RATE, BREAKER_OPEN_SECONDS, BREAKER_MAX_OPEN_SECONDS)
+
+ee = lazy_import('ee')
+
+# One breaker per upstream dataset; callers name the datasets each round-trip reads
+BREAKER_DATASETS = ('modis', 'hls', 'cmip6')
+# Network and HTTP client errors raised below the EE client
+TRANSPORT_MODULES = ('googleapiclient', 'httplib2', 'urllib3', 'requests', 'google.auth')
+# EEException messages that mean Earth Engine is overloaded or down, rather than that the request is wrong
+TRANSIENT_MARKERS = ('timed out', 'timeout', 'deadline', 'too many', 'rate limit', 'quota exceeded', 'internal error',
+                     'backend error', 'unavailable', '429', '500', '502', '503', '504')
+
+# Calls run here so a caller can stop waiting at its deadline; a call that overruns keeps its thread until EE answers
+_executor = ThreadPoolExecutor(max_workers=EE_MAX_CONCURRENT_CALLS, thread_name_prefix='ee-call')
+_deadlines_enabled: contextvars.ContextVar[bool] = contextvars.ContextVar('ee_deadlines_enabled', default=True)
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, datasets: List[str], retry_after: float, reason: str):
+        super().__init__(f"Earth Engine {'/'.join(datasets)} unavailable: {reason}")
+        self.datasets = datasets
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Opens when BREAKER_FAILURE_RATE of the last BREAKER_WINDOW calls failed or overran their deadline.
+    # After the open period one probe call is let through: success closes the breaker, failure reopens it
+    # for twice as long (up to BREAKER_MAX_OPEN_SECONDS)
+    def __init__(self, name: str, deadline: float):
+        self.name = name
+        self.deadline = deadline
+        self.state = 'closed'
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=BREAKER_WINDOW)
+        self._open_seconds = BREAKER_OPEN_SECONDS
+        self._open_until = 0.0
+        self._probe = None  # token of the half-open probe in flight
+
+    def before_call(self) -> Optional[object]:
+        # Returns the probe token when this call is the half-open probe, None for an ordinary call
+        with self._lock:
+            if self.state == 'closed':
+                return None
+            now = time.time()
+            if self.state == 'open' and now >= self._open_until:
+                self.state = 'half_open'
+                self._probe = None
+            if self.state == 'half_open' and self._probe is None:
+                self._probe = object()
+                return self._probe
+            retry_after = max(self._open_until - now, 1.0)
+        BREAKER_REJECTIONS.labels(self.name).inc()
+        raise UpstreamUnavailable([self.name], retry_after, "circuit breaker open")
+
+    def cancel_probe(self, probe: Optional[object]):
+        with self._lock:
+            if probe is not None and probe is self._probe:
+                self._probe = None
+
+    def record(self, ok: bool, probe: Optional[object] = None):
+        with self._lock:
+            if self.state == 'half_open':
+                # Calls that started before the breaker opened can finish now; only the probe decides
+                if probe is None or probe is not self._probe:
+                    return
+                self._probe = None
+                if ok:
+                    self._close()
+                else:
+                    self._open_seconds = min(self._open_seconds * 2, BREAKER_MAX_OPEN_SECONDS)
+                    self._open()
+                return
+            if self.state == 'open':
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= BREAKER_MIN_CALLS and failures / len(self._outcomes) >= BREAKER_FAILURE_RATE:
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self._open_until = time.time() + self._open_seconds
+        self._outcomes.clear()
+        BREAKER_OPEN.labels(self.name).set(1)
+        logging.warning(f"Circuit breaker for {self.name} opened for {self._open_seconds:.0f}s")
+
+    def _close(self):
+        self.state = 'closed'
+        self._open_seconds = BREAKER_OPEN_SECONDS
+        self._outcomes.clear()
+        BREAKER_OPEN.labels(self.name).set(0)
+        logging.info(f"Circuit breaker for {self.name} closed")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "deadline_seconds": self.deadline,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": self._outcomes.count(False),
+                "retry_after_seconds": round(max(self._open_until - time.time(), 0), 1) if self.state != 'closed' else 0,
+            }
+
+
+breakers = {name: CircuitBreaker(name, EE_DEADLINES[name]) for name in BREAKER_DATASETS}
+
+
+def breaker_status() -> Dict[str, Dict[str, Any]]:
+    return {name: breaker.status() for name, breaker in breakers.items()}
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    if isinstance(error, ee.EEException):
+        message = str(error).lower()
+        return any(marker in message for marker in TRANSIENT_MARKERS)
+    return isinstance(error, OSError) or type(error).__module__.startswith(TRANSPORT_MODULES)
+
+
+@contextmanager
+def no_deadline():
+    # For background jobs (baselines, field precompute) that may legitimately run longer than a request may wait
+    token = _deadlines_enabled.set(False)
+    try:
+        yield
+    finally:
+        _deadlines_enabled.reset(token)
+
+
+def guarded_call(datasets: Sequence[str], ee_span, func: Callable, *args, **kwargs):
+    # Runs one Earth Engine round-trip through the breakers of the datasets it reads ('modis', 'hls', 'cmip6')
+    # and gives up after the tightest of their deadlines
+    guards = [breakers[name] for name in datasets]
+    if not guards:
+        return func(*args, **kwargs)
+
+    probes = []
+    for breaker in guards:
+        try:
+            probes.append(breaker.before_call())
+        except UpstreamUnavailable:
+            for admitted, probe in zip(guards, probes):
+                admitted.cancel_probe(probe)
+            raise
+
+    names = [breaker.name for breaker in guards]
+    try:
+        if _deadlines_enabled.get():
+            deadline = min(breaker.deadline for breaker in guards)
+            future = _executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+            try:
+                result = future.result(timeout=deadline)
+            except FutureTimeout:
+                ee_span.set_attribute("ee.deadline_exceeded", deadline)
+                raise UpstreamUnavailable(names, BREAKER_OPEN_SECONDS, f"no answer within {deadline:g}s")
+        else:
+            result = func(*args, **kwargs)
+    except UpstreamUnavailable:
+        for breaker, probe in zip(guards, probes):
+            breaker.record(False, probe)
+        raise
+    except Exception as e:
+        # Requests Earth Engine rejects as invalid still show the service is answering
+        failed = is_upstream_failure(e)
+        for breaker, probe in zip(guards, probes):
+            breaker.record(not failed, probe)
+        raise
+    for breaker, probe in zip(guards, probes):
+        breaker.record(True, probe)
+    return result
+
+
+def upstream_failure(error: Optional[BaseException]) -> Optional[BaseException]:
+    # Routes wrap errors in HTTPException(500, ...) inside `except Exception`, so the original is on the context chain
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, UpstreamUnavailable) or is_upstream_failure(error):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
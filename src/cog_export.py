@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import os
+import json
+import math
+import hashlib
+import logging
+import tempfile
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .startup import lazy_import
+from .metrics import instrument
+from .cache import DiskLRUCache
+from .circuit_breaker import guarded_call
+from .tracing import ee_round_trip, traced_get_info
+from .earth_engine import get_recent_hls_collection, get_region_hls_collection, get_region_composite
+from .settings import (CACHE_DIR, EXPORT_CHUNK_SIZE, MAX_EXPORT_PIXELS, EXPORT_CACHE_MAX_BYTES,
+                       EXPORT_FETCH_CONCURRENCY)
+
+ee = lazy_import('ee')
+
+# Exports share a byte budget like the other caches; the least recently downloaded ones are evicted first
+export_cache = DiskLRUCache(os.path.join(CACHE_DIR, 'exports'), EXPORT_CACHE_MAX_BYTES)
+EXPORT_LAYERS = {
+    "rgb": ['B4', 'B3', 'B2'],
+    "ndvi": ['NDVI'],
+}
+EXPORT_SOURCES = ("hls_image", "region_image")
+NODATA = -9999.0
+METERS_PER_DEGREE = 111320.0
+
+
+def export_path(export_id: str) -> Optional[str]:
+    return export_cache.file_path(export_id)
+
+
+def _source_image(aoi: ee.Geometry, source: str):
+    # Same imagery as /hls_image (most recent scene) or /region_image (past-year cloud-masked composite)
+    if source == "hls_image":
+        collection = get_recent_hls_collection(aoi)
+        image = ee.Image(collection.first())
+    else:
+        collection = get_region_hls_collection(aoi)
+        _, image = get_region_composite(aoi)
+    return collection, image
+
+
+def _layer_image(image: ee.Image, layer: str) -> ee.Image:
+    if layer == "ndvi":
+        layer_image = image.normalizedDifference(['B5', 'B4']).rename('NDVI')
+    else:
+        layer_image = image.select(EXPORT_LAYERS["rgb"])
+    return layer_image.toFloat().unmask(NODATA)
+
+
+def export_grid(geometry: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    # A FeatureCollection AOI can dissolve to a GeometryCollection, so the bounds come from shapely rather than rings
+    from affine import Affine
+    from shapely.errors import GeometryTypeError
+    from shapely.geometry import shape
+
+    try:
+        lon_min, lat_min, lon_max, lat_max = shape(geometry).bounds
+    except (GeometryTypeError, KeyError, TypeError, ValueError):
+        raise ValueError(f"Unsupported AOI geometry type for export: {geometry.get('type')}")
+    if math.isnan(lon_min):
+        raise ValueError("The AOI geometry is empty.")
+
+    # Degrees of longitude shrink with latitude, so the x step is widened to keep pixels `scale` meters wide
+    pixel_height = scale / METERS_PER_DEGREE
+    pixel_width = pixel_height / max(math.cos(math.radians((lat_min + lat_max) / 2)), 1e-6)
+    width = max(1, math.ceil((lon_max - lon_min) / pixel_width))
+    height = max(1, math.ceil((lat_max - lat_min) / pixel_height))
+    if width * height > MAX_EXPORT_PIXELS:
+        raise ValueError(f"Export of {width}x{height} pixels exceeds the limit of {MAX_EXPORT_PIXELS}. Use a larger scale.")
+
+    return {
+        'width': width,
+        'height': height,
+        'transform': Affine(pixel_width, 0, float(lon_min), 0, -pixel_height, float(lat_max)),
+    }
+
+
+@instrument('fetch_export_window')
+def _fetch_window(image: ee.Image, transform, window, band_names) -> np.ndarray:
+    with ee_round_trip('computePixels export_window', image, width=int(window.width), height=int(window.height)) as ee_span:
+        pixels = guarded_call(['hls'], ee_span, ee.data.computePixels, {
+            'expression': image,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': {
+                'dimensions': {'width': int(window.width), 'height': int(window.height)},
+                'affineTransform': {
+                    'scaleX': transform.a,
+                    'shearX': 0,
+                    'translateX': transform.c + window.col_off * transform.a,
+                    'shearY': 0,
+                    'scaleY': transform.e,
+                    'translateY': transform.f + window.row_off * transform.e,
+                },
+                'crsCode': 'EPSG:4326',
+            },
+        })
+    return np.stack([pixels[band] for band in band_names]).astype(np.float32)
+
+
+def _chunk_windows(width: int, height: int, chunk_size: int):
+    from rasterio.windows import Window
+
+    for row_off in range(0, height, chunk_size):
+        for col_off in range(0, width, chunk_size):
+            yield Window(col_off, row_off, min(chunk_size, width - col_off), min(chunk_size, height - row_off))
+
+
+def write_cog(image: ee.Image, band_names, grid: Dict[str, Any], output_path: str,
+              chunk_size: int = EXPORT_CHUNK_SIZE):
+    import rasterio
+    from rasterio.shutil import copy as rio_copy
+
+    profile = {
+        'driver': 'GTiff',
+        'width': grid['width'],
+        'height': grid['height'],
+        'count': len(band_names),
+        'dtype': 'float32',
+        'crs': 'EPSG:4326',
+        'transform': grid['transform'],
+        'nodata': NODATA,
+        'tiled': True,
+        'blockxsize': 512,
+        'blockysize': 512,
+        'compress': 'deflate',
+        'BIGTIFF': 'IF_SAFER',
+    }
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path)) as tmp_dir:
+        staging_path = os.path.join(tmp_dir, 'staging.tif')
+
+        # Up to EXPORT_FETCH_CONCURRENCY windows are fetched at once and written in order as they arrive,
+        # so only that many chunks are held in memory
+        with rasterio.open(staging_path, 'w', **profile) as dst, \
+                ThreadPoolExecutor(EXPORT_FETCH_CONCURRENCY, thread_name_prefix='export-window') as pool:
+            dst.descriptions = tuple(band_names)
+            pending = deque()
+            for window in _chunk_windows(grid['width'], grid['height'], chunk_size):
+                pending.append((window, pool.submit(contextvars.copy_context().run, _fetch_window,
+                                                    image, grid['transform'], window, band_names)))
+                if len(pending) >= EXPORT_FETCH_CONCURRENCY:
+                    done, future = pending.popleft()
+                    dst.write(future.result(), window=done)
+            while pending:
+                done, future = pending.popleft()
+                dst.write(future.result(), window=done)
+
+        # The COG driver builds the overviews and reorders blocks for range reads
+        tmp_cog_path = os.path.join(tmp_dir, 'cog.tif')
+        rio_copy(staging_path, tmp_cog_path, driver='COG', compress='DEFLATE', predictor='YES',
+                 blocksize=512, overview_resampling='AVERAGE', bigtiff='IF_SAFER')
+        os.replace(tmp_cog_path, output_path)
+
+
+@instrument('export_analysis_raster')
+def export_analysis_raster(aoi: ee.Geometry, layer: str, source: str, scale: float) -> Optional[Dict[str, Any]]:
+    collection, image = _source_image(aoi, source)
+
+    info = traced_get_info(ee.Dictionary({
+        'image_count': collection.size(),
+        'geometry': aoi,
+        'source_id': ee.Algorithms.If(
+            collection.size().gt(0),
+            ee.String(ee.Image(collection.first()).get('system:index')).cat('_').cat(ee.Number(collection.size()).format()),
+            None
+        ),
+    }), 'export_info', ['hls'])
+
+    if info['image_count'] == 0:
+        return None
+
+    band_names = EXPORT_LAYERS[layer]
+    export_id = hashlib.sha1(json.dumps(
+        [source, layer, scale, info['source_id'], info['geometry']], sort_keys=True
+    ).encode('utf-8')).hexdigest()
+
+    grid = export_grid(info['geometry'], scale)
+    output_path = export_path(export_id)
+    if output_path is None:
+        logging.info(f"Writing {grid['width']}x{grid['height']} {layer} COG export {export_id}")
+        # Written next to the cache directory, so moving the finished file in is a rename
+        with tempfile.TemporaryDirectory(dir=CACHE_DIR) as tmp_dir:
+            cog_path = os.path.join(tmp_dir, 'export.tif')
+            write_cog(_layer_image(image, layer), band_names, grid, cog_path)
+            output_path = export_cache.put_file(export_id, cog_path)
+
+    return {
+        "export_id": export_id,
+        "layer": layer,
+        "source": source,
+        "bands": band_names,
+        "width": grid['width'],
+        "height": grid['height'],
+        "crs": "EPSG:4326",
+        "nodata": NODATA,
+        "size_bytes": os.path.getsize(output_path),
+    }
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from typing import Iterable, Tuple
+
+from .startup import lazy_import
+
+ee = lazy_import('ee')
+
+# HLS v2.0 Fmask quality bits (see /dataset_info)
+FMASK_BITS = {
+    "cirrus": 0,
+    "cloud": 1,
+    "adjacent": 2,
+    "shadow": 3,
+    "snow": 4,
+    "water": 5,
+}
+DEFAULT_MASKED_CLASSES = ("cloud", "adjacent", "shadow", "snow")
+COMPOSITE_METHODS = ("quality", "median")
+
+# Least-cloudy scenes kept per MGRS tile; a median needs a few to reject residual clouds
+SCENES_PER_TILE = {
+    "quality": 4,
+    "median": 8,
+}
+
+
+def fmask_bitmask(classes: Iterable[str] = DEFAULT_MASKED_CLASSES) -> int:
+    bitmask = 0
+    for name in classes:
+        if name not in FMASK_BITS:
+            raise ValueError(f"Unknown Fmask class: {name}. Use one of {list(FMASK_BITS)}.")
+        bitmask |= 1 << FMASK_BITS[name]
+    return bitmask
+
+
+def fmask_clear(image: ee.Image, classes: Iterable[str] = DEFAULT_MASKED_CLASSES) -> ee.Image:
+    return image.select('Fmask').bitwiseAnd(fmask_bitmask(classes)).eq(0)
+
+
+def mask_fmask(image: ee.Image, classes: Iterable[str] = DEFAULT_MASKED_CLASSES) -> ee.Image:
+    return image.updateMask(fmask_clear(image, classes))
+
+
+def add_ndvi(image: ee.Image) -> ee.Image:
+    return image.addBands(image.normalizedDifference(['B5', 'B4']).rename('NDVI'))
+
+
+def limit_to_covering_scenes(collection: ee.ImageCollection, scenes_per_tile: int) -> ee.ImageCollection:
+    # Every MGRS tile touching the AOI contributes only its least-cloudy scenes,
+    # so the composite covers the AOI with the fewest images to process
+    tile_ids = collection.aggregate_array('MGRS_TILE_ID').distinct()
+
+    def least_cloudy(tile_id):
+        return (collection
+                .filter(ee.Filter.eq('MGRS_TILE_ID', tile_id))
+                .sort('CLOUD_COVERAGE')
+                .limit(scenes_per_tile)
+                .toList(scenes_per_tile))
+
+    return ee.ImageCollection(ee.List(tile_ids.map(least_cloudy)).flatten())
+
+
+def build_composite(collection: ee.ImageCollection, method: str = "quality",
+                    masked_classes: Iterable[str] = DEFAULT_MASKED_CLASSES) -> Tuple[ee.ImageCollection, ee.Image]:
+    if method not in COMPOSITE_METHODS:
+        raise ValueError(f"Unknown composite method: {method}. Use one of {list(COMPOSITE_METHODS)}.")
+
+    masked_classes = tuple(masked_classes)
+    scenes = limit_to_covering_scenes(collection, SCENES_PER_TILE[method])
+    masked = scenes.map(lambda image: add_ndvi(mask_fmask(image, masked_classes)))
+
+    if method == "quality":
+        # Greenest clear observation per pixel
+        composite = masked.qualityMosaic('NDVI')
+    else:
+        composite = masked.median()
+
+    return scenes, composite
@@ -0,0 +1,52 @@
+import json
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .settings import CROP_PROFILES_FILE
+
+THRESHOLD_NAMES = ("poor", "fair", "good")
+OFF_SEASON = "off_season"
+
+
+def load_crop_profiles(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path) as f:
+        profiles = json.load(f)
+
+    for crop, profile in profiles.items():
+        thresholds = [profile['thresholds'][name] for name in THRESHOLD_NAMES]
+        if thresholds != sorted(thresholds):
+            raise ValueError(f"Crop profile '{crop}': thresholds must increase from poor to good")
+        for stage in profile.setdefault('growth_stages', []):
+            if not (1 <= stage['start_doy'] <= 366 and 1 <= stage['end_doy'] <= 366):
+                raise ValueError(f"Crop profile '{crop}': stage '{stage['name']}' needs days of year between 1 and 366")
+            if stage['ndvi_min'] > stage['ndvi_max']:
+                raise ValueError(f"Crop profile '{crop}': stage '{stage['name']}' has ndvi_min above ndvi_max")
+
+    logging.info(f"Loaded {len(profiles)} crop profile(s) from {path}")
+    return profiles
+
+
+CROP_PROFILES = load_crop_profiles(CROP_PROFILES_FILE)
+
+
+def threshold_matrix(crop_types: Sequence[str]) -> np.ndarray:
+    # (crops, 3) array of poor/fair/good thresholds
+    return np.array([[CROP_PROFILES[crop]['thresholds'][name] for name in THRESHOLD_NAMES] for crop in crop_types],
+                    dtype=np.float64).reshape(len(crop_types), len(THRESHOLD_NAMES))
+
+
+def stage_calendar(crop_types: Sequence[str]) -> Tuple[Dict[str, np.ndarray], List[List[str]]]:
+    # Calendars have different numbers of stages, so they are padded to a (crops, stages) grid;
+    # padded slots are masked out by `valid`
+    stages = [CROP_PROFILES[crop]['growth_stages'] for crop in crop_types]
+    shape = (len(crop_types), max((len(crop_stages) for crop_stages in stages), default=0))
+    calendar = {key: np.zeros(shape) for key in ('start_doy', 'end_doy', 'ndvi_min', 'ndvi_max')}
+    calendar['valid'] = np.zeros(shape, dtype=bool)
+    for i, crop_stages in enumerate(stages):
+        for j, stage in enumerate(crop_stages):
+            for key in ('start_doy', 'end_doy', 'ndvi_min', 'ndvi_max'):
+                calendar[key][i, j] = stage[key]
+            calendar['valid'][i, j] = True
+    return calendar, [[stage['name'] for stage in crop_stages] for crop_stages in stages]
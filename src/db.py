@@ -0,0 +1,17 @@
+import os
+import sqlite3
+
+from .settings import DATA_DIR
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_connection(name: str) -> sqlite3.Connection:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return connect(os.path.join(DATA_DIR, f"{name}.db"))
@@ -1,56 +1,112 @@
-import ee
-from datetime import datetime, timedelta
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
 import logging
 
-def get_hls_image(aoi):
+from .startup import lazy_import
+from .metrics import instrument
+from .tracing import traced_get_info, traced_thumb_url
+from .compositing import build_composite, mask_fmask
+from .hls_collections import get_merged_hls_collection, harmonize_hls
+from .scene_catalog import find_best_scene
+
+ee = lazy_import('ee')
+
+RGB_VIS = {'min': 0, 'max': 0.3, 'gamma': 1.2}
+NDVI_VIS = {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']}
+
+def get_recent_hls_collection(aoi):
     current_date = ee.Date(datetime.now())
     one_year_ago = current_date.advance(-1, 'year')
 
-    image_collection = ee.ImageCollection('NASA/HLS/HLSL30/v002')
-    filtered_collection = (image_collection
-                           .filterBounds(aoi)
-                           .filterDate(one_year_ago, current_date)
-                           .sort('system:time_start', False))
+    return (get_merged_hls_collection(one_year_ago, current_date, aoi)
+            .sort('system:time_start', False))
+
+@instrument('get_hls_image')
+def get_hls_image(aoi, composite=None, bbox=None):
+    if bbox is not None and not composite:
+        return get_catalog_hls_image(bbox)
+
+    filtered_collection = get_recent_hls_collection(aoi)
+
+    if composite:
+        return get_hls_composite(filtered_collection, composite)
 
     most_recent_image = filtered_collection.first()
 
     if most_recent_image:
         rgb_image = most_recent_image.select(['B4', 'B3', 'B2'])
         ndvi = most_recent_image.normalizedDifference(['B5', 'B4']).rename('NDVI')
-        return rgb_image, ndvi, most_recent_image.date().format('YYYY-MM-dd').getInfo(), filtered_collection.size().getInfo()
+        image_date = traced_get_info(most_recent_image.date().format('YYYY-MM-dd'), 'image_date', ['hls'])
+        image_count = traced_get_info(filtered_collection.size(), 'image_count', ['hls'])
+        return rgb_image, ndvi, image_date, image_count
     else:
         return None, None, None, 0
 
+def get_catalog_hls_image(bbox):
+    # Scene discovery runs against the local catalog, so no Earth Engine round-trip is needed here
+    scene, image_count = find_best_scene(bbox)
+    if scene is None:
+        return None, None, None, 0
+
+    image = harmonize_hls(ee.Image(scene['scene_id']), scene['collection'])
+    image_date = datetime.fromtimestamp(scene['time_start'] / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+    rgb_image = image.select(['B4', 'B3', 'B2'])
+    ndvi = image.normalizedDifference(['B5', 'B4']).rename('NDVI')
+    return rgb_image, ndvi, image_date, image_count
+
+def get_hls_composite(filtered_collection, method):
+    scenes, composite = build_composite(filtered_collection, method)
+
+    # Date of the newest contributing scene and scene count in a single round-trip
+    info = traced_get_info(ee.Dictionary({
+        'image_count': scenes.size(),
+        'image_date': ee.Algorithms.If(
+            scenes.size().gt(0),
+            ee.Date(scenes.aggregate_max('system:time_start')).format('YYYY-MM-dd'),
+            None
+        ),
+    }), 'composite_info', ['hls'])
+
+    if info['image_count'] == 0:
+        return None, None, None, 0
+
+    footprint = scenes.geometry().bounds()
+    rgb_image = composite.select(['B4', 'B3', 'B2']).clip(footprint)
+    ndvi = composite.select('NDVI').clip(footprint)
+    return rgb_image, ndvi, info['image_date'], info['image_count']
+
 def calculate_ndvi(image):
     ndvi = image.normalizedDifference(['B5', 'B4']).rename('NDVI')
     return image.addBands(ndvi)
 
-def get_image_urls_for_region(region_geometry):
+def get_region_hls_collection(region_geometry):
     now = datetime.now()
     one_year_ago = now - timedelta(days=365)
 
     ee_now = ee.Date(now)
     ee_one_year_ago = ee.Date(one_year_ago)
 
-    hls_collection = ee.ImageCollection("NASA/HLS/HLSL30/v002")
-
-    filtered_collection = hls_collection \
-        .filterBounds(region_geometry) \
-        .filterDate(ee_one_year_ago, ee_now) \
+    return get_merged_hls_collection(ee_one_year_ago, ee_now, region_geometry) \
         .sort('CLOUD_COVERAGE', True)
 
-    image_count = filtered_collection.size().getInfo()
+def get_region_composite(region_geometry):
+    # Cloud-masked composite of the least-cloudy scenes per tile, not a mosaic of every scene
+    return build_composite(get_region_hls_collection(region_geometry), "quality")
+
+def get_image_urls_for_region(region_geometry):
+    filtered_collection = get_region_hls_collection(region_geometry)
+
+    image_count = traced_get_info(filtered_collection.size(), 'image_count', ['hls'])
     if image_count == 0:
         return None, None
 
-    mosaic = filtered_collection.mosaic()
+    _, composite = get_region_composite(region_geometry)
 
-    rgb_image = mosaic.select(['B4', 'B3', 'B2'])
-
-    ndvi_image = mosaic.normalizedDifference(['B5', 'B4']).rename('NDVI')
+    rgb_image = composite.select(['B4', 'B3', 'B2'])
 
-    rgb_vis = {'min': 0, 'max': 0.3, 'gamma': 1.2}
-    ndvi_vis = {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']}
+    ndvi_image = composite.select('NDVI')
 
     # Simplify the geometry
     if isinstance(region_geometry, ee.geometry.Geometry):
@@ -63,45 +119,54 @@ def get_image_urls_for_region(region_geometry):
 
     #logging.info(f"Simplified region geometry: {simplified_geometry.getInfo()}")
 
-    full_rgb_url = rgb_image.getThumbURL({
-        **rgb_vis,
-        'region': simplified_geometry,
-        'dimensions': 1024
-    })
+    with instrument('getThumbURL'):
+        full_rgb_url = traced_thumb_url(rgb_image, {
+            **RGB_VIS,
+            'region': simplified_geometry,
+            'dimensions': 1024
+        }, 'full_rgb', ['hls'])
 
-    full_ndvi_url = ndvi_image.getThumbURL({
-        **ndvi_vis,
-        'region': simplified_geometry,
-        'dimensions': 1024
-    })
+        full_ndvi_url = traced_thumb_url(ndvi_image, {
+            **NDVI_VIS,
+            'region': simplified_geometry,
+            'dimensions': 1024
+        }, 'full_ndvi', ['hls'])
 
     return full_rgb_url, full_ndvi_url
 
-def get_image_data(aoi, i, properties):
-    rgb_image, ndvi_image, image_date, image_count = get_hls_image(aoi)
+def get_hls_mosaic_layers():
+    # Global least-cloudy-on-top, Fmask-masked mosaic of the past year, used for map tiles
+    now = datetime.now()
+    one_year_ago = now - timedelta(days=365)
+
+    mosaic = get_merged_hls_collection(ee.Date(one_year_ago), ee.Date(now)) \
+        .sort('CLOUD_COVERAGE', False) \
+        .map(mask_fmask) \
+        .mosaic()
+
+    rgb_image = mosaic.select(['B4', 'B3', 'B2'])
+    ndvi_image = mosaic.normalizedDifference(['B5', 'B4']).rename('NDVI')
+    return rgb_image, ndvi_image
+
+def get_image_data(aoi, i, properties, composite=None, bbox=None):
+    rgb_image, ndvi_image, image_date, image_count = get_hls_image(aoi, composite, bbox)
     if rgb_image is None:
         return None
 
-    rgb_vis = {'min': 0, 'max': 0.3, 'gamma': 1.2}
-    ndvi_vis = {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']}
-
-    bounds = aoi.bounds().getInfo()['coordinates'][0]
-    lon_min, lat_min = bounds[0]
-    lon_max, lat_max = bounds[2]
-
-    full_rgb_url = rgb_image.getThumbURL({**rgb_vis, 'dimensions': 1024})
-    full_ndvi_url = ndvi_image.getThumbURL({**ndvi_vis, 'dimensions': 1024})
-    
-    clipped_rgb_url = rgb_image.clip(aoi).getThumbURL({
-        **rgb_vis, 
-        'dimensions': 1024,
-        'region': aoi
-    })
-    clipped_ndvi_url = ndvi_image.clip(aoi).getThumbURL({
-        **ndvi_vis, 
-        'dimensions': 1024,
-        'region': aoi
-    })
+    with instrument('getThumbURL'):
+        full_rgb_url = traced_thumb_url(rgb_image, {**RGB_VIS, 'dimensions': 1024}, 'full_rgb', ['hls'])
+        full_ndvi_url = traced_thumb_url(ndvi_image, {**NDVI_VIS, 'dimensions': 1024}, 'full_ndvi', ['hls'])
+
+        clipped_rgb_url = traced_thumb_url(rgb_image.clip(aoi), {
+            **RGB_VIS,
+            'dimensions': 1024,
+            'region': aoi
+        }, 'clipped_rgb', ['hls'])
+        clipped_ndvi_url = traced_thumb_url(ndvi_image.clip(aoi), {
+            **NDVI_VIS,
+            'dimensions': 1024,
+            'region': aoi
+        }, 'clipped_ndvi', ['hls'])
 
     return {
         "region_id": i,
@@ -112,5 +177,5 @@ def get_image_data(aoi, i, properties):
         "full_ndvi_url": full_ndvi_url,
         "clipped_rgb_url": clipped_rgb_url,
         "clipped_ndvi_url": clipped_ndvi_url,
-        "available_bands": rgb_image.bandNames().getInfo()
+        "available_bands": ['B4', 'B3', 'B2']
     }
\ No newline at end of file
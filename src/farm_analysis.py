@@ -1,36 +1,63 @@
-import ee
+from __future__ import annotations
+
 from datetime import datetime
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Sequence, Union
 from fastapi import HTTPException
 import logging
 
+from .startup import lazy_import
+from .metrics import instrument
+from .tracing import traced_get_info
+from .local_render import cache_ee_thumbnail
+from .crop_profiles import CROP_PROFILES, OFF_SEASON, THRESHOLD_NAMES, threshold_matrix, stage_calendar
+from .phenology import fit_phenology, harvest_window
+from .settings import NDVI_CELL_CACHE
+
+ee = lazy_import('ee')
+
+MODIS_NDVI_COLLECTION = 'MODIS/006/MOD13Q1'
+
+# Crop-specific NDVI thresholds, loaded from the crop profile file
+CROP_NDVI_THRESHOLDS = {crop: profile['thresholds'] for crop, profile in CROP_PROFILES.items()}
+
+# Fixed NDVI histogram bins; 0.05 wide so every crop threshold falls on a bin edge
+NDVI_HISTOGRAM_MIN = -1.0
+NDVI_HISTOGRAM_MAX = 1.0
+NDVI_HISTOGRAM_BINS = 40
+HEALTH_CLASSES = ("poor", "fair", "good", "excellent")
+HEALTH_LABELS = ("Poor", "Fair", "Good", "Excellent")
 
-# Define crop-specific NDVI thresholds
-CROP_NDVI_THRESHOLDS = {
-    "corn": {"poor": 0.3, "fair": 0.5, "good": 0.7},
-    "wheat": {"poor": 0.3, "fair": 0.4, "good": 0.6},
-    "soybeans": {"poor": 0.3, "fair": 0.5, "good": 0.7},
-    "rice": {"poor": 0.3, "fair": 0.5, "good": 0.7},
-    "cotton": {"poor": 0.3, "fair": 0.4, "good": 0.6},
-}
+# NDVI differences beyond this count as loss/gain when computing changed area fractions
+NDVI_CHANGE_THRESHOLD = 0.1
+CHANGE_VIS = {'min': -0.5, 'max': 0.5, 'palette': ['red', 'white', 'green']}
 
+@instrument('calculate_ndvi_stats')
 def calculate_ndvi_stats(aoi: ee.Geometry, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    # Imported here because ndvi_cells builds on this module's reducers
+    from .ndvi_cells import cached_ndvi_stats, SINUSOIDAL_WKT, CRS_TRANSFORM
+
     try:
-        collection = ee.ImageCollection('MODIS/006/MOD13Q1') \
+        if NDVI_CELL_CACHE:
+            stats = cached_ndvi_stats(aoi, start_date, end_date)
+            if stats is not None:
+                return stats
+
+        collection = ee.ImageCollection(MODIS_NDVI_COLLECTION) \
             .filterDate(start_date, end_date) \
             .filterBounds(aoi)
         
-        if collection.size().getInfo() == 0:
+        if traced_get_info(collection.size(), 'collection_size', ['modis']) == 0:
             raise ValueError("No MODIS data available for the specified date range and location.")
 
         def calc_stats(image):
             ndvi = image.select('NDVI').divide(10000)  # Scale NDVI values
+            # Same native grid and unweighted pixels as the cell cache, so both give the same statistics
             stats = ndvi.reduceRegion(
-                reducer=ee.Reducer.mean().combine(ee.Reducer.stdDev(), None, True)
-                    .combine(ee.Reducer.minMax(), None, True),
+                reducer=ndvi_stats_reducer().unweighted(),
                 geometry=aoi,
-                scale=250,
+                crs=SINUSOIDAL_WKT,
+                crsTransform=CRS_TRANSFORM,
                 maxPixels=1e9
             )
             return ee.Feature(None, {
@@ -38,79 +65,224 @@ def calculate_ndvi_stats(aoi: ee.Geometry, start_date: str, end_date: str) -> Li
                 'stdDev': stats.get('NDVI_stdDev'),
                 'min': stats.get('NDVI_min'),
                 'max': stats.get('NDVI_max'),
+                'histogram': histogram_counts(stats.get('NDVI_histogram')),
                 'date': image.date().format('YYYY-MM-dd')
             })
 
-        stats = collection.map(calc_stats).getInfo()
+        stats = traced_get_info(collection.map(calc_stats), 'ndvi_stats', ['modis'])
         return stats['features']
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculating NDVI stats: {str(e)}")
 
-def analyze_vegetation_health(ndvi_stats: List[Dict[str, Any]], crop_type: str) -> Dict[str, Any]:
+def ndvi_stats_reducer():
+    # Histogram shares the same pass over the pixels as the summary statistics
+    return ee.Reducer.mean().combine(ee.Reducer.stdDev(), None, True) \
+        .combine(ee.Reducer.minMax(), None, True) \
+        .combine(ee.Reducer.fixedHistogram(NDVI_HISTOGRAM_MIN, NDVI_HISTOGRAM_MAX, NDVI_HISTOGRAM_BINS), None, True)
+
+def histogram_counts(histogram):
+    # [[bin_min, count], ...] -> [count, ...]; the bin edges are fixed, so only counts are sent back
+    return ee.Algorithms.If(histogram, ee.Array(histogram).slice(1, 1, 2).project([0]).toList(), None)
+
+def ndvi_histogram_edges() -> List[float]:
+    return np.round(np.linspace(NDVI_HISTOGRAM_MIN, NDVI_HISTOGRAM_MAX, NDVI_HISTOGRAM_BINS + 1), 6).tolist()
+
+def check_thresholds_on_bin_edges(profiles: Dict[str, Dict[str, Any]]):
+    # Area fractions are summed from whole histogram bins, so a threshold between two edges cannot be honoured
+    edges = np.asarray(ndvi_histogram_edges())
+    width = (NDVI_HISTOGRAM_MAX - NDVI_HISTOGRAM_MIN) / NDVI_HISTOGRAM_BINS
+    for crop, profile in profiles.items():
+        for name in THRESHOLD_NAMES:
+            value = profile['thresholds'][name]
+            if not np.isclose(edges, value, rtol=0, atol=1e-9).any():
+                raise ValueError(f"Crop profile '{crop}': threshold '{name}' ({value}) must be a multiple of {width:g} "
+                                 f"between {NDVI_HISTOGRAM_MIN:g} and {NDVI_HISTOGRAM_MAX:g}")
+
+check_thresholds_on_bin_edges(CROP_PROFILES)
+
+def health_class_fractions_matrix(histograms: Sequence[Sequence[float]], crop_types: Sequence[str]) -> np.ndarray:
+    # (crops, dates, classes) area fractions from (dates, bins) pixel-weighted histogram counts
+    counts = np.asarray(histograms, dtype=np.float64).reshape(len(histograms), NDVI_HISTOGRAM_BINS)
+    bin_starts = np.asarray(ndvi_histogram_edges()[:-1])
+    # A bin belongs to the class of the highest threshold at or below its lower edge
+    class_index = (threshold_matrix(crop_types)[:, None, :] <= bin_starts[None, :, None]).sum(axis=2)
+    one_hot = class_index[:, :, None] == np.arange(len(HEALTH_CLASSES))
+    totals = counts.sum(axis=1)[None, :, None]
+    fractions = np.einsum('db,cbk->cdk', counts, one_hot.astype(np.float64))
+    return np.divide(fractions, totals, out=np.zeros_like(fractions), where=totals > 0)
+
+def health_class_fractions(counts: List[float], crop_type: str) -> Dict[str, float]:
+    # Area fraction of the AOI in each health class, from the pixel-weighted histogram counts
+    return dict(zip(HEALTH_CLASSES, health_class_fractions_matrix([counts], [crop_type])[0, 0].tolist()))
+
+def add_health_class_fractions(ndvi_stats: List[Dict[str, Any]], crop_type: Union[str, Sequence[str]]):
+    # With several crops, each feature's class_fractions is keyed by crop
+    crop_types = _crop_list(crop_type)
+    features = [feature for feature in ndvi_stats if feature['properties'].get('histogram') is not None]
+    if not features:
+        return
+    fractions = health_class_fractions_matrix([feature['properties']['histogram'] for feature in features], crop_types)
+    for j, feature in enumerate(features):
+        per_crop = {crop: dict(zip(HEALTH_CLASSES, fractions[i, j].tolist())) for i, crop in enumerate(crop_types)}
+        feature['properties']['class_fractions'] = per_crop[crop_type] if isinstance(crop_type, str) else per_crop
+
+@instrument('calculate_ndvi_stats_batch')
+def calculate_ndvi_stats_batch(fields: ee.FeatureCollection, start_date: str, end_date: str,
+                               collection_id: str = MODIS_NDVI_COLLECTION) -> Dict[str, List[Dict[str, Any]]]:
+    # One reduceRegions pass per composite covers every field, and the results come back
+    # as parallel lists in a single round-trip instead of one request per field
+    collection = ee.ImageCollection(collection_id) \
+        .filterDate(start_date, end_date) \
+        .filterBounds(fields.geometry())
+
+    def calc_stats(image):
+        date = image.date().format('YYYY-MM-dd')
+        return image.select('NDVI').divide(10000).reduceRegions(
+            collection=fields,
+            reducer=ndvi_stats_reducer(),
+            scale=250
+        ).map(lambda feature: feature.set({'date': date, 'histogram': histogram_counts(feature.get('histogram'))}))
+
+    keys = ['field_id', 'date', 'mean', 'stdDev', 'min', 'max', 'histogram']
+    columns = collection.map(calc_stats).flatten() \
+        .filter(ee.Filter.notNull(keys)) \
+        .sort('date') \
+        .reduceColumns(ee.Reducer.toList().repeat(len(keys)), keys) \
+        .get('list')
+    field_ids, dates, means, std_devs, mins, maxs, histograms = traced_get_info(columns, 'ndvi_stats_batch', ['modis'])
+
+    stats = {}
+    for field_id, date, mean, std_dev, min_value, max_value, histogram in zip(
+            field_ids, dates, means, std_devs, mins, maxs, histograms):
+        stats.setdefault(field_id, []).append({
+            'properties': {'mean': mean, 'stdDev': std_dev, 'min': min_value, 'max': max_value,
+                           'histogram': histogram, 'date': date}
+        })
+    return stats
+
+def ndvi_trend_direction(ndvi_stats: List[Dict[str, Any]]) -> str:
+    ndvi_values = [stat['properties']['mean'] for stat in ndvi_stats]
+    if len(ndvi_values) < 2:
+        return "Stable"
+    ndvi_trend = np.polyfit(range(len(ndvi_values)), ndvi_values, 1)[0]
+    return "Increasing" if ndvi_trend > 0 else "Decreasing" if ndvi_trend < 0 else "Stable"
+
+def _crop_list(crop_type: Union[str, Sequence[str]]) -> List[str]:
+    crop_types = [crop_type] if isinstance(crop_type, str) else list(crop_type)
+    for crop in crop_types:
+        if crop not in CROP_NDVI_THRESHOLDS:
+            raise ValueError(f"Unsupported crop type: {crop}")
+    return crop_types
+
+def _ndvi_series(ndvi_stats: List[Dict[str, Any]]):
+    means = np.array([feature['properties']['mean'] for feature in ndvi_stats], dtype=np.float64)
+    dates = np.array([feature['properties']['date'] for feature in ndvi_stats], dtype='datetime64[D]')
+    doys = (dates - dates.astype('datetime64[Y]')).astype(np.int64) + 1
+    return means, doys
+
+def classify_ndvi(means: np.ndarray, crop_types: Sequence[str]) -> np.ndarray:
+    # (crops, dates) index into HEALTH_CLASSES: how many of a crop's thresholds each mean reaches.
+    # A value on a threshold is in the upper class, as in health_class_fractions_matrix
+    return (means[None, :, None] >= threshold_matrix(crop_types)[:, None, :]).sum(axis=2)
+
+def growth_stages(means: np.ndarray, doys: np.ndarray, crop_types: Sequence[str]):
+    # Matches every date against every crop's stage calendar at once. Returns the (crops, dates)
+    # stage index (-1 off-season), the stage names, and per crop the share of in-season dates
+    # whose NDVI falls inside the range the calendar expects for that stage
+    calendar, names = stage_calendar(crop_types)
+    day = doys[None, :, None]
+    start = calendar['start_doy'][:, None, :]
+    end = calendar['end_doy'][:, None, :]
+    # Stages that end before they start wrap around the new year (e.g. winter wheat dormancy)
+    inside = np.where(start <= end, (day >= start) & (day <= end), (day >= start) | (day <= end))
+    inside &= calendar['valid'][:, None, :]
+    stage_index = np.where(inside.any(axis=2), inside.argmax(axis=2), -1)
+
+    lookup = np.maximum(stage_index, 0)
+    low = np.take_along_axis(calendar['ndvi_min'], lookup, axis=1)
+    high = np.take_along_axis(calendar['ndvi_max'], lookup, axis=1)
+    in_season = (stage_index >= 0) & ~np.isnan(means)[None, :]
+    matches = in_season & (means[None, :] >= low) & (means[None, :] <= high)
+    season_dates = in_season.sum(axis=1)
+    fit = np.divide(matches.sum(axis=1), season_dates, out=np.full(len(crop_types), np.nan), where=season_dates > 0)
+    return stage_index, names, fit
+
+def analyze_vegetation_health(ndvi_stats: List[Dict[str, Any]], crop_type: Union[str, Sequence[str]]) -> Dict[str, Any]:
+    # A list of crops is evaluated against the same statistics and the result is keyed by crop
     if not ndvi_stats:
         raise ValueError("No NDVI statistics available for analysis.")
 
-    if crop_type not in CROP_NDVI_THRESHOLDS:
-        raise ValueError(f"Unsupported crop type: {crop_type}")
-
-    means = [feature['properties']['mean'] for feature in ndvi_stats]
-    current_mean = means[-1]
+    crop_types = _crop_list(crop_type)
+    means, doys = _ndvi_series(ndvi_stats)
+    current_mean = ndvi_stats[-1]['properties']['mean']
     historical_mean = np.mean(means[:-1]) if len(means) > 1 else current_mean
 
-    thresholds = CROP_NDVI_THRESHOLDS[crop_type]
-    
-    if current_mean > thresholds["good"]:
-        health = "Excellent"
-    elif current_mean > thresholds["fair"]:
-        health = "Good"
-    elif current_mean > thresholds["poor"]:
-        health = "Fair"
-    else:
-        health = "Poor"
-    
-    return {
-        "current_ndvi": current_mean,
-        "historical_average_ndvi": historical_mean,
-        "vegetation_health": health,
-        "ndvi_min": min(feature['properties']['min'] for feature in ndvi_stats),
-        "ndvi_max": max(feature['properties']['max'] for feature in ndvi_stats)
-    }
+    health = classify_ndvi(means[-1:], crop_types)[:, 0]
+    stage_index, stage_names, fit = growth_stages(means, doys, crop_types)
+    current_counts = ndvi_stats[-1]['properties'].get('histogram')
+    fractions = health_class_fractions_matrix([current_counts], crop_types)[:, 0] if current_counts is not None else None
+    ndvi_min = min(feature['properties']['min'] for feature in ndvi_stats)
+    ndvi_max = max(feature['properties']['max'] for feature in ndvi_stats)
 
-def predict_harvest(ndvi_stats: List[Dict[str, Any]], crop_type: str) -> str:
+    results = {}
+    for i, crop in enumerate(crop_types):
+        results[crop] = {
+            "current_ndvi": current_mean,
+            "historical_average_ndvi": historical_mean,
+            "vegetation_health": HEALTH_LABELS[health[i]],
+            "class_fractions": dict(zip(HEALTH_CLASSES, fractions[i].tolist())) if fractions is not None else None,
+            "growth_stage": stage_names[i][stage_index[i, -1]] if stage_index[i, -1] >= 0 else OFF_SEASON,
+            "calendar_fit": None if np.isnan(fit[i]) else float(fit[i]),
+            "ndvi_min": ndvi_min,
+            "ndvi_max": ndvi_max
+        }
+    return results[crop_type] if isinstance(crop_type, str) else results
+
+def predict_harvest(ndvi_stats: List[Dict[str, Any]], crop_type: Union[str, Sequence[str]],
+                    phenology: Optional[Dict[str, Any]] = None) -> Union[str, Dict[str, str]]:
     if not ndvi_stats:
         raise ValueError("No NDVI statistics available for prediction.")
 
-    if crop_type not in CROP_NDVI_THRESHOLDS:
-        raise ValueError(f"Unsupported crop type: {crop_type}")
-
-    current_ndvi = ndvi_stats[-1]['properties']['mean']
-    thresholds = CROP_NDVI_THRESHOLDS[crop_type]
-
-    if current_ndvi > thresholds["good"]:
-        return "Excellent yield expected"
-    elif current_ndvi > thresholds["fair"]:
-        return "Good yield expected"
-    elif current_ndvi > thresholds["poor"]:
-        return "Fair yield expected"
-    else:
-        return "Poor yield expected"
+    crop_types = _crop_list(crop_type)
+    if phenology is None:
+        phenology = fit_phenology([ndvi_stats])[0]
+    # Once the season has peaked, yield potential is judged on the fitted peak instead of the latest composite
+    reference = phenology['peak_ndvi'] if phenology.get('peak_date') else ndvi_stats[-1]['properties']['mean']
+    health = classify_ndvi(np.array([reference], dtype=np.float64), crop_types)[:, 0]
+    predictions = {crop: f"{HEALTH_LABELS[health[i]]} yield expected" for i, crop in enumerate(crop_types)}
+    return predictions[crop_type] if isinstance(crop_type, str) else predictions
 
-def analyze_farm(aoi: ee.Geometry, start_date: str, end_date: str, crop_type: str) -> Dict[str, Any]:
+def analyze_farm(aoi: ee.Geometry, start_date: str, end_date: str, crop_type: Union[str, Sequence[str]]) -> Dict[str, Any]:
     try:
+        crop_types = _crop_list(crop_type)
+        # One Earth Engine reduction, however many crops are compared against it
         ndvi_stats = calculate_ndvi_stats(aoi, start_date, end_date)
-        vegetation_health = analyze_vegetation_health(ndvi_stats, crop_type)
-        harvest_prediction = predict_harvest(ndvi_stats, crop_type)
-        
-        # Calculate NDVI trend
-        ndvi_values = [stat['properties']['mean'] for stat in ndvi_stats]
-        ndvi_trend = np.polyfit(range(len(ndvi_values)), ndvi_values, 1)[0]
-        
-        return {
+        vegetation_health = analyze_vegetation_health(ndvi_stats, crop_types)
+        phenology = fit_phenology([ndvi_stats])[0]
+        harvest_prediction = predict_harvest(ndvi_stats, crop_types, phenology)
+        single_crop = crop_types[0] if len(crop_types) == 1 else None
+        add_health_class_fractions(ndvi_stats, single_crop or crop_types)
+
+        result = {
+            "ndvi_histogram_bins": ndvi_histogram_edges(),
             "ndvi_stats": ndvi_stats,
-            "vegetation_health": vegetation_health,
-            "harvest_prediction": harvest_prediction,
-            "ndvi_trend": "Increasing" if ndvi_trend > 0 else "Decreasing" if ndvi_trend < 0 else "Stable"
         }
+        if single_crop:
+            result["vegetation_health"] = vegetation_health[single_crop]
+            result["harvest_prediction"] = harvest_prediction[single_crop]
+            result["phenology"] = {**phenology, "harvest_window": harvest_window(phenology, single_crop)}
+        else:
+            result["phenology"] = phenology
+            result["crops"] = {
+                crop: {"vegetation_health": vegetation_health[crop], "harvest_prediction": harvest_prediction[crop],
+                       "harvest_window": harvest_window(phenology, crop)}
+                for crop in crop_types
+            }
+            # Best calendar match first; crops with no in-season dates go last
+            fits = {crop: vegetation_health[crop]["calendar_fit"] for crop in crop_types}
+            result["crop_ranking"] = sorted(crop_types, key=lambda crop: (fits[crop] is None, -(fits[crop] or 0)))
+        result["ndvi_trend"] = ndvi_trend_direction(ndvi_stats)
+        return result
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
@@ -119,35 +291,41 @@ def analyze_farm(aoi: ee.Geometry, start_date: str, end_date: str, crop_type: st
     
 
 
+def ndvi_trend_collection(aoi: ee.Geometry, start_date: str, end_date: str):
+    start = ee.Date(start_date)
+    end = ee.Date(end_date)
+
+    collection = ee.ImageCollection(MODIS_NDVI_COLLECTION) \
+        .filterDate(start, end) \
+        .filterBounds(aoi)
+
+    def calculate_ndvi(image):
+        date = image.date().format('YYYY-MM-dd')
+        ndvi = image.select('NDVI').multiply(0.0001)  # Scale factor for MODIS NDVI
+        mean_ndvi = ndvi.reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=aoi,
+            scale=250,
+            maxPixels=1e9
+        ).get('NDVI')
+        return ee.Feature(None, {'date': date, 'ndvi': mean_ndvi})
+
+    return collection, collection.map(calculate_ndvi)
+
+@instrument('get_ndvi_trend')
 def get_ndvi_trend(aoi: ee.Geometry, start_date: str, end_date: str) -> List[Dict[str, Any]]:
     try:
-        start = ee.Date(start_date)
-        end = ee.Date(end_date)
-
-        collection = ee.ImageCollection('MODIS/006/MOD13Q1') \
-            .filterDate(start, end) \
-            .filterBounds(aoi)
+        collection, ndvi_features = ndvi_trend_collection(aoi, start_date, end_date)
 
         # Log the size of the collection
-        collection_size = collection.size().getInfo()
+        collection_size = traced_get_info(collection.size(), 'collection_size', ['modis'])
         logging.info(f"Collection size: {collection_size}")
 
         if collection_size == 0:
             logging.warning(f"No images found for the given date range and area. Start: {start_date}, End: {end_date}")
             return []
 
-        def calculate_ndvi(image):
-            date = image.date().format('YYYY-MM-dd')
-            ndvi = image.select('NDVI').multiply(0.0001)  # Scale factor for MODIS NDVI
-            mean_ndvi = ndvi.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=aoi,
-                scale=250,
-                maxPixels=1e9
-            ).get('NDVI')
-            return ee.Feature(None, {'date': date, 'ndvi': mean_ndvi})
-
-        ndvi_trend = collection.map(calculate_ndvi).getInfo()
+        ndvi_trend = traced_get_info(ndvi_features, 'ndvi_trend', ['modis'])
         
         # Log the number of features returned
         logging.info(f"Number of NDVI data points: {len(ndvi_trend['features'])}")
@@ -161,4 +339,111 @@ def get_ndvi_trend(aoi: ee.Geometry, start_date: str, end_date: str) -> List[Dic
         ]
     except Exception as e:
         logging.error(f"Error calculating NDVI trend: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error calculating NDVI trend: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error calculating NDVI trend: {str(e)}")
+
+@instrument('get_ndvi_trend_columns')
+def get_ndvi_trend_columns(aoi: ee.Geometry, start_date: str, end_date: str) -> Dict[str, List[Any]]:
+    try:
+        _, ndvi_features = ndvi_trend_collection(aoi, start_date, end_date)
+
+        # Earth Engine returns the series as two parallel lists, so no per-feature dicts are built;
+        # dates without valid pixels are dropped to keep the columns aligned
+        columns = ndvi_features \
+            .filter(ee.Filter.notNull(['ndvi'])) \
+            .reduceColumns(ee.Reducer.toList().repeat(2), ['date', 'ndvi']) \
+            .get('list')
+        dates, ndvi = traced_get_info(columns, 'ndvi_trend_columns', ['modis'])
+
+        logging.info(f"Number of NDVI data points: {len(dates)}")
+        return {'date': dates, 'ndvi': ndvi}
+    except Exception as e:
+        logging.error(f"Error calculating NDVI trend: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error calculating NDVI trend: {str(e)}")
+
+def calculate_trendline(dates: List[str], ndvi_values: List[float]) -> Dict[str, Any]:
+    # Simple linear regression of NDVI against time
+    timestamps = np.array(dates, dtype='datetime64[D]').astype('datetime64[s]').astype(np.float64)
+
+    if len(timestamps) > 1:
+        coeffs = np.polyfit(timestamps, ndvi_values, 1)
+        trendline = np.poly1d(coeffs)
+        trend_start = float(trendline(timestamps[0]))
+        trend_end = float(trendline(timestamps[-1]))
+
+        trend_direction = "Increasing" if coeffs[0] > 0 else "Decreasing" if coeffs[0] < 0 else "Stable"
+    else:
+        trend_start = trend_end = ndvi_values[0] if len(ndvi_values) else None
+        trend_direction = "Insufficient data"
+
+    return {"start": trend_start, "end": trend_end, "direction": trend_direction}
+
+def _period_composite(aoi: ee.Geometry, start_date: str, end_date: str):
+    collection = ee.ImageCollection(MODIS_NDVI_COLLECTION) \
+        .filterDate(start_date, end_date) \
+        .filterBounds(aoi) \
+        .select('NDVI')
+    return collection, collection.median().divide(10000)
+
+@instrument('calculate_ndvi_change')
+def calculate_ndvi_change(aoi: ee.Geometry, before_start: str, before_end: str, after_start: str, after_end: str,
+                          thumbnail_key: Optional[str] = None) -> Dict[str, Any]:
+    before_collection, before = _period_composite(aoi, before_start, before_end)
+    after_collection, after = _period_composite(aoi, after_start, after_end)
+    change = after.subtract(before).rename('change')
+
+    stacked = before.rename('before') \
+        .addBands(after.rename('after')) \
+        .addBands(change) \
+        .addBands(change.lt(-NDVI_CHANGE_THRESHOLD).rename('loss')) \
+        .addBands(change.gt(NDVI_CHANGE_THRESHOLD).rename('gain'))
+    stats = stacked.reduceRegion(
+        reducer=ee.Reducer.mean().combine(ee.Reducer.stdDev(), None, True).combine(ee.Reducer.minMax(), None, True),
+        geometry=aoi,
+        scale=250,
+        maxPixels=1e9
+    )
+
+    # Both composites, the difference and every statistic in one round-trip; the reduction
+    # is skipped server-side when either period has no images
+    info = traced_get_info(ee.Dictionary({
+        'before_count': before_collection.size(),
+        'after_count': after_collection.size(),
+        'stats': ee.Algorithms.If(before_collection.size().gt(0).And(after_collection.size().gt(0)), stats, None),
+    }), 'ndvi_change', ['modis'])
+
+    if info['stats'] is None:
+        raise ValueError("No MODIS data available for one of the periods at this location.")
+    stats = info['stats']
+
+    result = {
+        "before": {
+            "start_date": before_start,
+            "end_date": before_end,
+            "image_count": info['before_count'],
+            "mean_ndvi": stats.get('before_mean'),
+            "stdDev": stats.get('before_stdDev'),
+        },
+        "after": {
+            "start_date": after_start,
+            "end_date": after_end,
+            "image_count": info['after_count'],
+            "mean_ndvi": stats.get('after_mean'),
+            "stdDev": stats.get('after_stdDev'),
+        },
+        "change": {
+            "mean": stats.get('change_mean'),
+            "stdDev": stats.get('change_stdDev'),
+            "min": stats.get('change_min'),
+            "max": stats.get('change_max'),
+            "loss_fraction": stats.get('loss_mean'),
+            "gain_fraction": stats.get('gain_mean'),
+        },
+        "change_threshold": NDVI_CHANGE_THRESHOLD,
+    }
+
+    if thumbnail_key:
+        result["change_thumbnail_url"] = cache_ee_thumbnail(
+            change.clip(aoi), {**CHANGE_VIS, 'dimensions': 512, 'region': aoi}, thumbnail_key, ['modis']
+        )
+    return result
+
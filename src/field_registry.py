@@ -0,0 +1,256 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import closing
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from .startup import lazy_import, ee_ready
+from .db import get_connection
+from .tracing import span, traced_get_info
+from .circuit_breaker import no_deadline
+from .farm_analysis import (calculate_ndvi_stats_batch, analyze_vegetation_health,
+                            predict_harvest, ndvi_trend_direction, add_health_class_fractions,
+                            ndvi_histogram_edges)
+from .weather_analysis import analyze_weather_batch, summarize_climate
+from .phenology import fit_phenology, harvest_window
+from .settings import (FIELD_SCHEDULER_INTERVAL, FIELD_BATCH_SIZE, FIELD_NDVI_DAYS, FIELD_CLIMATE_DAYS,
+                       FIELD_CMIP6_MODEL, FIELD_CMIP6_SCENARIO, FIELD_NDVI_COLLECTION, FIELD_COMPOSITE_MAX_AGE_DAYS)
+
+ee = lazy_import('ee')
+
+# A worker holds the precompute lease while it runs, so only one worker per host does the work
+LEASE_SECONDS = 30 * 60
+EE_WAIT_INTERVAL = 30
+# Field-days per climate getInfo, to stay well under Earth Engine's per-request element limit
+MAX_WEATHER_VALUES_PER_CALL = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fields (
+    field_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    crop_type TEXT NOT NULL,
+    geometry TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS field_summaries (
+    field_id TEXT PRIMARY KEY REFERENCES fields(field_id) ON DELETE CASCADE,
+    composite_date TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+_worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _connect():
+    conn = get_connection('fields')
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _field_row_to_dict(row) -> Dict[str, Any]:
+    return {
+        "field_id": row['field_id'],
+        "name": row['name'],
+        "crop_type": row['crop_type'],
+        "geometry": json.loads(row['geometry']),
+        "created_at": row['created_at'],
+    }
+
+
+def register_field(name: str, crop_type: str, geometry: Dict[str, Any]) -> Dict[str, Any]:
+    field_id = uuid.uuid4().hex
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO fields (field_id, name, crop_type, geometry, created_at) VALUES (?, ?, ?, ?, ?)",
+            (field_id, name, crop_type, json.dumps(geometry), time.time())
+        )
+    return get_field(field_id)
+
+
+def delete_field(field_id: str) -> bool:
+    with closing(_connect()) as conn, conn:
+        return conn.execute("DELETE FROM fields WHERE field_id = ?", (field_id,)).rowcount > 0
+
+
+def list_fields() -> List[Dict[str, Any]]:
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT f.*, s.composite_date, s.computed_at FROM fields f "
+            "LEFT JOIN field_summaries s ON s.field_id = f.field_id ORDER BY f.created_at"
+        ).fetchall()
+    return [{**_field_row_to_dict(row), "composite_date": row['composite_date'], "computed_at": row['computed_at']}
+            for row in rows]
+
+
+def get_field(field_id: str) -> Optional[Dict[str, Any]]:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT * FROM fields WHERE field_id = ?", (field_id,)).fetchone()
+    return _field_row_to_dict(row) if row else None
+
+
+def get_field_summary(field_id: str) -> Optional[Dict[str, Any]]:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT * FROM field_summaries WHERE field_id = ?", (field_id,)).fetchone()
+    if row is None:
+        return None
+    return {"composite_date": row['composite_date'], "computed_at": row['computed_at'], **json.loads(row['summary'])}
+
+
+def latest_composite_date() -> Optional[str]:
+    # No date window, so a collection that stopped updating shows up as an old date rather than as nothing
+    latest = ee.ImageCollection(FIELD_NDVI_COLLECTION).aggregate_max('system:time_start')
+    latest_ms = traced_get_info(latest, 'latest_composite', ['modis'])
+    if latest_ms is None:
+        return None
+    return datetime.fromtimestamp(latest_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _fields_collection(fields: List[Dict[str, Any]]):
+    return ee.FeatureCollection([
+        ee.Feature(ee.Geometry(field['geometry']), {'field_id': field['field_id']})
+        for field in fields
+    ])
+
+
+def summarize_field(field: Dict[str, Any], ndvi_stats: List[Dict[str, Any]],
+                    weather: Optional[Dict[str, List[float]]], phenology: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {"ndvi_histogram_bins": ndvi_histogram_edges(), "ndvi_stats": ndvi_stats}
+    if ndvi_stats:
+        add_health_class_fractions(ndvi_stats, field['crop_type'])
+        summary.update({
+            "vegetation_health": analyze_vegetation_health(ndvi_stats, field['crop_type']),
+            "harvest_prediction": predict_harvest(ndvi_stats, field['crop_type'], phenology),
+            "phenology": {**phenology, "harvest_window": harvest_window(phenology, field['crop_type'])},
+            "ndvi_trend": ndvi_trend_direction(ndvi_stats),
+        })
+    if weather and weather['temperature']:
+        summary.update(summarize_climate(weather['temperature'], weather['precipitation']))
+    return summary
+
+
+def precompute_fields(fields: List[Dict[str, Any]], composite_date: str) -> int:
+    end = datetime.strptime(composite_date, '%Y-%m-%d') + timedelta(days=1)
+    ndvi_start = (end - timedelta(days=FIELD_NDVI_DAYS)).strftime('%Y-%m-%d')
+    climate_start = (end - timedelta(days=FIELD_CLIMATE_DAYS)).strftime('%Y-%m-%d')
+    end_date = end.strftime('%Y-%m-%d')
+
+    ndvi_stats = calculate_ndvi_stats_batch(_fields_collection(fields), ndvi_start, end_date, FIELD_NDVI_COLLECTION)
+    weather = {}
+    chunk_size = max(1, MAX_WEATHER_VALUES_PER_CALL // FIELD_CLIMATE_DAYS)
+    for start in range(0, len(fields), chunk_size):
+        weather.update(analyze_weather_batch(_fields_collection(fields[start:start + chunk_size]), climate_start, end_date,
+                                             FIELD_CMIP6_MODEL, FIELD_CMIP6_SCENARIO, FIELD_NDVI_COLLECTION, FIELD_COMPOSITE_MAX_AGE_DAYS))
+    # Curve fitting for the whole batch is a single vectorized pass
+    series = [ndvi_stats.get(field['field_id'], []) for field in fields]
+    phenology = fit_phenology(series)
+
+    rows = []
+    for field, field_stats, field_phenology in zip(fields, series, phenology):
+        try:
+            summary = summarize_field(field, field_stats, weather.get(field['field_id']), field_phenology)
+        except ValueError as e:
+            logging.warning(f"Could not summarize field {field['field_id']}: {str(e)}")
+            continue
+        rows.append((field['field_id'], composite_date, time.time(), json.dumps(summary)))
+
+    with closing(_connect()) as conn, conn:
+        # Fields deleted while the batch was running are skipped by the join
+        conn.executemany(
+            "INSERT OR REPLACE INTO field_summaries (field_id, composite_date, computed_at, summary) "
+            "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM fields WHERE field_id = ?)",
+            [row + (row[0],) for row in rows]
+        )
+    return len(rows)
+
+
+def _claim_lease(conn, name: str) -> bool:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT owner, expires_at FROM scheduler_leases WHERE name = ?", (name,)).fetchone()
+        if row and row['owner'] != _worker_id and row['expires_at'] > time.time():
+            conn.rollback()
+            return False
+        conn.execute("INSERT OR REPLACE INTO scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                     (name, _worker_id, time.time() + LEASE_SECONDS))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _renew_lease(conn, name: str) -> bool:
+    # False when the lease expired and another worker has taken it over
+    with conn:
+        return conn.execute("UPDATE scheduler_leases SET expires_at = ? WHERE name = ? AND owner = ?",
+                            (time.time() + LEASE_SECONDS, name, _worker_id)).rowcount > 0
+
+
+def _release_lease(conn, name: str):
+    with conn:
+        conn.execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (name, _worker_id))
+
+
+def precompute_due_fields() -> Dict[str, Any]:
+    with closing(_connect()) as conn:
+        if conn.execute("SELECT 1 FROM fields LIMIT 1").fetchone() is None:
+            return {"status": "no_fields", "computed": 0}
+        if not _claim_lease(conn, 'precompute'):
+            return {"status": "running_elsewhere", "computed": 0}
+
+        try:
+            composite_date = latest_composite_date()
+            if composite_date is None:
+                logging.warning(f"No composites found in {FIELD_NDVI_COLLECTION}; field summaries are not updated")
+                return {"status": "no_composite", "computed": 0}
+            age_days = (datetime.now(timezone.utc).date() - date.fromisoformat(composite_date)).days
+            if age_days > FIELD_COMPOSITE_MAX_AGE_DAYS:
+                logging.warning(f"Latest composite in {FIELD_NDVI_COLLECTION} is from {composite_date}, {age_days} days ago; "
+                                f"the collection looks discontinued, so field summaries are not updated")
+                return {"status": "stale_collection", "composite_date": composite_date, "computed": 0}
+
+            due = [_field_row_to_dict(row) for row in conn.execute(
+                "SELECT f.* FROM fields f LEFT JOIN field_summaries s ON s.field_id = f.field_id "
+                "WHERE s.composite_date IS NULL OR s.composite_date < ?", (composite_date,)
+            )]
+            computed = 0
+            for start in range(0, len(due), FIELD_BATCH_SIZE):
+                # The lease only has to outlast one batch, however many batches the run has
+                if not _renew_lease(conn, 'precompute'):
+                    logging.warning(f"Precompute lease lost after {computed} field(s); stopping this run")
+                    return {"status": "lease_lost", "composite_date": composite_date, "due": len(due), "computed": computed}
+                batch = due[start:start + FIELD_BATCH_SIZE]
+                with span('precompute_batch', fields=len(batch), composite_date=composite_date), no_deadline():
+                    computed += precompute_fields(batch, composite_date)
+            if due:
+                logging.info(f"Precomputed summaries for {computed} of {len(due)} field(s), composite {composite_date}")
+            return {"status": "ok", "composite_date": composite_date, "due": len(due), "computed": computed}
+        finally:
+            _release_lease(conn, 'precompute')
+
+
+async def run_field_scheduler():
+    # Runs in every worker; the SQLite lease keeps the workers from duplicating a run
+    while True:
+        if not ee_ready.is_set():
+            await asyncio.sleep(EE_WAIT_INTERVAL)
+            continue
+        try:
+            await run_in_threadpool(precompute_due_fields)
+        except Exception as e:
+            logging.error(f"Field precompute run failed: {str(e)}")
+        await asyncio.sleep(FIELD_SCHEDULER_INTERVAL)
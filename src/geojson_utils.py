@@ -1,4 +1,8 @@
-import ee
+from __future__ import annotations
+
+from .startup import lazy_import
+
+ee = lazy_import('ee')
 
 def process_geojson(geojson_data):
     if isinstance(geojson_data, dict):
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from itertools import chain
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from pydantic_core import core_schema
+
+from .startup import lazy_import
+
+ee = lazy_import('ee')
+
+GEOMETRY_TYPES = ("Polygon", "MultiPolygon")
+MIN_RING_VERTICES = 4
+
+
+class GeoJSONGeometry:
+    # Polygon / MultiPolygon with all vertices in one contiguous (n, 2) float64 array.
+    # coords[ring_offsets[i]:ring_offsets[i + 1]] is ring i and
+    # ring_offsets[polygon_offsets[j]:polygon_offsets[j + 1] + 1] bounds the rings of polygon j.
+    __slots__ = ("type", "coords", "ring_offsets", "polygon_offsets")
+
+    def __init__(self, type: str, coords: np.ndarray, ring_offsets: np.ndarray, polygon_offsets: np.ndarray):
+        self.type = type
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+
+    @classmethod
+    def from_geojson(cls, value: Dict[str, Any]) -> "GeoJSONGeometry":
+        if not isinstance(value, dict):
+            raise ValueError("Geometry must be a GeoJSON object")
+        geometry_type = value.get("type")
+        if geometry_type not in GEOMETRY_TYPES:
+            raise ValueError(f"Unsupported geometry type: {geometry_type}. Use one of {list(GEOMETRY_TYPES)}.")
+
+        coordinates = value.get("coordinates")
+        if not isinstance(coordinates, list) or not coordinates:
+            raise ValueError("Geometry coordinates must be a non-empty list")
+        polygons = [coordinates] if geometry_type == "Polygon" else coordinates
+
+        try:
+            rings = list(chain.from_iterable(polygons))
+            ring_lengths = [len(ring) for ring in rings]
+            coords = np.array(list(chain.from_iterable(rings)), dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Geometry coordinates must be nested lists of [lon, lat] positions")
+        if coords.ndim != 2 or coords.shape[1] < 2:
+            raise ValueError("Geometry coordinates must be nested lists of [lon, lat] positions")
+
+        geometry = cls(
+            geometry_type,
+            np.ascontiguousarray(coords[:, :2]),  # altitude is dropped
+            np.concatenate(([0], np.cumsum(ring_lengths))).astype(np.int64),
+            np.concatenate(([0], np.cumsum([len(polygon) for polygon in polygons]))).astype(np.int64)
+        )
+        geometry.validate()
+        return geometry
+
+    def validate(self):
+        ring_lengths = np.diff(self.ring_offsets)
+        if len(ring_lengths) == 0 or (np.diff(self.polygon_offsets) == 0).any():
+            raise ValueError("Every polygon needs at least one ring")
+        if (ring_lengths < MIN_RING_VERTICES).any():
+            raise ValueError(f"Every ring needs at least {MIN_RING_VERTICES} positions")
+        if not np.isfinite(self.coords).all():
+            raise ValueError("Coordinates must be finite numbers")
+
+        lon, lat = self.coords[:, 0], self.coords[:, 1]
+        if (np.abs(lon) > 180).any() or (np.abs(lat) > 90).any():
+            raise ValueError("Coordinates must be within [-180, 180] longitude and [-90, 90] latitude")
+
+        first = self.coords[self.ring_offsets[:-1]]
+        last = self.coords[self.ring_offsets[1:] - 1]
+        open_rings = np.flatnonzero((first != last).any(axis=1))
+        if len(open_rings):
+            raise ValueError(f"Ring {int(open_rings[0])} is not closed (first and last positions differ)")
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        lon_min, lat_min = self.coords.min(axis=0)
+        lon_max, lat_max = self.coords.max(axis=0)
+        return float(lon_min), float(lat_min), float(lon_max), float(lat_max)
+
+    def rings(self) -> List[np.ndarray]:
+        return np.split(self.coords, self.ring_offsets[1:-1])
+
+    @property
+    def coordinates(self) -> List:
+        # One tolist() over the whole array; the rings are list slices of it (references, not copies of the positions)
+        positions = self.coords.tolist()
+        rings = [positions[start:end] for start, end in zip(self.ring_offsets[:-1], self.ring_offsets[1:])]
+        polygons = [rings[start:end] for start, end in zip(self.polygon_offsets[:-1], self.polygon_offsets[1:])]
+        return polygons[0] if self.type == "Polygon" else polygons
+
+    def to_geojson(self) -> Dict[str, Any]:
+        return {"type": self.type, "coordinates": self.coordinates}
+
+    def to_ee(self) -> ee.Geometry:
+        # ee.Geometry only accepts GeoJSON made of Python lists: it checks the nesting depth of every ring and
+        # JSON-encodes the coordinates as given, so an ndarray or a flat array plus offsets cannot be passed through.
+        # The nested lists are built once, as slices of a single tolist()
+        return ee.Geometry(self.to_geojson())
+
+    @classmethod
+    def _validate(cls, value: Any) -> "GeoJSONGeometry":
+        if isinstance(value, cls):
+            return value
+        return cls.from_geojson(value)
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda geometry: geometry.to_geojson())
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "enum": list(GEOMETRY_TYPES)},
+                "coordinates": {"type": "array", "items": {"type": "array"}}
+            },
+            "required": ["type", "coordinates"]
+        }
+
+    def __repr__(self):
+        return f"GeoJSONGeometry(type={self.type!r}, vertices={len(self.coords)}, rings={len(self.ring_offsets) - 1})"
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import json
+import time
+from contextlib import closing
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from .startup import lazy_import
+from .db import get_connection
+from .metrics import instrument, record_cache_lookup
+from .tracing import traced_get_info
+from .farm_analysis import MODIS_NDVI_COLLECTION
+from .settings import GRID_MAX_CELLS, GRID_CACHE_TTL
+
+ee = lazy_import('ee')
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GRID_PRECISIONS = range(3, 8)
+GRID_LAYERS = ('ndvi', 'climate')
+# Ranges ending this long ago only cover final, reprocessed data, so their cells never expire
+SETTLED_AFTER_DAYS = 32
+CMIP6_SCALE = 27830
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grid_cells (
+    layer TEXT NOT NULL,
+    cell_id TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    stats TEXT,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (layer, cell_id, start_date, end_date)
+);
+"""
+
+
+def _connect():
+    conn = get_connection('grid_cells')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _bit_counts(precision: int) -> Tuple[int, int]:
+    # Geohash interleaves longitude and latitude bits, starting with longitude
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    lon_bits, lat_bits = _bit_counts(precision)
+    return 360.0 / 2 ** lon_bits, 180.0 / 2 ** lat_bits
+
+
+def encode_cells(lon_index: np.ndarray, lat_index: np.ndarray, precision: int) -> List[str]:
+    lon_bits, lat_bits = _bit_counts(precision)
+    value = np.zeros(len(lon_index), dtype=np.int64)
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            source, position = lon_index, lon_bits - 1 - bit // 2
+        else:
+            source, position = lat_index, lat_bits - 1 - bit // 2
+        value = (value << 1) | ((source >> position) & 1)
+
+    chars = np.array(list(GEOHASH_ALPHABET))
+    digits = np.stack([(value >> (5 * (precision - 1 - i))) & 31 for i in range(precision)], axis=1)
+    return [''.join(row) for row in chars[digits]]
+
+
+def decode_cell(cell_id: str) -> Tuple[float, float, float, float]:
+    precision = len(cell_id)
+    lon_bits, lat_bits = _bit_counts(precision)
+    value = 0
+    for char in cell_id:
+        value = (value << 5) | GEOHASH_ALPHABET.index(char)
+    lon_index = lat_index = 0
+    for bit in range(5 * precision):
+        bit_value = (value >> (5 * precision - 1 - bit)) & 1
+        if bit % 2 == 0:
+            lon_index = (lon_index << 1) | bit_value
+        else:
+            lat_index = (lat_index << 1) | bit_value
+    width, height = cell_size(precision)
+    west, south = -180.0 + lon_index * width, -90.0 + lat_index * height
+    return west, south, west + width, south + height
+
+
+def cover_region(region: Dict[str, Any], bounds: Tuple[float, float, float, float], precision: int) -> List[str]:
+    # Every cell of the geohash grid that intersects the region, in row-major order
+    import shapely
+    from shapely.geometry import shape
+
+    lon_bits, lat_bits = _bit_counts(precision)
+    width, height = cell_size(precision)
+    west, south, east, north = bounds
+    lon_range = np.arange(int((west + 180) // width), min(int((east + 180) // width), 2 ** lon_bits - 1) + 1)
+    lat_range = np.arange(int((south + 90) // height), min(int((north + 90) // height), 2 ** lat_bits - 1) + 1)
+    if len(lon_range) * len(lat_range) > GRID_MAX_CELLS:
+        raise ValueError(f"The region covers {len(lon_range) * len(lat_range)} cells at precision {precision}; "
+                         f"the limit is {GRID_MAX_CELLS}. Use a lower precision.")
+
+    lon_index, lat_index = [grid.ravel() for grid in np.meshgrid(lon_range, lat_range)]
+    boxes = shapely.box(-180 + lon_index * width, -90 + lat_index * height,
+                        -180 + (lon_index + 1) * width, -90 + (lat_index + 1) * height)
+    inside = shapely.intersects(boxes, shape(region))
+    return encode_cells(lon_index[inside], lat_index[inside], precision)
+
+
+def _cell_collection(cell_ids: List[str]):
+    return ee.FeatureCollection([
+        ee.Feature(ee.Geometry.Rectangle(list(decode_cell(cell_id)), None, False), {'cell_id': cell_id})
+        for cell_id in cell_ids
+    ])
+
+
+def _layer_image(layer: str, start_date: str, end_date: str, precision: int):
+    if layer == 'ndvi':
+        image = ee.ImageCollection(MODIS_NDVI_COLLECTION).filterDate(start_date, end_date) \
+            .select('NDVI').mean().divide(10000).rename('ndvi')
+        reducer = ee.Reducer.mean().combine(ee.Reducer.stdDev(), None, True) \
+            .combine(ee.Reducer.minMax(), None, True).combine(ee.Reducer.count(), None, True)
+        return image, reducer, 250
+
+    image = ee.ImageCollection('NASA/GDDP-CMIP6').filterDate(start_date, end_date).select(['tas', 'pr']).mean()
+    image = image.select('tas').subtract(273.15).rename('temperature') \
+        .addBands(image.select('pr').multiply(86400).rename('precipitation'))  # Celsius, mm/day
+    # Cells can be smaller than a CMIP6 pixel; sample finer so every cell gets a value
+    height_m = cell_size(precision)[1] * 111320
+    return image, ee.Reducer.mean(), min(CMIP6_SCALE, height_m / 2)
+
+
+@instrument('compute_grid_cells')
+def compute_grid_cells(layer: str, cell_ids: List[str], start_date: str, end_date: str) -> Dict[str, Dict[str, Any]]:
+    # One reduceRegions call for every missing cell
+    image, reducer, scale = _layer_image(layer, start_date, end_date, len(cell_ids[0]))
+    stats = image.reduceRegions(collection=_cell_collection(cell_ids), reducer=reducer, scale=scale) \
+        .map(lambda feature: feature.setGeometry(None))
+    features = traced_get_info(stats, f'grid_{layer}', ['modis' if layer == 'ndvi' else 'cmip6'])['features']
+
+    results = {}
+    for feature in features:
+        properties = dict(feature['properties'])
+        cell_id = properties.pop('cell_id')
+        results[cell_id] = properties if any(value is not None for value in properties.values()) else None
+    return results
+
+
+def _expires(end_date: str) -> bool:
+    return date.fromisoformat(end_date) > date.today() - timedelta(days=SETTLED_AFTER_DAYS)
+
+
+def grid_stats(layer: str, region: Dict[str, Any], bounds: Tuple[float, float, float, float], precision: int,
+               start_date: str, end_date: str) -> Dict[str, Any]:
+    cell_ids = cover_region(region, bounds, precision)
+    if not cell_ids:
+        raise ValueError("The region does not intersect any grid cell.")
+
+    oldest = time.time() - GRID_CACHE_TTL if _expires(end_date) else 0
+    with closing(_connect()) as conn:
+        cached = {}
+        # Looked up in chunks to stay under SQLite's bound-parameter limit
+        for start in range(0, len(cell_ids), 500):
+            chunk = cell_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT cell_id, stats FROM grid_cells WHERE layer = ? AND start_date = ? AND end_date = ? "
+                f"AND computed_at >= ? AND cell_id IN ({','.join('?' * len(chunk))})",
+                (layer, start_date, end_date, oldest, *chunk)
+            ).fetchall()
+            cached.update({row['cell_id']: json.loads(row['stats']) if row['stats'] else None for row in rows})
+
+        missing = [cell_id for cell_id in cell_ids if cell_id not in cached]
+        record_cache_lookup('grid_cells', True, len(cached))
+        record_cache_lookup('grid_cells', False, len(missing))
+
+        computed = {}
+        if missing:
+            computed = compute_grid_cells(layer, missing, start_date, end_date)
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO grid_cells (layer, cell_id, start_date, end_date, stats, computed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(layer, cell_id, start_date, end_date,
+                      json.dumps(computed[cell_id]) if computed.get(cell_id) else None, now) for cell_id in missing]
+                )
+
+    features = []
+    for cell_id in cell_ids:
+        west, south, east, north = decode_cell(cell_id)
+        features.append({
+            "type": "Feature",
+            "id": cell_id,
+            "geometry": {"type": "Polygon", "coordinates": [[[west, south], [east, south], [east, north],
+                                                             [west, north], [west, south]]]},
+            "properties": {"cell_id": cell_id, **(cached.get(cell_id) or computed.get(cell_id) or {})},
+        })
+    return {
+        "type": "FeatureCollection",
+        "layer": layer,
+        "precision": precision,
+        "cached_cells": len(cached),
+        "computed_cells": len(missing),
+        "features": features,
+    }
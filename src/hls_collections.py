@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from .startup import lazy_import
+
+ee = lazy_import('ee')
+
+HLS_L30 = 'NASA/HLS/HLSL30/v002'
+HLS_S30 = 'NASA/HLS/HLSS30/v002'
+
+# Bands kept from each sensor, renamed to the L30 names used throughout the API
+# (Sentinel-2 narrow NIR B8A plays the role of Landsat B5)
+HLS_BANDS = {
+    HLS_L30: ['B2', 'B3', 'B4', 'B5', 'Fmask'],
+    HLS_S30: ['B2', 'B3', 'B4', 'B8A', 'Fmask'],
+}
+COMMON_BANDS = ['B2', 'B3', 'B4', 'B5', 'Fmask']
+
+
+def collection_of(scene_id: str) -> str:
+    return scene_id.rsplit('/', 1)[0]
+
+
+def harmonize_hls(image: ee.Image, collection_id: str) -> ee.Image:
+    return image.select(HLS_BANDS[collection_id], COMMON_BANDS)
+
+
+def _harmonizer(collection_id: str):
+    return lambda image: harmonize_hls(image, collection_id)
+
+
+def get_merged_hls_collection(start, end, region=None) -> ee.ImageCollection:
+    # Filter each source before harmonizing so Earth Engine can use its indexes
+    merged = None
+    for collection_id in (HLS_L30, HLS_S30):
+        collection = ee.ImageCollection(collection_id).filterDate(start, end)
+        if region is not None:
+            collection = collection.filterBounds(region)
+        collection = collection.map(_harmonizer(collection_id))
+        merged = collection if merged is None else merged.merge(collection)
+    return merged
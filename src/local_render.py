@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import io
+import os
+import math
+import json
+import hashlib
+import logging
+import urllib.request
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from .startup import lazy_import
+from .cache import DiskLRUCache
+from .metrics import instrument
+from .circuit_breaker import guarded_call
+from .tracing import ee_round_trip, traced_get_info, traced_thumb_url
+from .earth_engine import get_recent_hls_collection, RGB_VIS, NDVI_VIS
+from .settings import CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_DIMENSIONS, TILE_FETCH_TIMEOUT
+
+ee = lazy_import('ee')
+
+# Bands needed to derive both the RGB and the NDVI renderings
+RENDER_BANDS = ['B2', 'B3', 'B4', 'B5']
+
+thumbnail_cache = DiskLRUCache(os.path.join(CACHE_DIR, 'thumbnails'), THUMBNAIL_CACHE_MAX_BYTES)
+
+
+def thumbnail_path(key: str) -> str:
+    return f"/thumbnails/{key}.png"
+
+
+def cache_ee_thumbnail(image: ee.Image, params: Dict[str, Any], key: str, datasets: Sequence[str]) -> str:
+    # Renders once on Earth Engine and serves later requests for the same key from the local cache
+    if not thumbnail_cache.contains(key):
+        url = traced_thumb_url(image, params, key, datasets)
+        with ee_round_trip('thumbnail download'), urllib.request.urlopen(url, timeout=TILE_FETCH_TIMEOUT) as response:
+            thumbnail_cache.put(key, response.read())
+    return thumbnail_path(key)
+
+
+def _coordinates_array(geometry: Dict[str, Any]) -> np.ndarray:
+    if geometry['type'] == 'Polygon':
+        rings = geometry['coordinates']
+    elif geometry['type'] == 'MultiPolygon':
+        rings = [ring for polygon in geometry['coordinates'] for ring in polygon]
+    elif geometry['type'] == 'GeometryCollection':
+        return np.concatenate([_coordinates_array(g) for g in geometry['geometries']])
+    else:
+        raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+    return np.concatenate([np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings])
+
+
+def compute_grid(geometry: Dict[str, Any], max_dimension: int = THUMBNAIL_DIMENSIONS) -> Dict[str, Any]:
+    coords = _coordinates_array(geometry)
+    lon_min, lat_min = coords.min(axis=0)
+    lon_max, lat_max = coords.max(axis=0)
+
+    # Keep the aspect ratio of the ground footprint rather than of the raw degrees
+    ground_width = (lon_max - lon_min) * math.cos(math.radians((lat_min + lat_max) / 2))
+    ground_height = lat_max - lat_min
+    if ground_width >= ground_height:
+        width = max_dimension
+        height = max(1, round(max_dimension * ground_height / ground_width))
+    else:
+        height = max_dimension
+        width = max(1, round(max_dimension * ground_width / ground_height))
+
+    return {
+        'width': int(width),
+        'height': int(height),
+        'lon_min': float(lon_min),
+        'lat_max': float(lat_max),
+        'scale_x': float(lon_max - lon_min) / width,
+        'scale_y': float(lat_max - lat_min) / height,
+    }
+
+
+@instrument('download_band_stack')
+def download_band_stack(image: ee.Image, grid: Dict[str, Any]) -> np.ndarray:
+    valid = image.select(RENDER_BANDS).mask().reduce(ee.Reducer.min()).rename('valid')
+    expression = image.select(RENDER_BANDS).toFloat().addBands(valid.toFloat())
+    with ee_round_trip('computePixels band_stack', expression, width=grid['width'], height=grid['height']) as ee_span:
+        return guarded_call(['hls'], ee_span, ee.data.computePixels, {
+            'expression': expression,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': {
+                'dimensions': {'width': grid['width'], 'height': grid['height']},
+                'affineTransform': {
+                    'scaleX': grid['scale_x'],
+                    'shearX': 0,
+                    'translateX': grid['lon_min'],
+                    'shearY': 0,
+                    'scaleY': -grid['scale_y'],
+                    'translateY': grid['lat_max'],
+                },
+                'crsCode': 'EPSG:4326',
+            },
+        })
+
+
+def stretch(values: np.ndarray, vis: Dict[str, Any]) -> np.ndarray:
+    scaled = np.clip((values - vis['min']) / (vis['max'] - vis['min']), 0, 1)
+    if 'gamma' in vis:
+        scaled = scaled ** (1.0 / vis['gamma'])
+    return scaled
+
+
+def apply_palette(scaled: np.ndarray, palette) -> np.ndarray:
+    from PIL import ImageColor
+
+    colors = np.array([ImageColor.getrgb(color)[:3] for color in palette], dtype=np.float64)
+    stops = np.linspace(0, 1, len(colors))
+    channels = [np.interp(scaled, stops, colors[:, c]) for c in range(3)]
+    return np.stack(channels, axis=-1)
+
+
+def render_rgb(bands: np.ndarray, vis: Dict[str, Any] = RGB_VIS) -> np.ndarray:
+    rgb = np.stack([bands['B4'], bands['B3'], bands['B2']], axis=-1)
+    return stretch(rgb, vis) * 255
+
+
+def render_ndvi(bands: np.ndarray, vis: Dict[str, Any] = NDVI_VIS) -> np.ndarray:
+    nir = bands['B5'].astype(np.float64)
+    red = bands['B4'].astype(np.float64)
+    total = nir + red
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndvi = np.where(total != 0, (nir - red) / total, 0)
+    return apply_palette(stretch(ndvi, vis), vis['palette'])
+
+
+def encode_png(rgb: np.ndarray, alpha: np.ndarray) -> bytes:
+    from PIL import Image
+
+    rgba = np.dstack([rgb, alpha * 255]).round().astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, mode='RGBA').save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+def aoi_mask(geometry: Dict[str, Any], grid: Dict[str, Any]) -> np.ndarray:
+    from affine import Affine
+    from rasterio.features import geometry_mask
+
+    transform = Affine(grid['scale_x'], 0, grid['lon_min'], 0, -grid['scale_y'], grid['lat_max'])
+    return geometry_mask([geometry], out_shape=(grid['height'], grid['width']),
+                         transform=transform, invert=True, all_touched=True)
+
+
+@instrument('render_thumbnails')
+def render_thumbnails(bands: np.ndarray, geometry: Dict[str, Any], grid: Dict[str, Any]) -> Dict[str, bytes]:
+    valid = bands['valid'] > 0
+    clipped = valid & aoi_mask(geometry, grid)
+
+    rgb = render_rgb(bands)
+    ndvi = render_ndvi(bands)
+
+    return {
+        'full_rgb': encode_png(rgb, valid),
+        'full_ndvi': encode_png(ndvi, valid),
+        'clipped_rgb': encode_png(rgb, clipped),
+        'clipped_ndvi': encode_png(ndvi, clipped),
+    }
+
+
+def _thumbnail_keys(scene_id: str, geometry: Dict[str, Any]) -> Dict[str, str]:
+    digest = hashlib.sha1(json.dumps([scene_id, geometry], sort_keys=True).encode('utf-8')).hexdigest()
+    return {name: f"{digest}_{name}" for name in ('full_rgb', 'full_ndvi', 'clipped_rgb', 'clipped_ndvi')}
+
+
+def get_image_data_local(aoi: ee.Geometry, i, properties) -> Optional[Dict[str, Any]]:
+    filtered_collection = get_recent_hls_collection(aoi)
+    image = filtered_collection.first()
+
+    # One metadata round-trip in place of the separate date/size/bounds/bandNames calls
+    info = traced_get_info(ee.Dictionary({
+        'image_count': filtered_collection.size(),
+        'scene_id': ee.Algorithms.If(filtered_collection.size().gt(0), image.get('system:index'), None),
+        'image_date': ee.Algorithms.If(filtered_collection.size().gt(0), image.date().format('YYYY-MM-dd'), None),
+        'geometry': aoi,
+    }), 'scene_info', ['hls'])
+
+    if info['image_count'] == 0:
+        return None
+
+    geometry = info['geometry']
+    keys = _thumbnail_keys(info['scene_id'], geometry)
+
+    if not all(thumbnail_cache.contains(key) for key in keys.values()):
+        grid = compute_grid(geometry)
+        logging.info(f"Downloading {grid['width']}x{grid['height']} band stack for scene {info['scene_id']}")
+        bands = download_band_stack(ee.Image(image), grid)
+        for name, png in render_thumbnails(bands, geometry, grid).items():
+            thumbnail_cache.put(keys[name], png)
+
+    return {
+        "region_id": i,
+        "properties": properties,
+        "image_date": info['image_date'],
+        "image_count": info['image_count'],
+        "full_rgb_url": thumbnail_path(keys['full_rgb']),
+        "full_ndvi_url": thumbnail_path(keys['full_ndvi']),
+        "clipped_rgb_url": thumbnail_path(keys['clipped_rgb']),
+        "clipped_ndvi_url": thumbnail_path(keys['clipped_ndvi']),
+        "available_bands": ['B4', 'B3', 'B2'],
+    }
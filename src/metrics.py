@@ -0,0 +1,136 @@
+import asyncio
+import functools
+import time
+
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from .tracing import span
+from .settings import PROMETHEUS_MULTIPROC_DIR
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+REQUEST_LATENCY = Histogram(
+    'farm_api_request_duration_seconds', 'HTTP request latency by route template',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    'farm_api_response_size_bytes', 'HTTP response body size as sent (after compression)',
+    ['route'], buckets=SIZE_BUCKETS
+)
+# Gauges are summed over live workers when running under gunicorn with PROMETHEUS_MULTIPROC_DIR set
+REQUESTS_IN_FLIGHT = Gauge('farm_api_requests_in_flight', 'HTTP requests currently being served', multiprocess_mode='livesum')
+
+STAGE_LATENCY = Histogram(
+    'farm_api_stage_duration_seconds', 'Latency of instrumented pipeline stages (Earth Engine calls, rendering, exports)',
+    ['stage', 'outcome'], buckets=LATENCY_BUCKETS
+)
+STAGES_IN_FLIGHT = Gauge('farm_api_stages_in_flight', 'Pipeline stages currently running', ['stage'], multiprocess_mode='livesum')
+
+CACHE_LOOKUPS = Counter('farm_api_cache_lookups_total', 'Cache lookups by cache and result (hit/miss)', ['cache', 'result'])
+QUEUE_DEPTH = Gauge('farm_api_queue_depth', 'Work items waiting for a concurrency slot', ['queue'], multiprocess_mode='livesum')
+BREAKER_OPEN = Gauge('farm_api_circuit_breaker_open', 'Whether the Earth Engine circuit breaker of a dataset is open (1) or not (0)',
+                     ['dataset'], multiprocess_mode='livemax')
+BREAKER_REJECTIONS = Counter('farm_api_circuit_breaker_rejections_total', 'Earth Engine calls refused by an open circuit breaker', ['dataset'])
+STALE_RESPONSES = Counter('farm_api_stale_responses_total', 'Responses served from the last good result during an Earth Engine failure', ['route'])
+THREADPOOL_BUSY = Gauge('farm_api_threadpool_busy_threads', 'Worker threads in use by run_in_threadpool / sync routes',
+                        multiprocess_mode='livesum')
+
+
+class instrument:
+    # Times a pipeline stage and opens a tracing span for it. Use as a decorator on
+    # sync or async functions, or as `with instrument('getThumbURL'):` around a single call.
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._start = None
+        self._span = None
+
+    def __enter__(self):
+        STAGES_IN_FLIGHT.labels(self.stage).inc()
+        self._span = span(self.stage)
+        self._span.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        STAGES_IN_FLIGHT.labels(self.stage).dec()
+        STAGE_LATENCY.labels(self.stage, 'error' if exc_type else 'ok').observe(elapsed)
+        self._span.__exit__(exc_type, exc, tb)
+        return False
+
+    def __call__(self, func):
+        stage = self.stage
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with instrument(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with instrument(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def record_cache_lookup(cache: str, hit: bool, count: int = 1):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc(count)
+
+
+def _update_threadpool_gauges():
+    from anyio import to_thread
+
+    limiter = to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    THREADPOOL_BUSY.set(statistics.borrowed_tokens)
+    QUEUE_DEPTH.labels('threadpool').set(statistics.tasks_waiting)
+
+
+def metrics_response() -> Response:
+    _update_threadpool_gauges()
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    # Every worker writes its samples to files in PROMETHEUS_MULTIPROC_DIR; whichever worker serves
+    # the scrape aggregates all of them
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    # Records latency, status and response size per route template (e.g. /tiles/{layer}/{z}/{x}/{y}.png)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def measuring_send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, measuring_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(elapsed)
+            RESPONSE_SIZE.labels(route).observe(size)
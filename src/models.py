@@ -2,16 +2,14 @@ from pydantic import BaseModel, Field
 from typing import Union, Dict, List, Optional
 from datetime import date
 
+from .geometry import GeoJSONGeometry
+
 class Coordinates(BaseModel):
     lon1: float
     lat1: float
     lon2: float
     lat2: float
 
-class GeoJSONGeometry(BaseModel):
-    type: str
-    coordinates: List[List[List[float]]]
-
 class GeoJSONFeature(BaseModel):
     type: str = "Feature"
     properties: Dict = Field(default_factory=dict)
@@ -40,4 +38,29 @@ class WeatherAnalysisRequest(BaseModel):
     
     
 class HLSImageRequest(BaseModel):
-    aoi: AOIInput
\ No newline at end of file
+    aoi: AOIInput
+    local_render: bool = False
+    composite: Optional[str] = None
+
+class COGExportRequest(BaseModel):
+    aoi: AOIInput
+    layer: str = "ndvi"
+    source: str = "region_image"
+    scale: float = Field(30, gt=0)
+
+class FieldRegistration(BaseModel):
+    name: str
+    crop_type: str
+    geometry: GeoJSONGeometry
+
+class NDVIChangeRequest(BaseModel):
+    aoi: AOIInput
+    before: DateRange
+    after: DateRange
+    thumbnail: bool = False
+
+class GridStatsRequest(BaseModel):
+    aoi: AOIInput
+    date_range: DateRange
+    layer: str = "ndvi"
+    precision: int = 5
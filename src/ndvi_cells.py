@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import logging
+from contextlib import closing
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .startup import lazy_import
+from .db import get_connection
+from .metrics import instrument, record_cache_lookup
+from .tracing import traced_get_info
+from .farm_analysis import (MODIS_NDVI_COLLECTION, NDVI_HISTOGRAM_MIN, NDVI_HISTOGRAM_MAX, NDVI_HISTOGRAM_BINS,
+                            histogram_counts)
+from .settings import NDVI_CELL_BLOCK_PIXELS
+
+ee = lazy_import('ee')
+
+# MOD13Q1 sinusoidal grid: sphere radius, upper-left corner of the tile grid and 250 m pixel size
+SINUSOIDAL_RADIUS = 6371007.181
+GRID_ORIGIN_X = -20015109.354
+GRID_ORIGIN_Y = 10007554.677
+PIXEL_SIZE = 231.65635826395825
+SINUSOIDAL_WKT = (
+    'PROJCS["MODIS Sinusoidal",GEOGCS["Custom datum",DATUM["Custom",SPHEROID["Custom",6371007.181,0.0]],'
+    'PRIMEM["Greenwich",0.0],UNIT["degree",0.0174532925199433]],PROJECTION["Sinusoidal"],'
+    'PARAMETER["false_easting",0.0],PARAMETER["false_northing",0.0],PARAMETER["central_meridian",0.0],'
+    'UNIT["Meter",1.0]]'
+)
+# Reductions run on the native pixel grid, so every pixel falls in exactly one cell or the residual
+CRS_TRANSFORM = [PIXEL_SIZE, 0, GRID_ORIGIN_X, 0, -PIXEL_SIZE, GRID_ORIGIN_Y]
+# MOD13Q1 composites start on these days of every year
+COMPOSITE_DOYS = range(1, 366, 16)
+RESIDUAL_ID = 'residual'
+# Vertices are added along AOI edges before projecting, since straight lon/lat edges curve in sinusoidal
+DENSIFY_DEGREES = 0.0005
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ndvi_cells (
+    cell_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    sum_sq REAL NOT NULL,
+    min REAL,
+    max REAL,
+    histogram TEXT,
+    PRIMARY KEY (cell_id, date)
+);
+"""
+
+
+def _connect():
+    conn = get_connection('ndvi_cells')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def to_sinusoidal(coords: np.ndarray) -> np.ndarray:
+    lon, lat = np.radians(coords[..., 0]), np.radians(coords[..., 1])
+    return np.stack([SINUSOIDAL_RADIUS * lon * np.cos(lat), SINUSOIDAL_RADIUS * lat], axis=-1)
+
+
+def composite_dates(start_date: str, end_date: str) -> List[str]:
+    # MOD13Q1 composite start dates in [start_date, end_date), the same window filterDate selects
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [day.isoformat() for year in range(start.year, end.year + 1)
+            for day in (date(year, 1, 1) + timedelta(days=doy - 1) for doy in COMPOSITE_DOYS)
+            if start <= day < end]
+
+
+def interior_cells(aoi_geojson: Dict[str, Any], block_pixels: int = NDVI_CELL_BLOCK_PIXELS) -> List[Tuple[int, int]]:
+    # Canonical blocks of block_pixels x block_pixels MODIS pixels that lie entirely inside the AOI
+    import shapely
+    from shapely.geometry import shape
+
+    region = shapely.transform(shapely.segmentize(shape(aoi_geojson), DENSIFY_DEGREES), to_sinusoidal)
+    # Shrinking by half a pixel keeps every pixel centre of an interior block inside the AOI,
+    # whatever small error the projected outline has
+    region = region.buffer(-PIXEL_SIZE / 2)
+    if region.is_empty:
+        return []
+
+    block = PIXEL_SIZE * block_pixels
+    west, south, east, north = region.bounds
+    columns = np.arange(int((west - GRID_ORIGIN_X) // block), int((east - GRID_ORIGIN_X) // block) + 1)
+    rows = np.arange(int((GRID_ORIGIN_Y - north) // block), int((GRID_ORIGIN_Y - south) // block) + 1)
+    column, row = [grid.ravel() for grid in np.meshgrid(columns, rows)]
+    boxes = shapely.box(GRID_ORIGIN_X + column * block, GRID_ORIGIN_Y - (row + 1) * block,
+                        GRID_ORIGIN_X + (column + 1) * block, GRID_ORIGIN_Y - row * block)
+    inside = shapely.contains(region, boxes)
+    return list(zip(column[inside].tolist(), row[inside].tolist()))
+
+
+def cell_id(column: int, row: int, block_pixels: int = NDVI_CELL_BLOCK_PIXELS) -> str:
+    return f"{block_pixels}/{column}/{row}"
+
+
+def _cell_coordinates(column: int, row: int, block_pixels: int = NDVI_CELL_BLOCK_PIXELS) -> List[List[List[float]]]:
+    block = PIXEL_SIZE * block_pixels
+    west, east = GRID_ORIGIN_X + column * block, GRID_ORIGIN_X + (column + 1) * block
+    south, north = GRID_ORIGIN_Y - (row + 1) * block, GRID_ORIGIN_Y - row * block
+    return [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+
+
+def _cell_geometry(column: int, row: int, block_pixels: int = NDVI_CELL_BLOCK_PIXELS):
+    return ee.Geometry.Polygon(_cell_coordinates(column, row, block_pixels), ee.Projection(SINUSOIDAL_WKT), False)
+
+
+@instrument('compute_ndvi_partial_sums')
+def compute_partial_sums(features, start_date: str, end_date: str,
+                         needed: Dict[str, List[str]]) -> Tuple[List[Tuple], List[str]]:
+    # Additive statistics (count, sum, sum of squares, min, max, histogram) for the cells each composite
+    # still needs, plus the dates of the composites that exist, all from one round-trip
+    collection = ee.ImageCollection(MODIS_NDVI_COLLECTION).filterDate(start_date, end_date)
+    needed_by_date = ee.Dictionary(needed)
+
+    def partial_sums(image):
+        date_string = image.date().format('YYYY-MM-dd')
+        image_features = features.filter(ee.Filter.inList('cell_id', needed_by_date.get(date_string, [RESIDUAL_ID])))
+        ndvi = image.select('NDVI').divide(10000).rename('ndvi')
+        sums = ndvi.addBands(ndvi.multiply(ndvi).rename('ndvi_sq')).reduceRegions(
+            collection=image_features, reducer=ee.Reducer.sum().unweighted(),
+            crs=SINUSOIDAL_WKT, crsTransform=CRS_TRANSFORM
+        )
+        # The second pass reduces the first pass's output features, so both sets of properties are kept
+        stats = ndvi.reduceRegions(
+            collection=sums,
+            reducer=ee.Reducer.count().combine(ee.Reducer.minMax(), None, True)
+                .combine(ee.Reducer.fixedHistogram(NDVI_HISTOGRAM_MIN, NDVI_HISTOGRAM_MAX, NDVI_HISTOGRAM_BINS), None, True)
+                .unweighted(),
+            crs=SINUSOIDAL_WKT, crsTransform=CRS_TRANSFORM
+        )
+        return stats.map(lambda feature: feature.set({'date': date_string,
+                                                      'histogram': histogram_counts(feature.get('histogram'))}))
+
+    keys = ['cell_id', 'date', 'count', 'ndvi', 'ndvi_sq', 'min', 'max', 'histogram']
+    columns = collection.map(partial_sums).flatten() \
+        .filter(ee.Filter.gt('count', 0)) \
+        .reduceColumns(ee.Reducer.toList().repeat(len(keys)), keys) \
+        .get('list')
+    info = traced_get_info(ee.Dictionary({
+        'columns': columns,
+        'time_starts': collection.aggregate_array('system:time_start'),
+    }), 'ndvi_partial_sums', ['modis'])
+    published = sorted({datetime.fromtimestamp(ms / 1000, timezone.utc).strftime('%Y-%m-%d') for ms in info['time_starts']})
+    return list(zip(*info['columns'])), published
+
+
+def _load_cached(conn, cell_ids: List[str], dates: List[str]) -> Dict[Tuple[str, str], Tuple]:
+    cached = {}
+    for start in range(0, len(cell_ids), 500):
+        chunk = cell_ids[start:start + 500]
+        rows = conn.execute(
+            f"SELECT cell_id, date, count, sum, sum_sq, min, max, histogram FROM ndvi_cells "
+            f"WHERE date >= ? AND date <= ? AND cell_id IN ({','.join('?' * len(chunk))})",
+            (dates[0], dates[-1], *chunk)
+        ).fetchall()
+        cached.update({(row['cell_id'], row['date']): (*tuple(row)[:7], json.loads(row['histogram']) if row['histogram'] else None)
+                       for row in rows})
+    return cached
+
+
+def _assemble(rows: List[Tuple], dates: List[str]) -> List[Dict[str, Any]]:
+    # Combines per-cell partial sums into the per-date statistics calculate_ndvi_stats returns
+    by_date = {day: [] for day in dates}
+    for row in rows:
+        if row[2] > 0 and row[1] in by_date:
+            by_date[row[1]].append(row)
+
+    features = []
+    for day, parts in by_date.items():
+        if not parts:
+            continue
+        count = sum(row[2] for row in parts)
+        mean = sum(row[3] for row in parts) / count
+        variance = max(sum(row[4] for row in parts) / count - mean * mean, 0.0)
+        histograms = [row[7] for row in parts if row[7] is not None]
+        features.append({'type': 'Feature', 'geometry': None, 'properties': {
+            'mean': mean,
+            'stdDev': float(np.sqrt(variance)),
+            'min': min(row[5] for row in parts),
+            'max': max(row[6] for row in parts),
+            'histogram': np.sum(histograms, axis=0).tolist() if histograms else None,
+            'date': day,
+        }})
+    return features
+
+
+def cached_ndvi_stats(aoi: ee.Geometry, start_date: str, end_date: str) -> Optional[List[Dict[str, Any]]]:
+    # Returns None when the AOI cannot be split into cells, so the caller falls back to a plain reduceRegion
+    try:
+        aoi_geojson = aoi.toGeoJSON()
+    except ee.EEException:
+        return None
+    cells = interior_cells(aoi_geojson)
+    dates = composite_dates(start_date, end_date)
+    if not cells or not dates:
+        return None
+
+    ids = [cell_id(column, row) for column, row in cells]
+    with closing(_connect()) as conn:
+        cached = _load_cached(conn, ids, dates)
+        # Cells are looked up per composite, so a new composite only costs the cells for that date
+        needed = {day: [cid for cid in ids if (cid, day) not in cached] for day in dates}
+        misses = sum(len(day_ids) for day_ids in needed.values())
+        record_cache_lookup('ndvi_cells', True, len(ids) * len(dates) - misses)
+        record_cache_lookup('ndvi_cells', False, misses)
+
+        sinusoidal = ee.Projection(SINUSOIDAL_WKT)
+        interior = ee.Geometry.MultiPolygon([_cell_coordinates(column, row) for column, row in cells], sinusoidal, False)
+        residual = aoi.difference(interior, ee.ErrorMargin(1), sinusoidal)
+        needed_ids = {cid for day_ids in needed.values() for cid in day_ids}
+        features = ee.FeatureCollection(
+            [ee.Feature(residual, {'cell_id': RESIDUAL_ID})] +
+            [ee.Feature(_cell_geometry(column, row), {'cell_id': cid})
+             for (column, row), cid in zip(cells, ids) if cid in needed_ids]
+        )
+        computed, published = compute_partial_sums(
+            features, start_date, end_date, {day: [RESIDUAL_ID] + day_ids for day, day_ids in needed.items()}
+        )
+        if not published:
+            raise ValueError("No MODIS data available for the specified date range and location.")
+
+        # Cells without valid pixels are cached as empty; composites that are not published yet are
+        # not cached at all, so they are picked up once they appear
+        returned = {(row[0], row[1]) for row in computed}
+        empty = [(cid, day, 0, 0.0, 0.0, None, None, None) for day in published for cid in needed.get(day, [])
+                 if (cid, day) not in returned]
+        new_rows = [row for row in computed if row[0] != RESIDUAL_ID] + empty
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ndvi_cells (cell_id, date, count, sum, sum_sq, min, max, histogram) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row[:7] + (json.dumps(row[7]) if row[7] is not None else None,) for row in new_rows]
+            )
+
+    logging.info(f"NDVI cell cache: {len(ids) * len(dates) - misses} of {len(ids) * len(dates)} cell composites reused")
+    return _assemble(list(cached.values()) + computed + empty, dates)
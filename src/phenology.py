@@ -0,0 +1,167 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .crop_profiles import CROP_PROFILES
+
+# Smoothing strength of the Whittaker smoother; larger values give a stiffer curve
+WHITTAKER_LAMBDA = 2.0
+# Start and end of season are where the fitted curve crosses this share of the seasonal amplitude
+SEASON_AMPLITUDE_FRACTION = 0.5
+# A green-up or senescence smaller than this is treated as noise rather than a season
+MIN_SEASON_AMPLITUDE = 0.1
+# The fitted curve has to drop this far below its maximum before the peak counts as reached
+PEAK_DROP = 0.05
+MIN_OBSERVATIONS = 5
+
+
+def _composite_slots(dates: np.ndarray, step: int) -> Tuple[np.ndarray, np.ndarray]:
+    # MOD13Q1 restarts its 16-day cycle every 1 January, so a composite's slot is (year, day of year // step)
+    # rather than a count of steps from the first date, which drifts by a slot or two every year
+    years = dates.astype('datetime64[Y]')
+    day_of_year = (dates - years).astype(np.int64)
+    per_year = -(-366 // step)
+    return (years.astype(np.int64) * per_year + day_of_year // step), years
+
+
+def ndvi_matrix(series: Sequence[List[Dict[str, Any]]]) -> Tuple[np.ndarray, np.ndarray]:
+    # Puts every series on one grid of composite slots at the composite spacing (the median gap between
+    # dates), since the smoother assumes evenly spaced samples; missing composites are NaN and
+    # observations that share a slot are averaged
+    observed = [np.array([feature['properties']['date'] for feature in stats], dtype='datetime64[D]') for stats in series]
+    unique = np.unique(np.concatenate(observed)) if observed else np.array([], dtype='datetime64[D]')
+    if len(unique) < 2:
+        return unique, np.full((len(series), len(unique)), np.nan)
+
+    step = max(1, int(np.median(np.diff(unique).astype(np.int64))))
+    per_year = -(-366 // step)
+    unique_slots, _ = _composite_slots(unique, step)
+    first, last = unique_slots.min(), unique_slots.max()
+
+    grid = np.arange(first, last + 1)
+    dates = (grid // per_year).astype('datetime64[Y]').astype('datetime64[D]') + (grid % per_year) * step
+    sums = np.zeros((len(series), len(grid)))
+    counts = np.zeros((len(series), len(grid)))
+    for i, stats in enumerate(series):
+        if stats:
+            slots = _composite_slots(observed[i], step)[0] - first
+            means = np.array([feature['properties']['mean'] for feature in stats], dtype=np.float64)
+            valid = ~np.isnan(means)
+            np.add.at(sums[i], slots[valid], means[valid])
+            np.add.at(counts[i], slots[valid], 1)
+    with np.errstate(invalid='ignore'):
+        values = np.where(counts > 0, sums / counts, np.nan)
+    return dates, values
+
+
+def whittaker_smooth(values: np.ndarray, lam: float = WHITTAKER_LAMBDA) -> np.ndarray:
+    # Solves (W + lam * D'D) z = W y for all rows at once, with D the second-difference operator.
+    # Missing observations get zero weight, so gaps are interpolated by the smoother itself.
+    # Rows with too few observations come back as NaN.
+    rows, n = values.shape
+    weights = ~np.isnan(values)
+    fitted = weights.sum(axis=1) >= MIN_OBSERVATIONS
+    difference = np.diff(np.eye(n), 2, axis=0)
+    systems = np.broadcast_to(lam * difference.T @ difference, (rows, n, n)).copy()
+    systems[:, np.arange(n), np.arange(n)] += weights
+    # Keep unfitted rows solvable; their output is discarded below
+    systems[~fitted] = np.eye(n)
+    smoothed = np.linalg.solve(systems, np.where(weights, values, 0.0)[..., None])[..., 0]
+    smoothed[~fitted] = np.nan
+    return smoothed
+
+
+def _crossing_dates(curve: np.ndarray, level: np.ndarray, index: np.ndarray, days: np.ndarray) -> np.ndarray:
+    # Linear interpolation between sample `index` and the next one, for the date `curve` reaches `level`
+    rows = np.arange(len(curve))
+    safe = np.clip(index, 0, curve.shape[1] - 2)
+    before = curve[rows, safe]
+    after = curve[rows, safe + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        position = safe + np.clip((level - before) / (after - before), 0, 1)
+    crossing = np.interp(position, np.arange(len(days)), days)
+    return np.where(index >= 0, crossing, np.nan)
+
+
+def extract_phenology(dates: np.ndarray, smoothed: np.ndarray) -> Dict[str, np.ndarray]:
+    # Start of season is the last upward crossing of the half-amplitude level before the peak, and
+    # end of season the first downward crossing after it. Dates are returned as days since the epoch.
+    rows, n = smoothed.shape
+    days = dates.astype(np.int64).astype(np.float64)
+    fitted = ~np.isnan(smoothed).any(axis=1)
+    curve = np.where(fitted[:, None], smoothed, 0.0)
+    index = np.arange(n)
+
+    peak = curve.argmax(axis=1)
+    peak_value = curve[np.arange(rows), peak]
+    left_min = np.where(index <= peak[:, None], curve, np.inf).min(axis=1)
+    right_min = np.where(index >= peak[:, None], curve, np.inf).min(axis=1)
+
+    sos_level = left_min + SEASON_AMPLITUDE_FRACTION * (peak_value - left_min)
+    below = curve[:, :-1] < sos_level[:, None]
+    rising = below & (curve[:, 1:] >= sos_level[:, None]) & (index[:-1] < peak[:, None])
+    last_rise = np.where(rising.any(axis=1), n - 2 - rising[:, ::-1].argmax(axis=1), -1)
+    last_rise[(peak_value - left_min) < MIN_SEASON_AMPLITUDE] = -1
+
+    eos_level = right_min + SEASON_AMPLITUDE_FRACTION * (peak_value - right_min)
+    falling = (curve[:, :-1] >= eos_level[:, None]) & (curve[:, 1:] < eos_level[:, None]) & (index[:-1] >= peak[:, None])
+    first_fall = np.where(falling.any(axis=1), falling.argmax(axis=1), -1)
+    first_fall[(peak_value - right_min) < MIN_SEASON_AMPLITUDE] = -1
+
+    peak_reached = fitted & (peak_value - curve[:, -1] >= PEAK_DROP)
+    return {
+        "fitted": fitted,
+        "peak_reached": peak_reached,
+        "start_of_season": np.where(fitted, _crossing_dates(curve, sos_level, last_rise, days), np.nan),
+        "peak": np.where(fitted, days[peak], np.nan),
+        "peak_ndvi": np.where(fitted, peak_value, np.nan),
+        "end_of_season": np.where(fitted, _crossing_dates(curve, eos_level, first_fall, days), np.nan),
+    }
+
+
+def _day_to_date(day: float) -> Optional[str]:
+    if np.isnan(day):
+        return None
+    return str(np.datetime64(int(round(day)), 'D'))
+
+
+def fit_phenology(series: Sequence[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # One smoothing solve and one extraction pass for every series (e.g. every field in a batch)
+    if not series:
+        return []
+    dates, values = ndvi_matrix(series)
+    if len(dates) < MIN_OBSERVATIONS:
+        return [{"season_status": "insufficient_data"} for _ in series]
+    phenology = extract_phenology(dates, whittaker_smooth(values))
+
+    results = []
+    for i in range(len(series)):
+        if not phenology['fitted'][i]:
+            results.append({"season_status": "insufficient_data"})
+            continue
+        peak_reached = bool(phenology['peak_reached'][i])
+        if not np.isnan(phenology['end_of_season'][i]):
+            status = "senescence"
+        elif peak_reached:
+            status = "past_peak"
+        elif not np.isnan(phenology['start_of_season'][i]):
+            status = "green_up"
+        else:
+            status = "no_season_detected"
+        results.append({
+            "season_status": status,
+            "start_of_season": _day_to_date(phenology['start_of_season'][i]),
+            "peak_date": _day_to_date(phenology['peak'][i]) if peak_reached else None,
+            "peak_ndvi": float(phenology['peak_ndvi'][i]),
+            "end_of_season": _day_to_date(phenology['end_of_season'][i]),
+        })
+    return results
+
+
+def harvest_window(phenology: Dict[str, Any], crop_type: str) -> Optional[Dict[str, str]]:
+    # Projected from the fitted peak with the crop profile's harvest_days_after_peak range
+    offsets = CROP_PROFILES[crop_type].get('harvest_days_after_peak')
+    if not phenology.get('peak_date') or not offsets:
+        return None
+    peak = np.datetime64(phenology['peak_date'], 'D')
+    return {"start": str(peak + int(offsets[0])), "end": str(peak + int(offsets[1]))}
@@ -0,0 +1,214 @@
+import os
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import Header, HTTPException
+
+from .settings import DEBUG_TOKEN
+
+PROFILE_HEADER = "x-debug-profile"
+MAX_STORED_PROFILES = 20
+MAX_STACK_DEPTH = 128
+
+_profile_lock = threading.Lock()
+_request_profiles = OrderedDict()  # profile id -> collapsed stacks
+_allocation_log = deque(maxlen=200)
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Debug endpoints are disabled. Set DEBUG_TOKEN to enable them.")
+    if not x_debug_token or not secrets.compare_digest(x_debug_token, DEBUG_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Debug-Token header.")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    # Samples the stacks of all other threads at a fixed interval and aggregates them in
+    # collapsed-stack format ("thread;outer;...;inner count"), which flamegraph.pl and speedscope read
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+@contextmanager
+def exclusive_profiler(interval: float):
+    # One profiler per worker; concurrent samplers would distort each other
+    if not _profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker.")
+    profiler = SamplingProfiler(interval)
+    try:
+        profiler.start()
+        yield profiler
+    finally:
+        profiler.stop()
+        _profile_lock.release()
+
+
+def store_request_profile(profile_id: str, collapsed: str):
+    _request_profiles[profile_id] = collapsed
+    while len(_request_profiles) > MAX_STORED_PROFILES:
+        _request_profiles.popitem(last=False)
+
+
+def get_request_profile(profile_id: str) -> Optional[str]:
+    return _request_profiles.get(profile_id)
+
+
+class RequestProfilerMiddleware:
+    # Requests sent with X-Debug-Profile: 1 and a valid X-Debug-Token are sampled while they run.
+    # The profile covers the whole worker during that window and is fetched via the returned X-Profile-Id.
+    def __init__(self, app, interval: float = 0.002):
+        self.app = app
+        self.interval = interval
+
+    def _wants_profile(self, scope) -> bool:
+        if scope["type"] != "http" or not DEBUG_TOKEN:
+            return False
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-debug-token", b"").decode("latin-1")
+        return headers.get(PROFILE_HEADER.encode()) == b"1" and secrets.compare_digest(token, DEBUG_TOKEN)
+
+    async def __call__(self, scope, receive, send):
+        if not self._wants_profile(scope) or not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = secrets.token_hex(8)
+        profiler = SamplingProfiler(self.interval)
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            store_request_profile(profile_id, profiler.stop())
+            _profile_lock.release()
+
+
+def start_tracemalloc(frames: int) -> Dict[str, Any]:
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _last_snapshot = None
+    return tracemalloc_status()
+
+
+def stop_tracemalloc() -> Dict[str, Any]:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    return tracemalloc_status()
+
+
+def tracemalloc_status() -> Dict[str, Any]:
+    tracing = tracemalloc.is_tracing()
+    current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+    return {
+        "tracing": tracing,
+        "frames": tracemalloc.get_traceback_limit() if tracing else None,
+        "current_bytes": current,
+        "peak_bytes": peak,
+    }
+
+
+def _stat_to_dict(stat) -> Dict[str, Any]:
+    return {
+        "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        "size_bytes": stat.size,
+        "count": stat.count,
+        "size_diff_bytes": getattr(stat, "size_diff", None),
+        "count_diff": getattr(stat, "count_diff", None),
+    }
+
+
+def take_snapshot(limit: int, key_type: str) -> Dict[str, Any]:
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not running. POST /debug/tracemalloc/start first.")
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    result = {
+        **tracemalloc_status(),
+        "top": [_stat_to_dict(stat) for stat in snapshot.statistics(key_type)[:limit]],
+        # Growth since the previous snapshot is what points at leaks
+        "growth": None if _last_snapshot is None else
+            [_stat_to_dict(stat) for stat in snapshot.compare_to(_last_snapshot, key_type)[:limit]],
+        "allocations_by_route": list(_allocation_log),
+    }
+    _last_snapshot = snapshot
+    return result
+
+
+@contextmanager
+def track_allocations(label: str):
+    # Records how much traced memory a block allocated and retained; a no-op unless tracemalloc is running
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        after, peak = tracemalloc.get_traced_memory()
+        _allocation_log.append({
+            "label": label,
+            "time": time.time(),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "retained_bytes": after - before,
+            "peak_bytes": peak - before,
+        })
@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import instrument
+from .uploads import Upload, name_keys
+
+MAX_CACHED_CATALOGS = 4
+SUMMARY_KEYS = {"by_type": "type", "by_country": "country"}
+
+_lock = threading.Lock()
+_catalogs = OrderedDict()  # (upload id, name key) -> RegionCatalog
+
+
+class RegionCatalog:
+    # Everything inspect_geojson reports about an upload, built once from its columns: region rows, bounding boxes,
+    # and per-property value -> positions indexes that are filled in the first time a property is filtered on
+    def __init__(self, upload: Upload, name_key: Optional[str]):
+        import shapely
+
+        self.upload = upload
+        types = [a or b for a, b in zip(upload.column('TYPE_1') or [None] * len(upload),
+                                        upload.column('ENGTYPE_1') or [None] * len(upload))]
+        countries = upload.column('NAME_0') or [None] * len(upload)
+        self.regions = [
+            {"id": region_id, "name": name, "type": region_type, "country": country}
+            for region_id, name, region_type, country in zip(upload.ids(), upload.names(name_keys(name_key)),
+                                                             types, countries)
+        ]
+
+        # Missing geometries get NaN bounds, which never match a bbox filter
+        self.bounds = shapely.bounds(upload.geometries()).reshape(-1, 4)
+        self._value_indexes = {}
+        self._index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.regions)
+
+    def value_index(self, key: str) -> Dict[str, np.ndarray]:
+        with self._index_lock:
+            if key not in self._value_indexes:
+                positions = {}
+                for i, value in enumerate(self.upload.column(key) or []):
+                    if value is not None:
+                        positions.setdefault(str(value), []).append(i)
+                self._value_indexes[key] = {value: np.array(found) for value, found in positions.items()}
+            return self._value_indexes[key]
+
+    def select(self, filters: Dict[str, List[str]], bbox: Optional[Tuple[float, float, float, float]]) -> np.ndarray:
+        # Positions of matching regions in file order. Values of one property are OR-ed, different properties AND-ed
+        mask = np.ones(len(self), dtype=bool)
+        for key, values in filters.items():
+            index = self.value_index(key)
+            key_mask = np.zeros(len(self), dtype=bool)
+            for value in values:
+                key_mask[index.get(value, [])] = True
+            mask &= key_mask
+        if bbox is not None:
+            west, south, east, north = bbox
+            mask &= (self.bounds[:, 0] <= east) & (self.bounds[:, 2] >= west) \
+                & (self.bounds[:, 1] <= north) & (self.bounds[:, 3] >= south)
+        return np.flatnonzero(mask)
+
+    def summary(self, positions: np.ndarray) -> Dict[str, Dict[str, int]]:
+        summary = {}
+        for name, field in SUMMARY_KEYS.items():
+            counts = {}
+            for i in positions.tolist():
+                value = self.regions[i][field]
+                counts[value] = counts.get(value, 0) + 1
+            summary[name] = {str(value): count for value, count in sorted(
+                counts.items(), key=lambda item: (-item[1], str(item[0])))}
+        return summary
+
+    def page(self, positions: np.ndarray, after: Optional[int], limit: int,
+             fields: Optional[List[str]], show_all_properties: bool) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        # Cursors are file positions, so pages stay stable while the (immutable) upload is paged through
+        if after is not None:
+            positions = positions[np.searchsorted(positions, after, side='right'):]
+        selected = positions[:limit].tolist()
+
+        regions = [dict(self.regions[i]) for i in selected]
+        if show_all_properties:
+            for region, properties in zip(regions, self.upload.properties(selected)):
+                region["properties"] = properties
+        elif fields:
+            columns = {key: self.upload.column(key) for key in fields}
+            for region, i in zip(regions, selected):
+                region["properties"] = {key: column[i] if column is not None else None for key, column in columns.items()}
+        next_cursor = selected[-1] if len(positions) > limit else None
+        return regions, next_cursor
+
+
+@instrument('build_region_catalog')
+def _build_catalog(upload: Upload, name_key: Optional[str]) -> RegionCatalog:
+    return RegionCatalog(upload, name_key)
+
+
+def region_catalog(upload: Upload, name_key: Optional[str]) -> RegionCatalog:
+    key = (upload.id, name_key)
+    with _lock:
+        if key in _catalogs:
+            _catalogs.move_to_end(key)
+            return _catalogs[key]
+    catalog = _build_catalog(upload, name_key)
+    with _lock:
+        _catalogs[key] = catalog
+        while len(_catalogs) > MAX_CACHED_CATALOGS:
+            _catalogs.popitem(last=False)
+    return catalog
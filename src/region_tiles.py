@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .cache import DiskLRUCache
+from .metrics import instrument
+from .settings import CACHE_DIR, REGION_TILE_CACHE_MAX_BYTES
+from .uploads import Upload, load_upload, name_keys
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+MVT_EXTENT = 4096
+MAX_REGION_ZOOM = 18
+LAYER_NAME = "regions"
+# Geometry within this many tile units outside the tile is kept, so strokes do not end at tile edges
+TILE_BUFFER = 64
+# Simplification tolerance in tile units; 4 units is a quarter of a pixel on a 256 px tile
+SIMPLIFY_UNITS = 4
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+MAX_LATITUDE = 85.0511287798
+
+region_tile_cache = DiskLRUCache(os.path.join(CACHE_DIR, 'region_tiles'), REGION_TILE_CACHE_MAX_BYTES)
+
+_index_lock = threading.Lock()
+_indexes = OrderedDict()  # (upload id, name key) -> projected geometries, properties and spatial index
+MAX_CACHED_INDEXES = 4
+
+
+def to_web_mercator(coords: np.ndarray) -> np.ndarray:
+    lon = coords[..., 0]
+    lat = np.clip(coords[..., 1], -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(lon) * 6378137.0
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * 6378137.0
+    return np.stack([x, y], axis=-1)
+
+
+def tile_bounds(z: int, x: int, y: int):
+    span = 2 * WEB_MERCATOR_HALF_WORLD / 2 ** z
+    west = -WEB_MERCATOR_HALF_WORLD + x * span
+    north = WEB_MERCATOR_HALF_WORLD - y * span
+    return west, north - span, west + span, north
+
+
+def _build_index(upload: Upload, name_key: Optional[str]) -> Dict[str, Any]:
+    import shapely
+
+    geometries = upload.geometries()
+    present = np.flatnonzero(~shapely.is_missing(geometries))
+    ids, names = upload.ids(), upload.names(name_keys(name_key))
+    properties = [{"id": ids[i], "name": names[i]} for i in present.tolist()]
+
+    projected = shapely.transform(geometries[present], to_web_mercator)
+    return {"geometries": projected, "properties": properties, "tree": shapely.STRtree(projected)}
+
+
+def _region_index(upload_id: str, name_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    # Projecting and indexing happens once per upload; every tile request afterwards is an index query
+    key = (upload_id, name_key)
+    with _index_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+    upload = load_upload(upload_id)
+    if upload is None:
+        return None
+    index = _build_index(upload, name_key)
+    with _index_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+@instrument('render_region_tile')
+def _render_tile(index: Dict[str, Any], z: int, x: int, y: int) -> bytes:
+    import shapely
+    import mapbox_vector_tile
+
+    west, south, east, north = tile_bounds(z, x, y)
+    unit = (east - west) / MVT_EXTENT
+    buffered = (west - TILE_BUFFER * unit, south - TILE_BUFFER * unit, east + TILE_BUFFER * unit, north + TILE_BUFFER * unit)
+
+    hits = index["tree"].query(shapely.box(*buffered))
+    if len(hits) == 0:
+        return b""
+
+    # Simplify to the tile's resolution first, so clipping and encoding work on far fewer vertices
+    geometries = shapely.simplify(index["geometries"][hits], SIMPLIFY_UNITS * unit, preserve_topology=True)
+    geometries = shapely.clip_by_rect(geometries, *buffered)
+    features = [
+        {"geometry": geometry, "properties": index["properties"][i], "id": int(i)}
+        for i, geometry in zip(hits.tolist(), geometries) if not geometry.is_empty
+    ]
+    if not features:
+        return b""
+    return mapbox_vector_tile.encode(
+        [{"name": LAYER_NAME, "features": features}],
+        default_options={"quantize_bounds": (west, south, east, north), "extents": MVT_EXTENT}
+    )
+
+
+def get_region_tile(upload_id: str, z: int, x: int, y: int, name_key: Optional[str] = None) -> Optional[bytes]:
+    # Tiles are rendered on first request and cached; uploads are content-addressed, so they never go stale
+    cache_key = f"{upload_id}/{name_key or ''}/{z}/{x}/{y}"
+    tile = region_tile_cache.get(cache_key)
+    if tile is not None:
+        return tile
+
+    index = _region_index(upload_id, name_key)
+    if index is None:
+        return None
+    tile = _render_tile(index, z, x, y)
+    region_tile_cache.put(cache_key, tile)
+    return tile
@@ -0,0 +1,209 @@
+import math
+import time
+import logging
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+
+from .startup import lazy_import
+from .db import get_connection
+from .metrics import instrument, record_cache_lookup
+from .tracing import traced_get_info
+from .hls_collections import HLS_L30, HLS_S30, collection_of
+from .settings import CATALOG_REFRESH_INTERVAL, CATALOG_MAX_CLOUD_COVER
+
+ee = lazy_import('ee')
+
+DAY_MS = 24 * 60 * 60 * 1000
+HISTORY_DAYS = 365
+# Re-scan a few days back on refresh to pick up late-ingested scenes
+REFRESH_OVERLAP_DAYS = 5
+# Catalog coverage is tracked per 1x1 degree cell
+CELL_SIZE = 1.0
+# Scenes per getInfo, well under Earth Engine's 5000-element limit on a collection fetch
+SCENE_PAGE_SIZE = 2000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    scene_id TEXT NOT NULL UNIQUE,
+    collection TEXT NOT NULL,
+    tile_id TEXT,
+    time_start INTEGER NOT NULL,
+    cloud_cover REAL,
+    minx REAL NOT NULL,
+    miny REAL NOT NULL,
+    maxx REAL NOT NULL,
+    maxy REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scenes_time_start ON scenes (time_start);
+CREATE VIRTUAL TABLE IF NOT EXISTS scene_index USING rtree(
+    id, minx, maxx, miny, maxy, tmin, tmax
+);
+CREATE TABLE IF NOT EXISTS coverage (
+    cell TEXT PRIMARY KEY,
+    synced_until INTEGER NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+BBox = Tuple[float, float, float, float]
+
+
+def _connect():
+    conn = get_connection('scene_catalog')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _cells(bbox: BBox) -> List[Tuple[int, int]]:
+    minx, miny, maxx, maxy = bbox
+    return [
+        (ix, iy)
+        for ix in range(math.floor(minx / CELL_SIZE), math.floor(maxx / CELL_SIZE) + 1)
+        for iy in range(math.floor(miny / CELL_SIZE), math.floor(maxy / CELL_SIZE) + 1)
+    ]
+
+
+def _cell_key(cell: Tuple[int, int]) -> str:
+    return f"{cell[0]}:{cell[1]}"
+
+
+@instrument('fetch_scene_metadata')
+def _fetch_scene_metadata(bbox: BBox, start_ms: int, end_ms: int) -> List[Dict[str, Any]]:
+    region = ee.Geometry.Rectangle(list(bbox))
+
+    def scene_features(collection_id):
+        def to_feature(image):
+            return ee.Feature(image.geometry().bounds(), {
+                'scene_id': image.get('system:id'),
+                'tile_id': image.get('MGRS_TILE_ID'),
+                'time_start': image.get('system:time_start'),
+                'cloud_cover': image.get('CLOUD_COVERAGE'),
+            })
+        return ee.ImageCollection(collection_id).filterBounds(region).filterDate(start_ms, end_ms).map(to_feature)
+
+    # Sorted so that consecutive pages of the same expression do not overlap or skip scenes
+    merged = ee.FeatureCollection(scene_features(HLS_L30)).merge(scene_features(HLS_S30)).sort('scene_id')
+    first = traced_get_info(ee.Dictionary({
+        'count': merged.size(),
+        'features': merged.toList(SCENE_PAGE_SIZE),
+    }), 'scene_metadata', ['hls'])
+    features = first['features']
+    for offset in range(SCENE_PAGE_SIZE, first['count'], SCENE_PAGE_SIZE):
+        features.extend(traced_get_info(merged.toList(SCENE_PAGE_SIZE, offset), 'scene_metadata_page', ['hls']))
+    return features
+
+
+def _insert_scenes(conn, features: List[Dict[str, Any]]) -> int:
+    inserted = 0
+    for feature in features:
+        properties = feature['properties']
+        ring = feature['geometry']['coordinates'][0]
+        xs = [point[0] for point in ring]
+        ys = [point[1] for point in ring]
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO scenes (scene_id, collection, tile_id, time_start, cloud_cover, minx, miny, maxx, maxy) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (properties['scene_id'], collection_of(properties['scene_id']), properties.get('tile_id'),
+             int(properties['time_start']), properties.get('cloud_cover'), min(xs), min(ys), max(xs), max(ys))
+        )
+        # Scenes already seen through an overlapping cell or an earlier refresh are skipped
+        if cursor.rowcount == 1:
+            day = properties['time_start'] / DAY_MS
+            conn.execute(
+                "INSERT INTO scene_index (id, minx, maxx, miny, maxy, tmin, tmax) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cursor.lastrowid, min(xs), max(xs), min(ys), max(ys), day, day)
+            )
+            inserted += 1
+    return inserted
+
+
+def _prune_scenes(conn, before_ms: int) -> int:
+    # Index entries are removed by the ids of the rows being deleted, so the rtree never outlives its scenes
+    conn.execute("DELETE FROM scene_index WHERE id IN (SELECT id FROM scenes WHERE time_start < ?)", (before_ms,))
+    return conn.execute("DELETE FROM scenes WHERE time_start < ?", (before_ms,)).rowcount
+
+
+def refresh_catalog(bbox: BBox, now_ms: Optional[int] = None) -> int:
+    now_ms = now_ms or int(time.time() * 1000)
+    cells = _cells(bbox)
+
+    with closing(_connect()) as conn:
+        keys = [_cell_key(cell) for cell in cells]
+        synced = {
+            row['cell']: row
+            for row in conn.execute(
+                f"SELECT cell, synced_until, synced_at FROM coverage WHERE cell IN ({','.join('?' * len(keys))})", keys
+            )
+        }
+        stale = [cell for cell in cells
+                 if _cell_key(cell) not in synced
+                 or time.time() - synced[_cell_key(cell)]['synced_at'] > CATALOG_REFRESH_INTERVAL]
+        record_cache_lookup('scene_catalog', not stale)
+        if not stale:
+            return 0
+
+        start_ms = now_ms - HISTORY_DAYS * DAY_MS
+        known = [synced[_cell_key(cell)]['synced_until'] for cell in stale if _cell_key(cell) in synced]
+        if len(known) == len(stale):
+            # Incremental refresh: only scenes newer than the oldest stale cell's sync point
+            start_ms = max(start_ms, min(known) - REFRESH_OVERLAP_DAYS * DAY_MS)
+
+        stale_bbox = (
+            min(ix for ix, _ in stale) * CELL_SIZE,
+            min(iy for _, iy in stale) * CELL_SIZE,
+            (max(ix for ix, _ in stale) + 1) * CELL_SIZE,
+            (max(iy for _, iy in stale) + 1) * CELL_SIZE,
+        )
+        features = _fetch_scene_metadata(stale_bbox, start_ms, now_ms)
+
+        with conn:
+            inserted = _insert_scenes(conn, features)
+            conn.executemany(
+                "INSERT OR REPLACE INTO coverage (cell, synced_until, synced_at) VALUES (?, ?, ?)",
+                [(_cell_key(cell), now_ms, time.time()) for cell in stale]
+            )
+            # Queries never look further back than HISTORY_DAYS, so older scenes are dropped everywhere
+            pruned = _prune_scenes(conn, now_ms - HISTORY_DAYS * DAY_MS)
+
+    logging.info(f"Scene catalog refreshed for {len(stale)} cell(s): {inserted} new of {len(features)} scenes, "
+                 f"{pruned} expired scene(s) removed")
+    return inserted
+
+
+def query_scenes(bbox: BBox, start_ms: int, end_ms: int, max_cloud_cover: Optional[float] = None,
+                 limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    minx, miny, maxx, maxy = bbox
+    sql = (
+        "SELECT s.scene_id, s.collection, s.tile_id, s.time_start, s.cloud_cover, s.minx, s.miny, s.maxx, s.maxy "
+        "FROM scene_index i JOIN scenes s ON s.id = i.id "
+        "WHERE i.maxx >= ? AND i.minx <= ? AND i.maxy >= ? AND i.miny <= ? AND i.tmax >= ? AND i.tmin <= ? "
+        "AND s.maxx >= ? AND s.minx <= ? AND s.maxy >= ? AND s.miny <= ? AND s.time_start BETWEEN ? AND ?"
+    )
+    params: List[Any] = [minx, maxx, miny, maxy, start_ms / DAY_MS, end_ms / DAY_MS,
+                         minx, maxx, miny, maxy, start_ms, end_ms]
+    if max_cloud_cover is not None:
+        sql += " AND s.cloud_cover <= ?"
+        params.append(max_cloud_cover)
+    sql += " ORDER BY s.time_start DESC, s.cloud_cover ASC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    with closing(_connect()) as conn:
+        return [dict(row) for row in conn.execute(sql, params)]
+
+
+def find_best_scene(bbox: BBox) -> Tuple[Optional[Dict[str, Any]], int]:
+    refresh_catalog(bbox)
+
+    now_ms = int(time.time() * 1000)
+    start_ms = now_ms - HISTORY_DAYS * DAY_MS
+    scenes = query_scenes(bbox, start_ms, now_ms)
+    if not scenes:
+        return None, 0
+
+    # Most recent acceptable scene, falling back to the most recent one of any cloudiness
+    clear = [scene for scene in scenes
+             if scene['cloud_cover'] is not None and scene['cloud_cover'] <= CATALOG_MAX_CLOUD_COVER]
+    return (clear or scenes)[0], len(scenes)
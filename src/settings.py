@@ -0,0 +1,87 @@
+import os
+
+# Writable location for caches and local stores (the Docker image only allows writes under /app/data)
+DATA_DIR = os.getenv('FARM_API_DATA_DIR', 'data')
+CACHE_DIR = os.getenv('FARM_API_CACHE_DIR', os.path.join(DATA_DIR, 'cache'))
+
+# Map tile proxy
+TILE_CACHE_MAX_BYTES = int(os.getenv('TILE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+TILE_MAX_AGE = int(os.getenv('TILE_MAX_AGE', str(24 * 60 * 60)))
+MAP_ID_TTL = int(os.getenv('MAP_ID_TTL', str(6 * 60 * 60)))
+MAX_CONCURRENT_TILE_FETCHES = int(os.getenv('MAX_CONCURRENT_TILE_FETCHES', '16'))
+TILE_FETCH_TIMEOUT = float(os.getenv('TILE_FETCH_TIMEOUT', '30'))
+
+# Locally rendered thumbnails
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+THUMBNAIL_DIMENSIONS = int(os.getenv('THUMBNAIL_DIMENSIONS', '1024'))
+
+# Cloud-optimized GeoTIFF exports
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '512'))
+MAX_EXPORT_PIXELS = int(os.getenv('MAX_EXPORT_PIXELS', str(64 * 1024 * 1024)))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv('EXPORT_CACHE_MAX_BYTES', str(4 * 1024 * 1024 * 1024)))
+# computePixels windows fetched at once for one export
+EXPORT_FETCH_CONCURRENCY = int(os.getenv('EXPORT_FETCH_CONCURRENCY', '4'))
+
+# Local HLS scene catalog
+CATALOG_REFRESH_INTERVAL = int(os.getenv('CATALOG_REFRESH_INTERVAL', str(6 * 60 * 60)))
+CATALOG_MAX_CLOUD_COVER = float(os.getenv('CATALOG_MAX_CLOUD_COVER', '50'))
+
+# In-process tracing (spans are kept in a ring buffer and optionally appended to a JSON-lines file)
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '200'))
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+# Share of traces whose Earth Engine spans carry the serialized-expression attributes (size, datasets)
+TRACE_EXPRESSION_SAMPLE_RATE = float(os.getenv('TRACE_EXPRESSION_SAMPLE_RATE', '0.05'))
+
+# Debug/profiling endpoints are disabled unless a token is configured
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+
+# Registered fields and scheduled precomputation
+FIELD_SCHEDULER_ENABLED = os.getenv('FIELD_SCHEDULER_ENABLED', '1') == '1'
+FIELD_SCHEDULER_INTERVAL = int(os.getenv('FIELD_SCHEDULER_INTERVAL', str(60 * 60)))
+FIELD_BATCH_SIZE = int(os.getenv('FIELD_BATCH_SIZE', '100'))
+FIELD_NDVI_DAYS = int(os.getenv('FIELD_NDVI_DAYS', '365'))
+FIELD_CLIMATE_DAYS = int(os.getenv('FIELD_CLIMATE_DAYS', '90'))
+# The scheduler follows the maintained MOD13Q1 collection; MODIS/006 stopped receiving composites in 2023
+FIELD_NDVI_COLLECTION = os.getenv('FIELD_NDVI_COLLECTION', 'MODIS/061/MOD13Q1')
+# A latest composite older than this means the collection has stopped updating
+FIELD_COMPOSITE_MAX_AGE_DAYS = int(os.getenv('FIELD_COMPOSITE_MAX_AGE_DAYS', '64'))
+# NASA/GDDP-CMIP6 has one image per model, scenario and day; field summaries use a single model run
+FIELD_CMIP6_MODEL = os.getenv('FIELD_CMIP6_MODEL', 'ACCESS-CM2')
+FIELD_CMIP6_SCENARIO = os.getenv('FIELD_CMIP6_SCENARIO', 'ssp245')
+
+# NDVI climatology baselines
+BASELINE_START_DATE = os.getenv('BASELINE_START_DATE', '2000-02-18')
+BASELINE_WORKERS = int(os.getenv('BASELINE_WORKERS', '2'))
+BASELINE_RETRY_AFTER = int(os.getenv('BASELINE_RETRY_AFTER', str(60 * 60)))
+
+# Crop profiles (NDVI health thresholds and growth-stage calendars)
+# Relative to the repository, not the working directory, so scripts and tests can import from anywhere
+CROP_PROFILES_FILE = os.getenv('CROP_PROFILES_FILE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'crop_profiles.json'))
+
+# Geohash grid statistics
+GRID_MAX_CELLS = int(os.getenv('GRID_MAX_CELLS', '2500'))
+GRID_CACHE_TTL = int(os.getenv('GRID_CACHE_TTL', str(24 * 60 * 60)))
+
+# Overlap-aware NDVI statistics: additive partial sums cached per MODIS-grid block
+NDVI_CELL_CACHE = os.getenv('NDVI_CELL_CACHE', '0') == '1'
+NDVI_CELL_BLOCK_PIXELS = int(os.getenv('NDVI_CELL_BLOCK_PIXELS', '4'))
+
+# Vector tiles of uploaded regions
+REGION_TILE_CACHE_MAX_BYTES = int(os.getenv('REGION_TILE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Multi-worker deployment (gunicorn.conf.py): every worker writes its Prometheus samples here and /metrics aggregates them
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR', '')
+
+# Earth Engine circuit breakers (per dataset) and stale-result fallback
+EE_CALL_DEADLINE = float(os.getenv('EE_CALL_DEADLINE', '60'))
+EE_DEADLINES = {dataset: float(os.getenv(f'EE_DEADLINE_{dataset.upper()}', str(EE_CALL_DEADLINE)))
+                for dataset in ('modis', 'hls', 'cmip6')}
+EE_MAX_CONCURRENT_CALLS = int(os.getenv('EE_MAX_CONCURRENT_CALLS', '32'))
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv('BREAKER_MAX_OPEN_SECONDS', '600'))
+STALE_RESULT_MAX_AGE = int(os.getenv('STALE_RESULT_MAX_AGE', str(7 * 24 * 60 * 60)))
+STALE_RESULT_REFRESH_INTERVAL = int(os.getenv('STALE_RESULT_REFRESH_INTERVAL', '300'))
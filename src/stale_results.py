@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from .db import get_connection
+from .circuit_breaker import upstream_failure
+from .metrics import STALE_RESPONSES
+from .settings import STALE_RESULT_MAX_AGE, STALE_RESULT_REFRESH_INTERVAL, BREAKER_OPEN_SECONDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stale_results (
+    key TEXT PRIMARY KEY,
+    route TEXT NOT NULL,
+    body BLOB NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stale_results_stored_at ON stale_results (stored_at);
+"""
+
+MAX_TRACKED_KEYS = 10000
+
+_revalidating = set()  # keys with a background recomputation in flight in this worker
+_background_tasks = set()
+_stored_at = OrderedDict()  # key -> when this worker last stored it, most recent last
+
+
+def _connect():
+    conn = get_connection('stale_results')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def result_key(route: str, *parts: Any) -> str:
+    encoded = orjson.dumps([route, parts], option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str)
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def store_result(route: str, key: str, result: Any):
+    body = orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY)
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO stale_results (key, route, body, stored_at) VALUES (?, ?, ?, ?)",
+                     (key, route, body, now))
+        conn.execute("DELETE FROM stale_results WHERE stored_at < ?", (now - STALE_RESULT_MAX_AGE,))
+
+
+def _store_due(key: str) -> bool:
+    # A hot request is stored at most every STALE_RESULT_REFRESH_INTERVAL per worker, not on every success
+    now = time.time()
+    if now - _stored_at.get(key, 0) < STALE_RESULT_REFRESH_INTERVAL:
+        return False
+    _stored_at[key] = now
+    _stored_at.move_to_end(key)
+    while len(_stored_at) > MAX_TRACKED_KEYS:
+        _stored_at.popitem(last=False)
+    return True
+
+
+def load_result(key: str) -> Optional[Tuple[Any, float]]:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT body, stored_at FROM stale_results WHERE key = ? AND stored_at >= ?",
+                           (key, time.time() - STALE_RESULT_MAX_AGE)).fetchone()
+    return (orjson.loads(row['body']), row['stored_at']) if row else None
+
+
+async def _revalidate(route: str, key: str, compute: Callable[[], Any], storable: Optional[Callable[[Any], bool]]):
+    try:
+        result = await run_in_threadpool(compute)
+        if storable is not None and not storable(result):
+            return
+        await run_in_threadpool(store_result, route, key, result)
+        _stored_at[key] = time.time()
+        logging.info(f"Revalidated stale {route} result {key}")
+    except Exception as e:
+        logging.info(f"Revalidation of {route} result {key} failed: {str(e)}")
+    finally:
+        _revalidating.discard(key)
+
+
+def _schedule_revalidation(route: str, key: str, compute: Callable[[], Any], storable: Optional[Callable[[Any], bool]]):
+    # While the breaker is open the recomputation fails fast; once it lets a probe through, this refreshes the entry
+    if key in _revalidating:
+        return
+    _revalidating.add(key)
+    task = asyncio.create_task(_revalidate(route, key, compute, storable))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def with_stale_fallback(route: str, key: str, compute: Callable[[], Any],
+                              storable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, Dict[str, Any]]:
+    # Runs compute (which makes Earth Engine calls) off the event loop and remembers its result. When Earth Engine
+    # is failing, returns the last good result for the same request instead, with the markers to add to the response.
+    # `storable` can veto remembering a result that is not final yet (one still waiting on a background job)
+    try:
+        result = await run_in_threadpool(compute)
+    except Exception as e:
+        failure = upstream_failure(e)
+        if failure is None:
+            raise
+        cached = await run_in_threadpool(load_result, key)
+        if cached is None:
+            retry_after = math.ceil(getattr(failure, 'retry_after', BREAKER_OPEN_SECONDS))
+            raise HTTPException(status_code=503, detail=f"{str(failure).rstrip('.')}. No earlier result is available for this request.",
+                                headers={"Retry-After": str(retry_after)})
+        result, stored_at = cached
+        STALE_RESPONSES.labels(route).inc()
+        logging.warning(f"Serving stale {route} result from {stored_at:.0f}: {str(failure)}")
+        _schedule_revalidation(route, key, compute, storable)
+        return result, {
+            "stale": True,
+            "computed_at": datetime.fromtimestamp(stored_at, timezone.utc).isoformat(),
+            "stale_reason": str(failure),
+        }
+
+    if (storable is None or storable(result)) and _store_due(key):
+        await run_in_threadpool(store_result, route, key, result)
+    return result, {}
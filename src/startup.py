@@ -0,0 +1,95 @@
+import time
+
+_process_start = time.perf_counter()
+
+import os
+import sys
+import logging
+import threading
+import importlib.util
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+# Seconds since this module was first imported, per startup stage
+STARTUP_TIMINGS: Dict[str, float] = {}
+
+ee_ready = threading.Event()
+ee_init_error: Optional[str] = None
+
+
+def lazy_import(name: str):
+    # Heavy client libraries are only executed on first attribute access, so a worker
+    # can answer liveness/metadata requests before they are loaded
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def mark(stage: str):
+    STARTUP_TIMINGS[stage] = round(time.perf_counter() - _process_start, 4)
+
+
+def initialize_earth_engine():
+    global ee_init_error
+    started = time.perf_counter()
+    try:
+        import ee
+        service_account = os.getenv('EE_SERVICE_ACCOUNT', 'test-724@ee-mazikuben2.iam.gserviceaccount.com')
+        key_file = os.getenv('EE_CREDENTIALS_FILE', 'credentials.json')
+        credentials = ee.ServiceAccountCredentials(service_account, key_file)
+        ee.Initialize(credentials)
+        ee_ready.set()
+        logging.info("Earth Engine initialized")
+    except Exception as e:
+        ee_init_error = str(e)
+        logging.error(f"Earth Engine initialization failed: {str(e)}", exc_info=True)
+    finally:
+        STARTUP_TIMINGS['earth_engine_init_duration'] = round(time.perf_counter() - started, 4)
+        mark('earth_engine_init_finished')
+
+
+def start_earth_engine_init() -> threading.Thread:
+    thread = threading.Thread(target=initialize_earth_engine, name='ee-init', daemon=True)
+    thread.start()
+    return thread
+
+
+def require_earth_engine():
+    if not ee_ready.is_set():
+        detail = f"Earth Engine initialization failed: {ee_init_error}" if ee_init_error else "Earth Engine is still initializing. Retry shortly."
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "2"})
+
+
+def readiness() -> Dict[str, Any]:
+    return {
+        "ready": ee_ready.is_set(),
+        "earth_engine": "ready" if ee_ready.is_set() else ("failed" if ee_init_error else "initializing"),
+        "error": ee_init_error,
+    }
+
+
+def _module_state(name: str) -> str:
+    module = sys.modules.get(name)
+    if module is None:
+        return "not imported"
+    # LazyLoader swaps the module class back to ModuleType once it has executed
+    if type(module).__name__ == '_LazyModule':
+        return "deferred"
+    return "loaded"
+
+
+def startup_report() -> Dict[str, Any]:
+    return {
+        "timings_seconds": STARTUP_TIMINGS,
+        "uptime_seconds": round(time.perf_counter() - _process_start, 3),
+        "heavy_modules": {name: _module_state(name)
+                          for name in ('ee', 'geopandas', 'numpy', 'rasterio', 'aiohttp', 'PIL')},
+        **readiness(),
+    }
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+
+from src.cache import DiskLRUCache
+
+
+def test_put_evicts_least_recently_used_over_budget(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'tiles'), max_bytes=250)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, b'x' * 100)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == b'x' * 100
+    assert cache.get('c') == b'x' * 100
+    assert len(os.listdir(tmp_path / 'tiles')) == 2
+
+
+def test_running_total_tracks_replacements_and_evictions(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'tiles'), max_bytes=1000)
+    cache.put('a', b'x' * 100)
+    cache.put('a', b'x' * 300)
+    cache.put('b', b'x' * 500)
+    cache.put('c', b'x' * 400)
+
+    conn = sqlite3.connect(cache.index_path)
+    total = conn.execute("SELECT bytes FROM totals").fetchone()[0]
+    summed = conn.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+    assert total == summed == 900
+
+
+def test_existing_index_without_totals_is_summed_once(tmp_path):
+    directory = str(tmp_path / 'tiles')
+    DiskLRUCache(directory, max_bytes=1000).put('a', b'x' * 100)
+    conn = sqlite3.connect(directory + '.db')
+    conn.execute("DROP TABLE totals")
+    conn.commit()
+
+    cache = DiskLRUCache(directory, max_bytes=1000)
+    cache.put('b', b'x' * 200)
+    assert conn.execute("SELECT bytes FROM totals").fetchone()[0] == 300
+
+
+def test_put_file_moves_files_into_the_budget(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'exports'), max_bytes=250)
+    for key in ('a', 'b', 'c'):
+        source = tmp_path / f'{key}.tif'
+        source.write_bytes(b'x' * 100)
+        path = cache.put_file(key, str(source))
+        assert not source.exists()
+        assert open(path, 'rb').read() == b'x' * 100
+
+    assert cache.file_path('a') is None
+    assert cache.file_path('c') == path
+    assert len(os.listdir(tmp_path / 'exports')) == 2
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from src import circuit_breaker
+from src.circuit_breaker import CircuitBreaker, UpstreamUnavailable, guarded_call
+from src.settings import BREAKER_MIN_CALLS, BREAKER_OPEN_SECONDS
+
+
+class FakeSpan:
+    def __init__(self):
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+def opened_breaker():
+    breaker = CircuitBreaker('modis', deadline=1)
+    for _ in range(BREAKER_MIN_CALLS):
+        breaker.record(False)
+    return breaker
+
+
+def expire(breaker):
+    breaker._open_until = time.time() - 1
+
+
+def test_opens_after_enough_failures_and_rejects():
+    breaker = opened_breaker()
+    assert breaker.state == 'open'
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+
+
+def test_successes_keep_breaker_closed():
+    breaker = CircuitBreaker('modis', deadline=1)
+    for ok in [True, True, False] * BREAKER_MIN_CALLS:
+        breaker.record(ok)
+    assert breaker.state == 'closed'
+
+
+def test_half_open_admits_a_single_probe():
+    breaker = opened_breaker()
+    expire(breaker)
+    probe = breaker.before_call()
+    assert probe is not None and breaker.state == 'half_open'
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+
+    breaker.record(True, probe)
+    assert breaker.state == 'closed'
+    assert breaker.before_call() is None
+
+
+def test_late_outcome_of_an_earlier_call_does_not_decide_half_open():
+    breaker = opened_breaker()
+    expire(breaker)
+    probe = breaker.before_call()
+
+    # A call admitted while the breaker was still closed finishes during the probe
+    breaker.record(True)
+    assert breaker.state == 'half_open'
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+
+    breaker.record(False, probe)
+    assert breaker.state == 'open'
+
+
+def test_failed_probe_doubles_the_open_period():
+    breaker = opened_breaker()
+    expire(breaker)
+    breaker.record(False, breaker.before_call())
+    assert breaker.state == 'open'
+    assert breaker._open_seconds == 2 * BREAKER_OPEN_SECONDS
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    breaker = opened_breaker()
+    expire(breaker)
+    breaker.cancel_probe(breaker.before_call())
+    assert breaker.before_call() is not None
+
+
+def test_guarded_call_turns_an_overrun_into_upstream_unavailable(monkeypatch):
+    breaker = CircuitBreaker('modis', deadline=0.05)
+    monkeypatch.setitem(circuit_breaker.breakers, 'modis', breaker)
+    span = FakeSpan()
+
+    with pytest.raises(UpstreamUnavailable):
+        guarded_call(['modis'], span, time.sleep, 0.5)
+    assert span.attributes['ee.deadline_exceeded'] == 0.05
+    assert list(breaker._outcomes) == [False]
+
+
+def test_guarded_call_does_not_count_invalid_requests_as_failures(monkeypatch):
+    import ee
+
+    breaker = CircuitBreaker('hls', deadline=1)
+    monkeypatch.setitem(circuit_breaker.breakers, 'hls', breaker)
+
+    def invalid():
+        raise ee.EEException("Image.select: Pattern 'X' did not match any bands.")
+
+    def overloaded():
+        raise ee.EEException("Too many concurrent aggregations.")
+
+    with pytest.raises(ee.EEException):
+        guarded_call(['hls'], FakeSpan(), invalid)
+    with pytest.raises(ee.EEException):
+        guarded_call(['hls'], FakeSpan(), overloaded)
+    assert list(breaker._outcomes) == [True, False]
@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.crop_profiles import load_crop_profiles
+from src.farm_analysis import (CROP_PROFILES, check_thresholds_on_bin_edges, classify_ndvi,
+                               health_class_fractions_matrix, ndvi_histogram_edges)
+
+
+def test_shipped_profiles_load_from_any_working_directory():
+    assert {'corn', 'wheat', 'soybeans'} <= set(CROP_PROFILES)
+
+
+def test_mean_and_histogram_agree_on_a_threshold():
+    edges = ndvi_histogram_edges()
+    for crop, profile in CROP_PROFILES.items():
+        for value in profile['thresholds'].values():
+            counts = np.zeros(len(edges) - 1)
+            counts[edges.index(value)] = 1
+            by_mean = classify_ndvi(np.array([value]), [crop])[0, 0]
+            by_histogram = health_class_fractions_matrix([counts], [crop])[0, 0].argmax()
+            assert by_mean == by_histogram
+
+
+def test_threshold_between_bin_edges_is_rejected():
+    with pytest.raises(ValueError, match="multiple of 0.05"):
+        check_thresholds_on_bin_edges({'custom': {'thresholds': {'poor': 0.33, 'fair': 0.5, 'good': 0.7}}})
+
+
+def test_decreasing_thresholds_are_rejected(tmp_path):
+    path = tmp_path / 'profiles.json'
+    path.write_text(json.dumps({'custom': {'thresholds': {'poor': 0.5, 'fair': 0.4, 'good': 0.7}}}))
+    with pytest.raises(ValueError, match="increase"):
+        load_crop_profiles(str(path))
@@ -0,0 +1,67 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+
+from src import db, field_registry
+from src.settings import FIELD_NDVI_COLLECTION
+
+FIELD = {'type': 'Polygon', 'coordinates': [[[30.0, 10.0], [30.01, 10.0], [30.01, 10.01], [30.0, 10.0]]]}
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(field_registry, 'ee', mock.MagicMock())
+    field_registry.register_field('North', 'maize', FIELD)
+    return field_registry
+
+
+def latest_composite(monkeypatch, days_ago):
+    latest = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    get_info = mock.Mock(return_value=latest.timestamp() * 1000)
+    monkeypatch.setattr(field_registry, 'traced_get_info', get_info)
+    return latest.strftime('%Y-%m-%d')
+
+
+def test_latest_composite_is_read_from_the_maintained_collection(registry, monkeypatch):
+    expected = latest_composite(monkeypatch, 5)
+
+    assert registry.latest_composite_date() == expected
+    registry.ee.ImageCollection.assert_called_once_with(FIELD_NDVI_COLLECTION)
+    assert FIELD_NDVI_COLLECTION == 'MODIS/061/MOD13Q1'
+
+
+def test_discontinued_collection_is_reported(registry, monkeypatch, caplog):
+    composite_date = latest_composite(monkeypatch, 600)
+    precompute = mock.Mock()
+    monkeypatch.setattr(registry, 'precompute_fields', precompute)
+
+    with caplog.at_level(logging.WARNING):
+        result = registry.precompute_due_fields()
+
+    assert result == {"status": "stale_collection", "composite_date": composite_date, "computed": 0}
+    assert "looks discontinued" in caplog.text
+    precompute.assert_not_called()
+
+
+def test_empty_collection_is_reported(registry, monkeypatch, caplog):
+    monkeypatch.setattr(registry, 'traced_get_info', mock.Mock(return_value=None))
+
+    with caplog.at_level(logging.WARNING):
+        result = registry.precompute_due_fields()
+
+    assert result == {"status": "no_composite", "computed": 0}
+    assert FIELD_NDVI_COLLECTION in caplog.text
+
+
+def test_recent_composite_precomputes_due_fields(registry, monkeypatch):
+    composite_date = latest_composite(monkeypatch, 10)
+    precompute = mock.Mock(side_effect=lambda batch, day: len(batch))
+    monkeypatch.setattr(registry, 'precompute_fields', precompute)
+
+    result = registry.precompute_due_fields()
+
+    assert result == {"status": "ok", "composite_date": composite_date, "due": 1, "computed": 1}
+    assert precompute.call_args.args[1] == composite_date
@@ -0,0 +1,121 @@
+from unittest import mock
+
+import numpy as np
+import shapely
+
+from src import farm_analysis
+from src.ndvi_cells import CRS_TRANSFORM, GRID_ORIGIN_X, GRID_ORIGIN_Y, PIXEL_SIZE, RESIDUAL_ID, SINUSOIDAL_WKT, \
+    _assemble, _cell_coordinates, cell_id, composite_dates, interior_cells, to_sinusoidal
+
+AOI = {'type': 'Polygon', 'coordinates': [[[30.0, 10.0], [30.1, 10.0], [30.1, 10.08], [30.0, 10.08], [30.0, 10.0]]]}
+
+
+def partial_sums(cid, day, pixels, bins=4):
+    pixels = np.asarray(pixels, dtype=float)
+    histogram = np.histogram(pixels, bins=bins, range=(-1, 1))[0].tolist()
+    return (cid, day, len(pixels), float(pixels.sum()), float((pixels ** 2).sum()),
+            float(pixels.min()), float(pixels.max()), histogram)
+
+
+def test_composite_dates_span_year_boundary():
+    dates = composite_dates('2021-12-01', '2022-01-20')
+
+    assert dates == ['2021-12-03', '2021-12-19', '2022-01-01', '2022-01-17']
+
+
+def test_composite_dates_exclude_end_date():
+    assert composite_dates('2022-01-01', '2022-01-17') == ['2022-01-01']
+
+
+def test_interior_cells_lie_inside_aoi():
+    cells = interior_cells(AOI, block_pixels=8)
+    region = shapely.transform(shapely.segmentize(shapely.geometry.shape(AOI), 0.0005), to_sinusoidal)
+
+    assert cells
+    for column, row in cells:
+        block = shapely.geometry.Polygon(_cell_coordinates(column, row, 8)[0])
+        assert region.contains(block)
+        assert np.isclose(block.area, (8 * PIXEL_SIZE) ** 2)
+
+
+def test_interior_cells_empty_for_aoi_smaller_than_a_block():
+    tiny = {'type': 'Point', 'coordinates': [30.0, 10.0]}
+
+    assert interior_cells(tiny, block_pixels=8) == []
+
+
+def test_assemble_matches_statistics_of_combined_pixels():
+    rng = np.random.default_rng(0)
+    parts = [rng.uniform(-0.2, 0.9, size) for size in (17, 64, 5)]
+    rows = [partial_sums(cell_id(i, 0), '2022-01-01', pixels) for i, pixels in enumerate(parts)]
+    pixels = np.concatenate(parts)
+
+    [feature] = _assemble(rows, ['2022-01-01'])
+    stats = feature['properties']
+
+    assert stats['date'] == '2022-01-01'
+    assert np.isclose(stats['mean'], pixels.mean())
+    assert np.isclose(stats['stdDev'], pixels.std())
+    assert stats['min'] == pixels.min()
+    assert stats['max'] == pixels.max()
+    assert stats['histogram'] == np.histogram(pixels, bins=4, range=(-1, 1))[0].tolist()
+
+
+def test_assemble_skips_empty_cells_and_other_dates():
+    rows = [
+        partial_sums('residual', '2022-01-01', [0.4, 0.6]),
+        ('8/1/1', '2022-01-01', 0, 0.0, 0.0, None, None, None),
+        partial_sums('8/2/2', '2022-02-02', [0.9]),
+    ]
+
+    features = _assemble(rows, ['2022-01-01', '2022-01-17'])
+
+    assert [feature['properties']['date'] for feature in features] == ['2022-01-01']
+    assert np.isclose(features[0]['properties']['mean'], 0.5)
+    assert features[0]['properties']['min'] == 0.4
+
+
+def test_cached_cells_match_a_single_reduction_over_the_aoi():
+    # Pixels on the native grid count when their centre is inside the AOI, as in an unweighted reduceRegion
+    region = shapely.transform(shapely.segmentize(shapely.geometry.shape(AOI), 0.0005), to_sinusoidal)
+    west, south, east, north = region.bounds
+    columns = np.arange(int((west - GRID_ORIGIN_X) // PIXEL_SIZE), int((east - GRID_ORIGIN_X) // PIXEL_SIZE) + 1)
+    rows = np.arange(int((GRID_ORIGIN_Y - north) // PIXEL_SIZE), int((GRID_ORIGIN_Y - south) // PIXEL_SIZE) + 1)
+    column, row = [grid.ravel() for grid in np.meshgrid(columns, rows)]
+    inside = shapely.contains_xy(region, GRID_ORIGIN_X + (column + 0.5) * PIXEL_SIZE,
+                                 GRID_ORIGIN_Y - (row + 0.5) * PIXEL_SIZE)
+    values = np.random.default_rng(1).uniform(-0.1, 0.9, column.shape)
+
+    cells = interior_cells(AOI, block_pixels=8)
+    cell_of_pixel = [cell_id(c, r, 8) if (c, r) in set(cells) else RESIDUAL_ID
+                     for c, r in zip((column // 8).tolist(), (row // 8).tolist())]
+    ids = np.array(cell_of_pixel)
+    assert inside[ids != RESIDUAL_ID].all()
+    parts = [partial_sums(cid, '2022-01-01', values[inside & (ids == cid)], bins=40)
+             for cid in [cell_id(c, r, 8) for c, r in cells] + [RESIDUAL_ID]]
+
+    [feature] = _assemble(parts, ['2022-01-01'])
+    stats, pixels = feature['properties'], values[inside]
+
+    assert np.isclose(stats['mean'], pixels.mean())
+    assert np.isclose(stats['stdDev'], pixels.std())
+    assert (stats['min'], stats['max']) == (pixels.min(), pixels.max())
+    assert stats['histogram'] == np.histogram(pixels, bins=40, range=(-1, 1))[0].tolist()
+
+
+def test_uncached_reduction_uses_the_cell_grid(monkeypatch):
+    ee = mock.MagicMock()
+    monkeypatch.setattr(farm_analysis, 'ee', ee)
+    monkeypatch.setattr(farm_analysis, 'NDVI_CELL_CACHE', False)
+    monkeypatch.setattr(farm_analysis, 'traced_get_info', mock.Mock(side_effect=[1, {'features': []}]))
+
+    farm_analysis.calculate_ndvi_stats(mock.MagicMock(), '2022-01-01', '2022-02-01')
+    calc_stats = ee.ImageCollection.return_value.filterDate.return_value.filterBounds.return_value.map.call_args.args[0]
+    image = mock.MagicMock()
+    calc_stats(image)
+
+    kwargs = image.select.return_value.divide.return_value.reduceRegion.call_args.kwargs
+    assert kwargs['crs'] == SINUSOIDAL_WKT
+    assert kwargs['crsTransform'] == CRS_TRANSFORM
+    assert 'scale' not in kwargs
+    assert "unweighted()'" in repr(kwargs['reducer'])
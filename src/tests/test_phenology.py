@@ -0,0 +1,66 @@
+import numpy as np
+
+from src.phenology import fit_phenology, ndvi_matrix, whittaker_smooth
+
+
+def mod13q1_dates(years):
+    # MOD13Q1 composites start on day 1, 17, 33, ... of every year
+    return [np.datetime64(f'{year}-01-01') + 16 * k for year in years for k in range(23)]
+
+
+def seasonal_series(dates, peak_doy=200):
+    def ndvi(date):
+        doy = (date - date.astype('datetime64[Y]')).astype(int) + 1
+        return 0.2 + 0.5 * np.exp(-((doy - peak_doy) / 40) ** 2)
+    return [{'properties': {'date': str(date), 'mean': float(ndvi(date))}} for date in dates]
+
+
+def test_multi_year_series_keeps_every_composite():
+    dates = mod13q1_dates(range(2020, 2024))
+    grid, values = ndvi_matrix([seasonal_series(dates)])
+
+    assert values.shape == (1, 92)
+    assert np.count_nonzero(~np.isnan(values)) == 92
+    assert list(grid.astype(str)) == [str(date) for date in dates]
+
+
+def test_year_boundary_does_not_shift_values():
+    dates = mod13q1_dates([2021, 2022])
+    series = seasonal_series(dates)
+    grid, values = ndvi_matrix([series])
+
+    by_date = dict(zip(grid.astype(str), values[0]))
+    for feature in series:
+        assert by_date[feature['properties']['date']] == feature['properties']['mean']
+
+
+def test_missing_composites_are_nan_and_series_share_the_grid():
+    dates = mod13q1_dates([2022, 2023])
+    gappy = [feature for i, feature in enumerate(seasonal_series(dates)) if i % 5]
+    grid, values = ndvi_matrix([seasonal_series(dates), gappy])
+
+    assert len(grid) == len(dates)
+    assert np.isnan(values[1, ::5]).all()
+    assert not np.isnan(values[0]).any()
+
+
+def test_smoother_fills_gaps_and_leaves_short_rows_unfitted():
+    values = np.array([[0.2, np.nan, 0.4, 0.5, np.nan, 0.5, 0.4, 0.3],
+                       [0.2, np.nan, np.nan, np.nan, np.nan, np.nan, 0.4, 0.3]])
+    smoothed = whittaker_smooth(values)
+
+    assert not np.isnan(smoothed[0]).any()
+    assert np.isnan(smoothed[1]).all()
+
+
+def test_season_spanning_new_year_is_fitted_on_the_real_dates():
+    # Southern-hemisphere style season peaking around 1 January
+    dates = mod13q1_dates([2022, 2023])[12:35]
+    series = [{'properties': {'date': str(date),
+                              'mean': 0.2 + 0.5 * np.exp(-(((date - np.datetime64('2023-01-01')).astype(int)) / 40) ** 2)}}
+              for date in dates]
+    phenology = fit_phenology([series])[0]
+
+    assert phenology['season_status'] == 'senescence'
+    peak = np.datetime64(phenology['peak_date'])
+    assert abs((peak - np.datetime64('2023-01-01')).astype(int)) <= 16
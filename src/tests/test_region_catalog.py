@@ -0,0 +1,86 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+import shapely
+
+from src.region_catalog import RegionCatalog
+from src.uploads import Upload
+
+
+def make_catalog(count=23):
+    # Region i is a 1 degree box at longitude i; every third region is a district, the rest are provinces
+    geometries = [shapely.box(i, 0, i + 1, 1) for i in range(count)]
+    geometries[5] = None
+    table = pa.table({
+        'NAME_1': [f'Region {i}' for i in range(count)],
+        'ID_1': list(range(1, count + 1)),
+        'TYPE_1': ['District' if i % 3 == 0 else 'Province' for i in range(count)],
+        'NAME_0': ['Kenya' if i < 10 else 'Uganda' for i in range(count)],
+        'crop': ['maize' if i % 2 else 'wheat' for i in range(count)],
+        'geometry': shapely.to_wkb(np.array(geometries)),
+    })
+    return RegionCatalog(Upload('0123456789abcdef0123', table), None)
+
+
+def page_through(catalog, positions, limit):
+    seen, after = [], None
+    while True:
+        regions, after = catalog.page(positions, after, limit, None, False)
+        seen.extend(region['id'] for region in regions)
+        if after is None:
+            return seen
+
+
+@pytest.mark.parametrize('limit', [1, 4, 7, 23, 50])
+def test_cursor_pages_visit_every_region_once(limit):
+    catalog = make_catalog()
+    positions = catalog.select({}, None)
+
+    assert page_through(catalog, positions, limit) == list(range(1, 24))
+
+
+def test_cursor_pages_over_filtered_positions():
+    catalog = make_catalog()
+    positions = catalog.select({'TYPE_1': ['District']}, None)
+
+    assert page_through(catalog, positions, 3) == [i + 1 for i in range(0, 23, 3)]
+
+
+def test_last_full_page_has_no_next_cursor():
+    catalog = make_catalog(8)
+    positions = catalog.select({}, None)
+
+    first, cursor = catalog.page(positions, None, 4, None, False)
+    second, last = catalog.page(positions, cursor, 4, None, False)
+
+    assert cursor == 3
+    assert [region['id'] for region in second] == [5, 6, 7, 8]
+    assert last is None
+
+
+def test_values_of_one_property_are_or_ed_and_properties_and_ed():
+    catalog = make_catalog()
+
+    either = catalog.select({'crop': ['maize', 'wheat']}, None)
+    both = catalog.select({'NAME_0': ['Uganda'], 'crop': ['maize']}, None)
+
+    assert either.tolist() == list(range(23))
+    assert both.tolist() == [i for i in range(10, 23) if i % 2]
+
+
+def test_bbox_filter_skips_missing_geometries():
+    catalog = make_catalog()
+
+    assert catalog.select({}, (3.5, 0.2, 6.5, 0.8)).tolist() == [3, 4, 6]
+
+
+def test_page_includes_requested_properties():
+    catalog = make_catalog()
+    positions = catalog.select({}, None)
+
+    regions, _ = catalog.page(positions, None, 2, ['crop', 'missing'], False)
+    full, _ = catalog.page(positions, None, 1, None, True)
+
+    assert regions[1] == {'id': 2, 'name': 'Region 1', 'type': 'Province', 'country': 'Kenya',
+                          'properties': {'crop': 'maize', 'missing': None}}
+    assert full[0]['properties']['TYPE_1'] == 'District'
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+import mapbox_vector_tile
+import numpy as np
+import pyarrow as pa
+import shapely
+
+from src import region_tiles
+from src.cache import DiskLRUCache
+from src.region_tiles import LAYER_NAME, MVT_EXTENT, TILE_BUFFER, _build_index, _render_tile, get_region_tile
+from src.uploads import Upload
+
+UPLOAD_ID = '0123456789abcdef0123'
+
+
+def make_upload():
+    # A region straddling the equator and the prime meridian, and a small one far away from it
+    geometries = [shapely.box(-10, -5, 10, 5), shapely.box(100, 40, 101, 41)]
+    table = pa.table({'name': ['Straddling', 'Remote'], 'id': ['a', 'b'],
+                      'geometry': shapely.to_wkb(np.array(geometries))})
+    return Upload(UPLOAD_ID, table)
+
+
+def decode_features(tile):
+    return mapbox_vector_tile.decode(tile)[LAYER_NAME]['features']
+
+
+def ring_points(geometry):
+    coordinates = geometry['coordinates']
+    rings = coordinates if geometry['type'] == 'Polygon' else [ring for polygon in coordinates for ring in polygon]
+    return np.array([point for ring in rings for point in ring])
+
+
+def test_features_are_clipped_to_buffered_tile():
+    index = _build_index(make_upload(), None)
+
+    features = decode_features(_render_tile(index, 4, 8, 7))
+
+    assert [feature['properties'] for feature in features] == [{'id': 'a', 'name': 'Straddling'}]
+    points = ring_points(features[0]['geometry'])
+    assert points.min() >= -TILE_BUFFER
+    assert points.max() <= MVT_EXTENT + TILE_BUFFER
+    # The region extends past the tile's west and south edges, so it is cut at the buffer, not at the region
+    assert points[:, 0].min() == -TILE_BUFFER
+
+
+def test_tile_without_regions_is_empty():
+    index = _build_index(make_upload(), None)
+
+    assert _render_tile(index, 4, 3, 3) == b''
+
+
+def test_rendered_tiles_are_cached(tmp_path, monkeypatch):
+    loads = []
+    upload = make_upload()
+    monkeypatch.setattr(region_tiles, 'region_tile_cache', DiskLRUCache(str(tmp_path / 'tiles'), 1 << 20))
+    monkeypatch.setattr(region_tiles, 'load_upload', lambda upload_id: loads.append(upload_id) or upload)
+    monkeypatch.setattr(region_tiles, '_indexes', OrderedDict())
+
+    first = get_region_tile(UPLOAD_ID, 4, 8, 7)
+    again = get_region_tile(UPLOAD_ID, 4, 8, 7)
+    empty = get_region_tile(UPLOAD_ID, 4, 3, 3)
+
+    assert first and again == first
+    assert empty == b''
+    assert loads == [UPLOAD_ID]
+    assert region_tiles.region_tile_cache.get(f'{UPLOAD_ID}//4/8/7') == first
+
+
+def test_unknown_upload_has_no_tiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(region_tiles, 'region_tile_cache', DiskLRUCache(str(tmp_path / 'tiles'), 1 << 20))
+    monkeypatch.setattr(region_tiles, 'load_upload', lambda upload_id: None)
+
+    assert get_region_tile('f' * 20, 4, 8, 7) is None
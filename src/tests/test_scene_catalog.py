@@ -0,0 +1,40 @@
+import sqlite3
+
+import pytest
+
+from src import db, scene_catalog
+from src.scene_catalog import DAY_MS, HISTORY_DAYS, query_scenes, refresh_catalog
+
+NOW_MS = 1_700_000_000_000
+BBOX = (30.2, 10.2, 30.4, 10.4)
+
+
+def scene(scene_id, time_start):
+    ring = [[30.0, 10.0], [31.0, 10.0], [31.0, 11.0], [30.0, 11.0], [30.0, 10.0]]
+    return {'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': {'scene_id': f'NASA/HLS/HLSL30/v002/{scene_id}', 'tile_id': '36PUS',
+                           'time_start': time_start, 'cloud_cover': 10.0}}
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DATA_DIR', str(tmp_path))
+    # Every refresh re-syncs, as if the refresh interval had passed
+    monkeypatch.setattr(scene_catalog, 'CATALOG_REFRESH_INTERVAL', -1)
+    return sqlite3.connect(str(tmp_path / 'scene_catalog.db'))
+
+
+def test_scenes_older_than_the_history_window_are_removed(catalog, monkeypatch):
+    monkeypatch.setattr(scene_catalog, '_fetch_scene_metadata', lambda bbox, start, end: [
+        scene('old', NOW_MS - 300 * DAY_MS), scene('recent', NOW_MS - 10 * DAY_MS)])
+    assert refresh_catalog(BBOX, NOW_MS) == 2
+
+    later_ms = NOW_MS + 100 * DAY_MS
+    monkeypatch.setattr(scene_catalog, '_fetch_scene_metadata', lambda bbox, start, end: [scene('new', later_ms - DAY_MS)])
+    refresh_catalog(BBOX, later_ms)
+
+    scenes = query_scenes(BBOX, 0, later_ms)
+    assert [s['scene_id'].rsplit('/', 1)[1] for s in scenes] == ['new', 'recent']
+    assert catalog.execute("SELECT COUNT(*) FROM scenes").fetchone()[0] == 2
+    assert catalog.execute("SELECT COUNT(*) FROM scene_index").fetchone()[0] == 2
+    assert catalog.execute("SELECT MIN(time_start) FROM scenes").fetchone()[0] >= later_ms - HISTORY_DAYS * DAY_MS
@@ -0,0 +1,19 @@
+import asyncio
+
+from src import tile_proxy
+
+
+def test_map_id_is_recreated_when_the_mosaic_day_rolls_over(monkeypatch):
+    created = []
+    monkeypatch.setattr(tile_proxy, '_create_map_id', lambda layer: created.append(layer) or {'mapid': len(created)})
+    monkeypatch.setattr(tile_proxy, '_map_ids', {})
+    monkeypatch.setattr(tile_proxy, '_map_id_lock', None)
+
+    async def map_ids():
+        return [await tile_proxy.get_map_id('ndvi', day) for day in ('2026-10-18', '2026-10-18', '2026-10-19')]
+
+    first, again, next_day = asyncio.run(map_ids())
+
+    assert again is first
+    assert next_day == {'mapid': 2}
+    assert created == ['ndvi', 'ndvi']
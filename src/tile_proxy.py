@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .startup import lazy_import
+from .cache import DiskLRUCache
+from .metrics import instrument, record_cache_lookup, QUEUE_DEPTH
+from .tracing import ee_round_trip
+from .circuit_breaker import guarded_call
+from .earth_engine import get_hls_mosaic_layers, RGB_VIS, NDVI_VIS
+from .settings import (CACHE_DIR, TILE_CACHE_MAX_BYTES, MAP_ID_TTL,
+                       MAX_CONCURRENT_TILE_FETCHES, TILE_FETCH_TIMEOUT)
+
+aiohttp = lazy_import('aiohttp')
+
+TILE_LAYERS = {
+    "rgb": RGB_VIS,
+    "ndvi": NDVI_VIS,
+}
+MAX_ZOOM = 20
+
+
+class TileFetchError(Exception):
+    pass
+
+
+tile_cache = DiskLRUCache(os.path.join(CACHE_DIR, 'tiles'), TILE_CACHE_MAX_BYTES)
+
+_session = None
+_fetch_semaphore: Optional[asyncio.Semaphore] = None
+_map_id_lock: Optional[asyncio.Lock] = None
+_map_ids = {}  # layer -> (map id dict, created timestamp, mosaic day)
+
+
+def get_session():
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_TILE_FETCHES, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=TILE_FETCH_TIMEOUT)
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+@instrument('getMapId')
+def _create_map_id(layer: str) -> dict:
+    rgb_image, ndvi_image = get_hls_mosaic_layers()
+    image = rgb_image if layer == "rgb" else ndvi_image
+    with ee_round_trip('getMapId', image, layer=layer) as ee_span:
+        return guarded_call(['hls'], ee_span, image.getMapId, TILE_LAYERS[layer])
+
+
+def mosaic_day() -> str:
+    return time.strftime('%Y-%m-%d')
+
+
+async def get_map_id(layer: str, day: str) -> dict:
+    # A map id only serves tiles cached under the mosaic day it was created on, so a new day's
+    # tiles never come from the previous day's mosaic, whatever is left of MAP_ID_TTL
+    global _map_id_lock
+    if _map_id_lock is None:
+        _map_id_lock = asyncio.Lock()
+
+    async with _map_id_lock:
+        cached = _map_ids.get(layer)
+        if cached and cached[2] == day and time.time() - cached[1] < MAP_ID_TTL:
+            record_cache_lookup('map_id', True)
+            return cached[0]
+        record_cache_lookup('map_id', False)
+
+        logging.info(f"Creating Earth Engine map ID for tile layer '{layer}' ({day})")
+        map_id = await run_in_threadpool(_create_map_id, layer)
+        _map_ids[layer] = (map_id, time.time(), day)
+        return map_id
+
+
+def invalidate_map_id(layer: str, map_id: dict):
+    # A map id whose tiles fail (an expired token, for one) is recreated by the next request rather than at MAP_ID_TTL
+    cached = _map_ids.get(layer)
+    if cached and cached[0] is map_id:
+        del _map_ids[layer]
+
+
+def tile_etag(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest() + '"'
+
+
+async def fetch_tile(layer: str, z: int, x: int, y: int) -> Tuple[bytes, str]:
+    global _fetch_semaphore
+    if _fetch_semaphore is None:
+        _fetch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TILE_FETCHES)
+
+    # Tiles are keyed per mosaic day so a new day's scenes are picked up
+    day = mosaic_day()
+    cache_key = f"{layer}/{day}/{z}/{x}/{y}"
+    data = await run_in_threadpool(tile_cache.get, cache_key)
+    if data is not None:
+        return data, tile_etag(data)
+
+    QUEUE_DEPTH.labels('tile_fetch').inc()
+    try:
+        await _fetch_semaphore.acquire()
+    finally:
+        QUEUE_DEPTH.labels('tile_fetch').dec()
+    try:
+        # Another request may have fetched the same tile while we were waiting
+        data = await run_in_threadpool(tile_cache.get, cache_key)
+        if data is not None:
+            return data, tile_etag(data)
+
+        map_id = await get_map_id(layer, day)
+        url = map_id['tile_fetcher'].format_tile_url(x, y, z)
+        try:
+            with instrument('fetch_tile_upstream'):
+                async with get_session().get(url) as response:
+                    if response.status != 200:
+                        invalidate_map_id(layer, map_id)
+                        raise TileFetchError(f"Earth Engine returned HTTP {response.status} for tile {z}/{x}/{y}")
+                    data = await response.read()
+        except aiohttp.ClientError as e:
+            invalidate_map_id(layer, map_id)
+            raise TileFetchError(f"Error fetching tile {z}/{x}/{y}: {str(e)}")
+        except asyncio.TimeoutError:
+            raise TileFetchError(f"Timed out fetching tile {z}/{x}/{y}")
+    finally:
+        _fetch_semaphore.release()
+
+    await run_in_threadpool(tile_cache.put, cache_key, data)
+    return data, tile_etag(data)
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence
+
+from .settings import TRACE_BUFFER_SIZE, TRACE_FILE, TRACE_EXPRESSION_SAMPLE_RATE
+
+LOAD_FUNCTIONS = ("Image.load", "ImageCollection.load", "Collection.loadTable")
+# Scrapes and trace reads would otherwise push real requests out of the ring buffer
+UNTRACED_PATHS = ("/metrics", "/debug/")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+_file_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "status",
+                 "start_time", "_start", "duration_ms", "children", "describe_expressions", "_lock")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        self.children = []
+        # Serializing every expression costs as much as building it, so only a sample of traces does it
+        self.describe_expressions = parent.describe_expressions if parent else random.random() < TRACE_EXPRESSION_SAMPLE_RATE
+        self._lock = threading.Lock()
+        if parent:
+            # Children can finish on threadpool threads while the parent is still open
+            with parent._lock:
+                parent.children.append(self)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None):
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    parent = _current_span.get()
+    new_span = Span(name, parent, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.end(e)
+        raise
+    else:
+        new_span.end()
+    finally:
+        _current_span.reset(token)
+        if parent is None:
+            _export(new_span)
+
+
+def _export(root: Span):
+    trace = {"trace_id": root.trace_id, **root.to_dict()}
+    _traces.append(trace)
+    if TRACE_FILE:
+        try:
+            with _file_lock, open(TRACE_FILE, "a") as f:
+                f.write(json.dumps(trace, default=str) + "\n")
+        except OSError as e:
+            logging.warning(f"Could not write trace to {TRACE_FILE}: {str(e)}")
+
+
+def _datasets(node: Any, found: List[str]):
+    if isinstance(node, dict):
+        invocation = node.get("functionInvocationValue")
+        if invocation and invocation.get("functionName") in LOAD_FUNCTIONS:
+            dataset = invocation.get("arguments", {}).get("id", {}).get("constantValue")
+            if dataset and dataset not in found:
+                found.append(dataset)
+        for value in node.values():
+            _datasets(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _datasets(value, found)
+
+
+def describe_expression(ee_object) -> Dict[str, Any]:
+    from ee import serializer
+
+    encoded = serializer.encode(ee_object, for_cloud_api=True)
+    datasets = []
+    _datasets(encoded, datasets)
+    return {"ee.expression_bytes": len(json.dumps(encoded)), "ee.datasets": datasets}
+
+
+@contextmanager
+def ee_round_trip(name: str, ee_object=None, **attributes):
+    # Span around one blocking Earth Engine request (getInfo, getThumbURL, computePixels, getMapId)
+    with span(name, kind="ee", **attributes) as ee_span:
+        if ee_object is not None and ee_span.describe_expressions:
+            try:
+                ee_span.attributes.update(describe_expression(ee_object))
+            except Exception as e:
+                ee_span.set_attribute("ee.describe_error", str(e))
+        yield ee_span
+
+
+def recent_traces(limit: int = 50, min_duration_ms: float = 0, name: Optional[str] = None) -> List[Dict[str, Any]]:
+    traces = [trace for trace in reversed(_traces)
+              if (trace["duration_ms"] or 0) >= min_duration_ms and (name is None or trace["name"] == name)]
+    return traces[:limit]
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    for trace in reversed(_traces):
+        if trace["trace_id"] == trace_id:
+            return trace
+    return None
+
+
+class TracingMiddleware:
+    # Root span per request; the route template is only known once routing has happened
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(UNTRACED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        with span(f"{scope['method']} {scope['path']}", kind="server", **{"http.method": scope["method"],
+                                                                          "http.target": scope["path"]}) as root:
+            async def tracing_send(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message["status"])
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", root.trace_id.encode("latin-1"))]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, tracing_send)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    root.name = f"{scope['method']} {route}"
+                    root.set_attribute("http.route", route)
+
+
+def traced_get_info(ee_object, label: str, datasets: Sequence[str]):
+    # `datasets` names the circuit breakers ('modis', 'hls', 'cmip6') the round-trip goes through
+    from .circuit_breaker import guarded_call
+
+    with ee_round_trip(f"getInfo {label}", ee_object) as ee_span:
+        return guarded_call(datasets, ee_span, ee_object.getInfo)
+
+
+def traced_thumb_url(image, params: Dict[str, Any], label: str, datasets: Sequence[str]) -> str:
+    from .circuit_breaker import guarded_call
+
+    with ee_round_trip(f"getThumbURL {label}", image) as ee_span:
+        return guarded_call(datasets, ee_span, image.getThumbURL, params)
@@ -0,0 +1,184 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .db import get_connection
+from .settings import DATA_DIR
+
+UPLOAD_DIR = os.path.join(DATA_DIR, 'uploads')
+UPLOAD_EXTENSIONS = ('.geojson', '.zip', '.gpkg', '.parquet')
+GEOMETRY_COLUMN = 'geometry'
+MAX_CACHED_UPLOADS = 4
+REGION_NAME_KEYS = ['NAME_1', 'name', 'NAME', 'Name', 'id', 'ID', 'Id', 'region', 'REGION', 'Region']
+
+# Shared by all worker processes, so "the last upload" is the same whichever worker serves the request
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id TEXT PRIMARY KEY,
+    filename TEXT,
+    regions INTEGER NOT NULL,
+    uploaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_uploaded_at ON uploads (uploaded_at);
+"""
+
+_upload_id_pattern = re.compile(r'^[0-9a-f]{20}$')
+_lock = threading.Lock()
+_loaded = OrderedDict()  # upload id -> Upload, most recently used last
+
+
+def name_keys(name_key: Optional[str] = None) -> List[str]:
+    return [name_key] + REGION_NAME_KEYS if name_key else list(REGION_NAME_KEYS)
+
+
+def is_supported_upload(filename: Optional[str]) -> bool:
+    return bool(filename) and filename.lower().endswith(UPLOAD_EXTENSIONS)
+
+
+class Upload:
+    # A stored upload: an Arrow table with one column per property and WKB geometries, memory-mapped from disk.
+    # Columns are converted to Python lists the first time they are needed
+    def __init__(self, upload_id: str, table):
+        self.id = upload_id
+        self.table = table
+        self.property_names = [name for name in table.column_names if name != GEOMETRY_COLUMN]
+        self._columns = {}
+        self._geometries = None
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def column(self, key: str) -> Optional[List[Any]]:
+        if key not in self.property_names:
+            return None
+        if key not in self._columns:
+            self._columns[key] = self.table.column(key).to_pylist()
+        return self._columns[key]
+
+    def geometries(self) -> np.ndarray:
+        import shapely
+
+        if self._geometries is None:
+            self._geometries = shapely.from_wkb(self.table.column(GEOMETRY_COLUMN).to_numpy(zero_copy_only=False))
+        return self._geometries
+
+    def name_values(self, keys: List[str]) -> List[Any]:
+        # Every region takes its name from the first name key that is a column, as with the old per-feature lookup
+        key = next((key for key in keys if key in self.property_names), None)
+        return self.column(key) if key else [None] * len(self)
+
+    def names(self, keys: List[str]) -> List[Any]:
+        return [f"Unnamed Region {i + 1}" if name is None else name for i, name in enumerate(self.name_values(keys))]
+
+    def ids(self) -> List[Any]:
+        primary = self.column('ID_1') or [None] * len(self)
+        fallback = self.column('id') or [None] * len(self)
+        return [a or b or i for i, (a, b) in enumerate(zip(primary, fallback))]
+
+    def properties(self, positions: List[int]) -> List[Dict[str, Any]]:
+        return self.table.select(self.property_names).take(positions).to_pylist()
+
+    def find(self, name: Any, keys: List[str]) -> Optional[int]:
+        return next((i for i, value in enumerate(self.name_values(keys)) if value == name), None)
+
+    def feature(self, position: int) -> Dict[str, Any]:
+        from shapely.geometry import mapping
+
+        geometry = self.geometries()[position]
+        return {
+            "type": "Feature",
+            "properties": self.properties([position])[0],
+            "geometry": mapping(geometry) if geometry is not None else None,
+        }
+
+
+def _read_zipped_shapefile(content: bytes):
+    import geopandas as gpd
+
+    with zipfile.ZipFile(io.BytesIO(content)) as archive, tempfile.TemporaryDirectory() as directory:
+        shapefiles = [name for name in archive.namelist() if name.lower().endswith('.shp')]
+        if len(shapefiles) != 1:
+            raise ValueError(f"A zip upload must contain exactly one .shp file, found {len(shapefiles)}.")
+        archive.extractall(directory)
+        return gpd.read_file(os.path.join(directory, shapefiles[0]))
+
+
+def read_upload(content: bytes, filename: str):
+    # geopandas is only needed on upload paths, so it is not imported at startup
+    import geopandas as gpd
+
+    name = filename.lower()
+    if name.endswith('.parquet'):
+        gdf = gpd.read_parquet(io.BytesIO(content))
+    elif name.endswith('.zip'):
+        gdf = _read_zipped_shapefile(content)
+    else:
+        gdf = gpd.read_file(io.BytesIO(content))
+
+    if gdf.crs and gdf.crs != "EPSG:4326":
+        gdf = gdf.to_crs("EPSG:4326")
+    if gdf.geometry.name != GEOMETRY_COLUMN:
+        gdf = gdf.rename_geometry(GEOMETRY_COLUMN)
+    return gdf
+
+
+def _open(upload_id: str, path: str) -> Upload:
+    import pyarrow.parquet as pq
+
+    upload = Upload(upload_id, pq.read_table(path, memory_map=True))
+    with _lock:
+        _loaded[upload_id] = upload
+        _loaded.move_to_end(upload_id)
+        while len(_loaded) > MAX_CACHED_UPLOADS:
+            _loaded.popitem(last=False)
+    return upload
+
+
+def _connect():
+    conn = get_connection('uploads')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def save_upload(content: bytes, gdf, filename: Optional[str] = None) -> Upload:
+    # Content-addressed, so re-uploading the same file reuses its id and everything cached for it
+    upload_id = hashlib.sha1(content).hexdigest()[:20]
+    path = os.path.join(UPLOAD_DIR, f"{upload_id}.parquet")
+    if not os.path.exists(path):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        gdf.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    with closing(_connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO uploads (upload_id, filename, regions, uploaded_at) VALUES (?, ?, ?, ?)",
+                     (upload_id, filename, len(gdf), time.time()))
+    return _open(upload_id, path)
+
+
+def last_upload_id() -> Optional[str]:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT upload_id FROM uploads ORDER BY uploaded_at DESC LIMIT 1").fetchone()
+    return row['upload_id'] if row else None
+
+
+def load_upload(upload_id: str) -> Optional[Upload]:
+    if not _upload_id_pattern.match(upload_id):
+        return None
+    with _lock:
+        if upload_id in _loaded:
+            _loaded.move_to_end(upload_id)
+            return _loaded[upload_id]
+    path = os.path.join(UPLOAD_DIR, f"{upload_id}.parquet")
+    if not os.path.exists(path):
+        return None
+    return _open(upload_id, path)
@@ -1,38 +1,96 @@
-import ee
+from __future__ import annotations
+
 from typing import List, Dict, Any
 from fastapi import HTTPException
 
+from .startup import lazy_import
+from .metrics import instrument
+from .tracing import traced_get_info
+
+ee = lazy_import('ee')
+
+def weather_collection(aoi: ee.Geometry, start_date: str, end_date: str):
+    collection = ee.ImageCollection('NASA/GDDP-CMIP6') \
+        .filterDate(start_date, end_date) \
+        .filterBounds(aoi)
+    
+    def calc_stats(image):
+        stats = image.reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=aoi,
+            scale=27830,  # approximate scale for CMIP6 data
+            maxPixels=1e9
+        )
+        return ee.Feature(None, {
+            'date': image.date().format('YYYY-MM-dd'),
+            'temperature': stats.get('tas'),
+            'precipitation': stats.get('pr')
+        })
+
+    return collection.map(calc_stats)
+
+@instrument('analyze_weather')
 def analyze_weather(aoi: ee.Geometry, start_date: str, end_date: str, parameters: List[str]) -> List[Dict[str, Any]]:
     try:
-        collection = ee.ImageCollection('NASA/GDDP-CMIP6') \
-            .filterDate(start_date, end_date) \
-            .filterBounds(aoi)
-        
-        def calc_stats(image):
-            stats = image.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=aoi,
-                scale=27830,  # approximate scale for CMIP6 data
-                maxPixels=1e9
-            )
-            return ee.Feature(None, {
-                'date': image.date().format('YYYY-MM-dd'),
-                'temperature': stats.get('tas'),
-                'precipitation': stats.get('pr')
-            })
-
-        stats = collection.map(calc_stats).getInfo()
+        stats = traced_get_info(weather_collection(aoi, start_date, end_date), 'weather', ['cmip6'])
         return stats['features']
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing weather: {str(e)}")
 
-def detect_drought(precipitation_data: List[Dict[str, Any]]) -> str:
-    if not precipitation_data:
-        return "Insufficient data for drought analysis"
+@instrument('analyze_weather_columns')
+def analyze_weather_columns(aoi: ee.Geometry, start_date: str, end_date: str, parameters: List[str]) -> Dict[str, List[Any]]:
+    try:
+        # Parallel lists straight from Earth Engine instead of one dict per feature
+        columns = weather_collection(aoi, start_date, end_date) \
+            .filter(ee.Filter.notNull(['temperature', 'precipitation'])) \
+            .reduceColumns(ee.Reducer.toList().repeat(3), ['date', 'temperature', 'precipitation']) \
+            .get('list')
+        dates, temperature, precipitation = traced_get_info(columns, 'weather_columns', ['cmip6'])
+        return {'date': dates, 'temperature': temperature, 'precipitation': precipitation}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analyzing weather: {str(e)}")
+
+@instrument('analyze_weather_batch')
+def analyze_weather_batch(fields: ee.FeatureCollection, start_date: str, end_date: str,
+                          model: str, scenario: str) -> Dict[str, Dict[str, List[float]]]:
+    # One model run, so the result is one value per field and day rather than per field, day, model and scenario
+    collection = ee.ImageCollection('NASA/GDDP-CMIP6') \
+        .filterDate(start_date, end_date) \
+        .filter(ee.Filter.eq('model', model)) \
+        .filter(ee.Filter.eq('scenario', scenario)) \
+        .filterBounds(fields.geometry())
+
+    def calc_stats(image):
+        return image.select(['tas', 'pr']).reduceRegions(
+            collection=fields,
+            reducer=ee.Reducer.mean(),
+            scale=27830  # approximate scale for CMIP6 data
+        ).map(lambda feature: feature.set('time_start', image.get('system:time_start')))
+
+    keys = ['field_id', 'tas', 'pr']
+    columns = collection.map(calc_stats).flatten() \
+        .filter(ee.Filter.notNull(keys)) \
+        .sort('time_start') \
+        .reduceColumns(ee.Reducer.toList().repeat(len(keys)), keys) \
+        .get('list')
+    field_ids, temperature, precipitation = traced_get_info(columns, 'weather_batch', ['cmip6'])
+
+    weather = {}
+    for field_id, temp, precip in zip(field_ids, temperature, precipitation):
+        values = weather.setdefault(field_id, {'temperature': [], 'precipitation': []})
+        values['temperature'].append(temp)
+        values['precipitation'].append(precip * 86400)  # Convert to mm/day
+    return weather
 
+def detect_drought(precipitation_data: List[Dict[str, Any]]) -> str:
     # Convert precipitation from kg/m^2/s to mm/day
     precip_values = [feature['properties']['precipitation'] * 86400 for feature in precipitation_data]
-    
+    return detect_drought_from_values(precip_values)
+
+def detect_drought_from_values(precip_values: List[float]) -> str:
+    if not len(precip_values):
+        return "Insufficient data for drought analysis"
+
     mean_precip = sum(precip_values) / len(precip_values)
     if mean_precip == 0:
         return "Extreme drought conditions"
@@ -56,34 +114,40 @@ def detect_drought(precipitation_data: List[Dict[str, Any]]) -> str:
     else:
         return "No drought"
 
+def summarize_climate(temp_values: List[float], precip_values: List[float]) -> Dict[str, Any]:
+    # temp_values in Kelvin, precip_values in mm/day
+    drought_status = detect_drought_from_values(precip_values)
+
+    climate_summary = {
+        "average_temperature": sum(temp_values) / len(temp_values) - 273.15,  # Convert from Kelvin to Celsius
+        "total_precipitation": sum(precip_values),
+    }
+
+    # Calculate climate trends
+    temp_trend = "Increasing" if temp_values[-1] > temp_values[0] else "Decreasing"
+    precip_trend = "Increasing" if precip_values[-1] > precip_values[0] else "Decreasing"
+
+    climate_trends = {
+        "temperature_trend": temp_trend,
+        "precipitation_trend": precip_trend,
+    }
+
+    return {
+        "drought_status": drought_status,
+        "climate_summary": climate_summary,
+        "climate_trends": climate_trends
+    }
+
 def analyze_climate(aoi: ee.Geometry, start_date: str, end_date: str, parameters: List[str]) -> Dict[str, Any]:
     try:
         weather_data = analyze_weather(aoi, start_date, end_date, parameters)
-        drought_status = detect_drought(weather_data)
         
-        # Calculate climate summary
         temp_values = [feature['properties']['temperature'] for feature in weather_data]
         precip_values = [feature['properties']['precipitation'] * 86400 for feature in weather_data]  # Convert to mm/day
 
-        climate_summary = {
-            "average_temperature": sum(temp_values) / len(temp_values) - 273.15,  # Convert from Kelvin to Celsius
-            "total_precipitation": sum(precip_values),
-        }
-
-        # Calculate climate trends
-        temp_trend = "Increasing" if temp_values[-1] > temp_values[0] else "Decreasing"
-        precip_trend = "Increasing" if precip_values[-1] > precip_values[0] else "Decreasing"
-
-        climate_trends = {
-            "temperature_trend": temp_trend,
-            "precipitation_trend": precip_trend,
-        }
-
         return {
             "weather_data": weather_data,
-            "drought_status": drought_status,
-            "climate_summary": climate_summary,
-            "climate_trends": climate_trends
+            **summarize_climate(temp_values, precip_values)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing climate: {str(e)}")
\ No newline at end of file